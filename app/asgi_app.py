@@ -0,0 +1,174 @@
+from pathlib import Path
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+from telebot.async_telebot import AsyncTeleBot
+from bot import bot, firebase_manager, payment_manager, get_bot_info, start_broadcast_watchdog
+from config import (BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, UPDATE_WORKERS, UPDATE_QUEUE_SIZE,
+                    UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_SHARED)
+from update_queue import UpdateQueue
+from update_dedup import UpdateDeduplicator
+from scheduler import start_scheduler
+import telebot
+import logging
+
+# Асинхронный режим сервера: uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+# Обработчики бота остаются синхронными и выполняются в пуле UpdateQueue,
+# а обращения к хранилищу из маршрутов вынесены в пул потоков Starlette.
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+templates = Jinja2Templates(directory=str(BASE_DIR / 'templates'))
+
+# Асинхронный клиент Telegram для исходящих вызовов из маршрутов
+async_bot = AsyncTeleBot(BOT_TOKEN)
+
+update_queue = UpdateQueue(bot.process_new_updates, workers=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE)
+update_dedup = UpdateDeduplicator(
+    window_seconds=UPDATE_DEDUP_WINDOW,
+    shared_store=firebase_manager if UPDATE_DEDUP_SHARED else None
+)
+
+
+async def index(request):
+    """Корневой маршрут"""
+    return PlainTextResponse("WB Review Bot is running!")
+
+
+async def status(request):
+    """Проверка статуса сервера"""
+    try:
+        bot_info = await run_in_threadpool(get_bot_info)
+        return JSONResponse({
+            'status': 'ok',
+            'bot_username': bot_info.username,
+            'server': 'running',
+            'mode': 'asgi',
+            'bot_token_length': len(BOT_TOKEN),
+            'webhook_host': WEBHOOK_HOST,
+            'update_queue': update_queue.get_metrics(),
+            'update_dedup': update_dedup.get_metrics()
+        })
+    except Exception as e:
+        logger.error(f"Status check error: {str(e)}")
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=500)
+
+
+async def metrics(request):
+    """Метрики очереди апдейтов"""
+    return JSONResponse({
+        'update_queue': update_queue.get_metrics(),
+        'update_dedup': update_dedup.get_metrics()
+    })
+
+
+async def webhook(request):
+    if request.headers.get('content-type') != 'application/json':
+        return JSONResponse({'status': 'error', 'message': 'Invalid content type'})
+
+    update = telebot.types.Update.de_json((await request.body()).decode('utf-8'))
+    if update_queue.is_full():
+        # Telegram повторит доставку позже
+        return JSONResponse({'status': 'busy'}, status_code=503)
+
+    if update_dedup.shared_store is not None:
+        is_new = await run_in_threadpool(update_dedup.is_new, update.update_id)
+    else:
+        is_new = update_dedup.is_new(update.update_id)
+    if not is_new:
+        return JSONResponse({'status': 'ok'})
+
+    if not update_queue.put(update):
+        if update_dedup.shared_store is not None:
+            await run_in_threadpool(update_dedup.forget, update.update_id)
+        else:
+            update_dedup.forget(update.update_id)
+        return JSONResponse({'status': 'busy'}, status_code=503)
+    return JSONResponse({'status': 'ok'})
+
+
+async def payment_webhook(request):
+    """Обработка уведомлений об оплате"""
+    try:
+        notification_data = await request.json()
+        is_valid, user_id = payment_manager.verify_payment(notification_data)
+
+        if is_valid and user_id:
+            await run_in_threadpool(firebase_manager.add_attempts, user_id)
+            await async_bot.send_message(
+                user_id,
+                "✅ Оплата успешно получена!\n"
+                "Вам начислено 10 новых попыток анализа."
+            )
+            return JSONResponse({'status': 'success'})
+
+        return JSONResponse({'status': 'invalid_payment'}, status_code=400)
+
+    except Exception as e:
+        logger.error(f"Error processing payment webhook: {str(e)}")
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=500)
+
+
+async def payment_success(request):
+    user_id = request.query_params.get('userId')
+    label = request.query_params.get('label')
+
+    logger.info(f"Payment webhook called: userId={user_id}, label={label}")
+
+    if user_id and label and label.startswith('wb_review_bot_'):
+        try:
+            # Извлекаем информацию о плане из метки
+            parts = label.split('_')
+            if len(parts) >= 4:
+                user_id = int(parts[3])
+                plan = parts[4] if len(parts) >= 5 else 'basic'
+                attempts = payment_manager.plans.get(plan, {}).get('attempts', 10)
+                amount = payment_manager.plans.get(plan, {}).get('amount', 50)
+
+                await run_in_threadpool(firebase_manager.add_attempts, user_id, attempts)
+                await run_in_threadpool(firebase_manager.record_payment, user_id, amount, plan)
+
+                logger.info(f"Payment successful: User {user_id}, Plan {plan}, Attempts {attempts}")
+
+                try:
+                    await async_bot.send_message(
+                        user_id,
+                        f"✅ Оплата успешно выполнена!\n\n"
+                        f"Вам начислено {attempts} попыток анализа.\n"
+                        f"Спасибо за поддержку бота!"
+                    )
+                except Exception as e:
+                    logger.error(f"Error sending payment notification: {str(e)}")
+
+                bot_info = await run_in_threadpool(get_bot_info)
+                return templates.TemplateResponse(
+                    'payment_success.html',
+                    {'request': request, 'bot_username': bot_info.username}
+                )
+
+        except Exception as e:
+            logger.error(f"Error processing payment: {str(e)}")
+            return templates.TemplateResponse('error.html', {'request': request, 'error': str(e)})
+
+    return JSONResponse({'status': 'error', 'message': 'Invalid payment data'})
+
+
+async def warm_up_bot_info():
+    """Получаем данные бота при старте, дальше они берутся из кэша"""
+    try:
+        await run_in_threadpool(get_bot_info)
+    except Exception as e:
+        logger.error(f"Error fetching bot info at startup: {str(e)}")
+
+
+app = Starlette(routes=[
+    Route('/', index),
+    Route('/status', status),
+    Route('/metrics', metrics),
+    Route(WEBHOOK_PATH, webhook, methods=['POST']),
+    Route('/webhook/payment', payment_webhook, methods=['POST']),
+    Route('/webhook/payment-success', payment_success, methods=['GET']),
+], on_startup=[warm_up_bot_info, start_broadcast_watchdog, start_scheduler])
@@ -0,0 +1,100 @@
+import argparse
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from logging_config import JsonFormatter, LazyQueueHandler, RedactingFilter
+
+# Замер накладных расходов логирования в потоке, который пишет лог:
+#
+#   python benchmark_logging.py -n 20000 --repeat 5
+#   python benchmark_logging.py --output app.log     # запись в файл вместо os.devnull
+#   python benchmark_logging.py --write-delay-ms 0.1 # медленный приемник логов (stdout в pipe)
+#
+# sync - форматирование, маскирование токена и запись выполняет вызывающий поток
+# (обычный StreamHandler), queue - как в setup_logging: вызывающий поток только
+# кладет запись в очередь, остальное делает поток QueueListener. record - запись
+# отбрасывается (NullHandler): нижняя граница, создание LogRecord в модуле logging.
+# caller_us - время одного вызова logger.info в вызывающем потоке,
+# total_us - с учетом ожидания, пока весь лог будет выведен.
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class SlowStream:
+    """Поток вывода, каждая запись в который блокируется на delay секунд"""
+
+    def __init__(self, stream, delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def build_output(stream, log_format: str) -> logging.Handler:
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    output.addFilter(RedactingFilter())
+    return output
+
+
+def measure(mode: str, log_format: str, count: int, stream) -> tuple:
+    logger = logging.getLogger(f"benchmark.{mode}.{log_format}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    output = build_output(stream, log_format)
+    listener = None
+    if mode == 'record':
+        logger.addHandler(logging.NullHandler())
+    elif mode == 'queue':
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(LazyQueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        listener.start()
+    else:
+        logger.addHandler(output)
+
+    started = time.perf_counter()
+    for index in range(count):
+        logger.info("Processed update %s for user %s", index, 100000 + index % 1000, extra={'update_id': index})
+    caller = time.perf_counter() - started
+    if listener:
+        # stop() дожидается вывода всех записей из очереди
+        listener.stop()
+    total = time.perf_counter() - started
+
+    logger.handlers.clear()
+    stream.flush()
+    return caller, total
+
+
+def run(count: int, repeat: int, log_format: str, output: str, write_delay_ms: float = 0) -> dict:
+    result = {'records': count, 'format': log_format, 'write_delay_ms': write_delay_ms}
+    with open(output, 'w', encoding='utf-8') as file:
+        stream = SlowStream(file, write_delay_ms / 1000) if write_delay_ms else file
+        for mode in ('record', 'sync', 'queue'):
+            timings = sorted(measure(mode, log_format, count, stream) for _ in range(repeat))
+            caller, total = timings[len(timings) // 2]
+            result[f"{mode}_caller_us"] = round(caller / count * 1e6, 2)
+            result[f"{mode}_total_us"] = round(total / count * 1e6, 2)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер накладных расходов логирования через очередь')
+    parser.add_argument('-n', '--records', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=os.devnull, help='Куда выводить лог (по умолчанию os.devnull)')
+    parser.add_argument('--write-delay-ms', type=float, default=0, help='Задержка каждой записи в вывод')
+    args = parser.parse_args()
+
+    results = [run(args.records, args.repeat, log_format, args.output, args.write_delay_ms)
+               for log_format in ('text', 'json')]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
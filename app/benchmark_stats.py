@@ -0,0 +1,63 @@
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from review_stats import compute_review_stats, WB_DATE_FORMAT
+
+# Замер статистики оценок на синтетическом ответе feedbacks.wb.ru:
+#
+#   python benchmark_stats.py -n 10000 50000 --repeat 20
+#
+# Для сравнения выводится время разбора того же ответа json.loads - его бот
+# выполняет при загрузке отзывов в любом случае.
+
+
+def build_payload(count: int, sku: int = 12345678, siblings: int = 3) -> bytes:
+    rng = random.Random(count)
+    now = datetime.now(timezone.utc)
+    feedbacks = []
+    for index in range(count):
+        created = now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+        feedbacks.append({
+            'id': f"fb{index:08d}",
+            'nmId': sku + index % siblings,
+            'text': "Отзыв покупателя " * rng.randrange(1, 20),
+            'productValuation': rng.choices((1, 2, 3, 4, 5), weights=(5, 4, 8, 20, 63))[0],
+            'createdDate': created.strftime(WB_DATE_FORMAT),
+            'photo': [rng.randrange(10 ** 9)] if rng.random() < 0.2 else None
+        })
+    return json.dumps({'feedbacks': feedbacks}, ensure_ascii=False).encode('utf-8')
+
+
+def measure(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return round(sorted(timings)[len(timings) // 2] * 1000, 2)
+
+
+def run(count: int, repeat: int) -> dict:
+    payload = build_payload(count)
+    feedbacks = json.loads(payload)['feedbacks']
+    stats = compute_review_stats(feedbacks, sku='12345678')
+    return {
+        'reviews': count,
+        'payload_kb': len(payload) // 1024,
+        'json_loads_ms': measure(lambda: json.loads(payload), repeat),
+        'stats_all_ms': measure(lambda: compute_review_stats(feedbacks), repeat),
+        'stats_sku_ms': measure(lambda: compute_review_stats(feedbacks, sku='12345678'), repeat),
+        'sku_reviews': stats['count'],
+        'average': round(stats['average'], 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер статистики оценок отзывов')
+    parser.add_argument('-n', '--reviews', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print(json.dumps([run(count, args.repeat) for count in args.reviews], ensure_ascii=False, indent=2))
@@ -1,32 +1,97 @@
 import telebot
+import csv
+import io
 import json
 import requests
 import re
 import g4f
 from telebot import types
-from firebase_manager import FirebaseManager
+from storage import create_storage_manager
 from payment_manager import PaymentManager
-from config import BOT_TOKEN
+from config import (BOT_TOKEN, ANALYSIS_FRESHNESS_HOURS, BROADCAST_RATE, BROADCAST_WORKERS, SEARCH_CACHE_TTL,
+                    SEARCH_PREFETCH, PRECOMPUTE_WORKERS, PRECOMPUTE_MAX_PENDING, COMPARE_MAX_PRODUCTS,
+                    COMPARE_WORKERS, BATCH_MAX_SKUS, BATCH_WORKERS, BATCH_LLM_WORKERS, WATCH_MAX_PER_USER,
+                    WATCH_NEGATIVE_RATING, HISTORY_PATH)
+from broadcast import RateLimitedSender, BroadcastJob, JOB_LOST
+from price_history import PriceHistory
+from review_stats import compute_review_stats
 import logging
+from logging_config import setup_logging
+from cache import LRUCache, TTLCache
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from functools import lru_cache
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import socket
+import threading
+import time
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+setup_logging()
 
-# Инициализация бота
-bot = telebot.TeleBot(BOT_TOKEN)
+# Включаем middleware для учета активности пользователей
+telebot.apihelper.ENABLE_MIDDLEWARE = True
+
+# Инициализация бота (апдейты webhook обрабатываются пулом из update_queue)
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
 
 # Инициализация менеджеров
-firebase_manager = FirebaseManager()
+firebase_manager = create_storage_manager()
 payment_manager = PaymentManager()
+price_history = PriceHistory(HISTORY_PATH)
 
 # Список ID администраторов
 ADMIN_IDS = [1312244058]  # Убедитесь, что это ваш ID
 
+# Как часто обновлять last_activity одного пользователя в базе
+ACTIVITY_TOUCH_INTERVAL = timedelta(hours=1)
+# Пользователи, чья активность записана за последний ACTIVITY_TOUCH_INTERVAL; при переполнении
+# вытесняются давно писавшие - для них будет лишь одно лишнее обновление в базе
+_activity_touched = TTLCache(maxsize=100000, ttl=ACTIVITY_TOUCH_INTERVAL.total_seconds())
+
+@bot.middleware_handler(update_types=['message', 'callback_query', 'inline_query'])
+def track_user_activity(bot_instance, update):
+    """Обновление last_activity не чаще раза в ACTIVITY_TOUCH_INTERVAL"""
+    user = getattr(update, 'from_user', None)
+    if not user:
+        return
+    
+    if user.id in _activity_touched:
+        return
+    
+    _activity_touched.set(user.id, True)
+    try:
+        firebase_manager.touch_user(user.id)
+    except Exception as e:
+        logger.error(f"Error updating activity for user {user.id}: {str(e)}")
+
+# Данные бота (get_me) запрашиваются один раз и обновляются раз в сутки
+BOT_INFO_TTL = timedelta(hours=24)
+_bot_info = None
+_bot_info_fetched_at = None
+_bot_info_lock = threading.Lock()
+
+def get_bot_info(refresh: bool = False):
+    """Кэшированный результат bot.get_me() вместо запроса к Telegram на каждый вызов"""
+    global _bot_info, _bot_info_fetched_at
+    
+    if not refresh and _bot_info and datetime.now() - _bot_info_fetched_at < BOT_INFO_TTL:
+        return _bot_info
+    
+    with _bot_info_lock:
+        if not refresh and _bot_info and datetime.now() - _bot_info_fetched_at < BOT_INFO_TTL:
+            return _bot_info
+        try:
+            _bot_info = bot.get_me()
+            _bot_info_fetched_at = datetime.now()
+        except Exception as e:
+            # Если Telegram недоступен, продолжаем работать с прежними данными
+            if not _bot_info:
+                raise
+            logger.error(f"Error refreshing bot info: {str(e)}")
+    return _bot_info
+
 # Словари с переводами
 TRANSLATIONS = {
     'ru': {
@@ -57,13 +122,18 @@ TRANSLATIONS = {
     }
 }
 
+WB_CARD_URL = 'https://card.wb.ru/cards/v2/detail?appType=1&curr=rub&dest=-8144334&spp=30&nm={}'
+
 class WbReview:
-    def __init__(self, string: str):
+    def __init__(self, string: str, item_name: str = None, root_id=None):
         self.sku = self.get_sku(string=string)
-        self.item_name = None  # Инициализируем как None
-        self.root_id = None
-        # Получаем root_id и item_name
-        self.get_root_id()
+        self.item_name = item_name
+        self.root_id = root_id
+        # Карточка товара card.wb.ru (цена, рейтинг, число отзывов)
+        self.card = None
+        # Получаем root_id и item_name, если карточка не загружена заранее
+        if not self.root_id:
+            self.get_root_id()
 
     @staticmethod
     def get_sku(string: str) -> str:
@@ -81,7 +151,7 @@ class WbReview:
         """Получение id родителя и названия товара"""
         try:
             response = requests.get(
-                f'https://card.wb.ru/cards/v2/detail?appType=1&curr=rub&dest=-8144334&spp=30&nm={self.sku}',
+                WB_CARD_URL.format(self.sku),
                 headers={'User-Agent': 'Mozilla/5.0'},
             )
             if response.status_code != 200:
@@ -92,6 +162,7 @@ class WbReview:
                 raise Exception("Товар не найден")
             
             product = data["data"]["products"][0]
+            self.card = product
             self.item_name = product.get("name", "Название не найдено")
             self.root_id = product.get("root")
             if not self.root_id:
@@ -119,8 +190,10 @@ class WbReview:
             if response.status_code == 200:
                 return response.json()
 
-    def parse(self):
-        json_feedbacks = self.get_review()
+    def parse(self, json_feedbacks=None):
+        """Отзывы этого артикула; json_feedbacks - уже загруженные отзывы того же root_id"""
+        if json_feedbacks is None:
+            json_feedbacks = self.get_review()
         if not json_feedbacks:
             return []
         
@@ -137,6 +210,29 @@ class WbReview:
         
         return feedbacks
 
+def card_snapshot(product):
+    """Цена в копейках, рейтинг и число отзывов из карточки card.wb.ru"""
+    price = None
+    for size in product.get('sizes') or []:
+        price = (size.get('price') or {}).get('product')
+        if price:
+            break
+    return (
+        price or product.get('salePriceU'),
+        product.get('reviewRating') or product.get('rating'),
+        product.get('feedbacks')
+    )
+
+def record_price_history(products):
+    """Запись цены и рейтинга в локальную историю: sku -> карточка card.wb.ru"""
+    try:
+        price_history.record_many({sku: card_snapshot(product) for sku, product in products.items() if product})
+    except Exception as e:
+        logger.error(f"Error recording price history: {str(e)}")
+
+# Текст ответа при ошибке LLM - такие результаты не попадают в общее хранилище
+ANALYSIS_FAILED_TEXT = "Не удалось проанализировать отзывы. Попробуйте позже."
+
 @lru_cache(maxsize=100)
 def analyze_reviews_cached(sku, reviews_text):
     """Кэшированная функция для анализа отзывов"""
@@ -161,27 +257,188 @@ def analyze_reviews_cached(sku, reviews_text):
         💡 Общий вывод: краткое заключение о товаре
         """
         
-        # Используем альтернативный провайдер
-        try:
-            # Сначала пробуем gpt-4
-            response = g4f.ChatCompletion.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                provider=g4f.Provider.Bing,
-            )
-        except Exception as e:
-            logger.warning(f"Error with gpt-4: {str(e)}. Trying gpt-3.5-turbo...")
-            # Если не получилось, используем gpt-3.5-turbo
-            response = g4f.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                provider=g4f.Provider.OpenaiChat,
-            )
-        
-        return response
+        return ask_llm(prompt)
     except Exception as e:
         logger.error(f"Error analyzing reviews: {str(e)}")
-        return "Не удалось проанализировать отзывы. Попробуйте позже."
+        return ANALYSIS_FAILED_TEXT
+
+def ask_llm(prompt):
+    """Запрос к LLM: gpt-4, при ошибке - gpt-3.5-turbo"""
+    # Используем альтернативный провайдер
+    try:
+        # Сначала пробуем gpt-4
+        return g4f.ChatCompletion.create(
+            model="gpt-4",
+            messages=[{"role": "user", "content": prompt}],
+            provider=g4f.Provider.Bing,
+        )
+    except Exception as e:
+        logger.warning(f"Error with gpt-4: {str(e)}. Trying gpt-3.5-turbo...")
+        # Если не получилось, используем gpt-3.5-turbo
+        return g4f.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}],
+            provider=g4f.Provider.OpenaiChat,
+        )
+
+# Сколько отзывов всех товаров вместе попадает в сравнительный запрос
+COMPARISON_REVIEWS_TOTAL = 80
+
+@lru_cache(maxsize=100)
+def compare_reviews_cached(products):
+    """Один сравнительный запрос к LLM по материалам товаров: кортеж (название, отзывы или готовый анализ)"""
+    try:
+        products_text = "\n\n".join(
+            f"Товар {i}: {name}\n{material}" for i, (name, material) in enumerate(products, 1)
+        )
+        prompt = f"""
+        Сравни товары с Wildberries по отзывам покупателей.
+        
+        {products_text}
+        
+        Формат ответа (для каждого товара по порядку):
+        Товар N
+        ✅ Плюсы: ...
+        ❌ Минусы: ...
+        
+        ⚖️ Сравнение: чем товары отличаются по мнению покупателей
+        
+        💡 Вывод: какой товар и кому лучше выбрать
+        """
+        
+        return ask_llm(prompt)
+    except Exception as e:
+        logger.error(f"Error comparing reviews: {str(e)}")
+        return ANALYSIS_FAILED_TEXT
+
+# Готовые анализы по артикулу в памяти процесса: {'item_name', 'analysis_text'}
+_analysis_cache = TTLCache(maxsize=500, ttl=ANALYSIS_FRESHNESS_HOURS * 3600)
+
+# Статистика оценок по артикулу (считается по уже загруженным отзывам), только в памяти процесса
+_review_stats_cache = TTLCache(maxsize=500, ttl=ANALYSIS_FRESHNESS_HOURS * 3600)
+
+# Анализы, посчитанные заранее (без запроса пользователя), сохраняются от имени системного пользователя
+SYSTEM_USER_ID = 0
+_precompute_executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix='precompute')
+# Поставленные расчеты: sku -> Future
+_precompute_in_flight = {}
+_precompute_lock = threading.Lock()
+
+def get_cached_analysis(sku):
+    """Готовый анализ артикула из памяти процесса или свежий анализ из общего хранилища"""
+    cached = _analysis_cache.get(sku)
+    if cached:
+        return cached
+    
+    try:
+        shared_analysis = firebase_manager.get_fresh_analysis(sku, ANALYSIS_FRESHNESS_HOURS)
+    except Exception as e:
+        logger.error(f"Error reading shared analysis for SKU {sku}: {str(e)}")
+        return None
+    
+    if not shared_analysis or not shared_analysis.get('analysis_text'):
+        return None
+    cached = {'item_name': shared_analysis.get('item_name'), 'analysis_text': shared_analysis['analysis_text']}
+    _analysis_cache.set(sku, cached)
+    return cached
+
+def get_product_analysis(text):
+    """Анализ товара: сначала готовый анализ этого артикула, затем WB и LLM"""
+    sku = WbReview.get_sku(text)
+    
+    cached = get_cached_analysis(sku)
+    if cached:
+        logger.info(f"Serving cached analysis for SKU {sku}")
+        return sku, cached['item_name'], cached['analysis_text']
+    
+    # Фоновый расчет этого артикула: уже идущий дожидаемся, ожидающий в очереди отменяем
+    with _precompute_lock:
+        future = _precompute_in_flight.get(sku)
+    if future is not None and not future.cancel():
+        future.result()
+        cached = _analysis_cache.get(sku)
+        if cached:
+            return sku, cached['item_name'], cached['analysis_text']
+    
+    return compute_product_analysis(text)
+
+def compute_product_analysis(text):
+    """Анализ товара по свежим отзывам WB"""
+    review_handler = WbReview(text)
+    record_price_history({review_handler.sku: review_handler.card})
+    json_feedbacks = review_handler.get_review()
+    store_review_stats(review_handler.sku, json_feedbacks)
+    reviews = review_handler.parse(json_feedbacks or {})
+    if not reviews:
+        return review_handler.sku, review_handler.item_name, None
+    
+    analysis = analyze_product_reviews(review_handler.sku, review_handler.item_name, reviews)
+    return review_handler.sku, review_handler.item_name, analysis
+
+def store_review_stats(sku, json_feedbacks):
+    """Статистика оценок артикула по загруженному ответу WB"""
+    try:
+        stats = compute_review_stats((json_feedbacks or {}).get('feedbacks') or [], sku)
+    except Exception as e:
+        logger.error(f"Error computing review stats for SKU {sku}: {str(e)}")
+        return
+    if stats:
+        _review_stats_cache.set(sku, stats)
+
+def analyze_product_reviews(sku, item_name, reviews):
+    """Анализ загруженных отзывов; удачный результат попадает в кэш процесса"""
+    # Преобразуем список отзывов в строку для кэширования
+    reviews_text = "\n".join(reviews)
+    analysis = analyze_reviews_cached(sku, reviews_text)
+    if analysis and analysis != ANALYSIS_FAILED_TEXT:
+        _analysis_cache.set(sku, {'item_name': item_name, 'analysis_text': analysis})
+    return analysis
+
+def precompute_analysis(sku):
+    """Фоновый расчет анализа артикула с сохранением в общее хранилище"""
+    try:
+        if get_cached_analysis(sku):
+            return
+        sku, item_name, analysis = compute_product_analysis(sku)
+        if analysis and analysis != ANALYSIS_FAILED_TEXT:
+            firebase_manager.save_analysis(SYSTEM_USER_ID, sku, item_name, analysis)
+            logger.info(f"Precomputed analysis for SKU {sku}")
+    except Exception as e:
+        logger.warning(f"Analysis precompute failed for SKU {sku}: {str(e)}")
+    finally:
+        with _precompute_lock:
+            _precompute_in_flight.pop(sku, None)
+
+def schedule_analysis_precompute(sku):
+    """Постановка фонового расчета анализа; повторные запросы того же артикула не дублируются
+
+    Одновременно выполняется не больше PRECOMPUTE_WORKERS расчетов, а в очереди
+    ждет не больше PRECOMPUTE_MAX_PENDING - лишние запросы отбрасываются.
+    """
+    with _precompute_lock:
+        if sku in _precompute_in_flight or len(_precompute_in_flight) >= PRECOMPUTE_MAX_PENDING:
+            return False
+        future = _precompute_executor.submit(precompute_analysis, sku)
+        _precompute_in_flight[sku] = future
+    
+    def forget_cancelled(done):
+        # Отмененный расчет не выполнит finally в precompute_analysis
+        if done.cancelled():
+            with _precompute_lock:
+                _precompute_in_flight.pop(sku, None)
+    
+    future.add_done_callback(forget_cancelled)
+    return True
+
+def save_analysis_result(user_id, sku, item_name, analysis):
+    """Сохранение анализа в историю пользователя (неудачные анализы не сохраняются)"""
+    if analysis and analysis != ANALYSIS_FAILED_TEXT:
+        firebase_manager.save_analysis(user_id, sku, item_name, analysis)
+        # Счетчик популярности артикула для прогрева кэша
+        try:
+            firebase_manager.increment_sku_requests(sku)
+        except Exception as e:
+            logger.error(f"Error counting request for SKU {sku}: {str(e)}")
 
 def get_user_language(user_id):
     """Получает язык пользователя из базы данных"""
@@ -214,6 +471,13 @@ def send_welcome(message):
         except Exception as e:
             logging.error(f"Error processing referral: {str(e)}")
     
+    # Ссылка из inline-режима: сразу показываем анализ товара
+    if len(text.split()) > 1 and text.split()[1].startswith('analyze_'):
+        sku = text.split()[1][len('analyze_'):]
+        if sku.isdigit():
+            process_article_number(message, sku)
+            return
+    
     # Создаем клавиатуру с основными функциями
     markup = types.InlineKeyboardMarkup(row_width=2)
     
@@ -261,7 +525,7 @@ def send_stats(message):
 @bot.message_handler(commands=['refer'])
 def send_referral(message):
     user_id = message.from_user.id
-    referral_link = f"https://t.me/{bot.get_me().username}?start=ref{user_id}"
+    referral_link = f"https://t.me/{get_bot_info().username}?start=ref{user_id}"
     
     markup = types.InlineKeyboardMarkup()
     share_button = types.InlineKeyboardButton(
@@ -360,40 +624,8 @@ def admin_command(message):
     # Обработка команды "broadcast" - отправляет сообщение всем пользователям
     elif command == "broadcast" and len(args) > 2:
         broadcast_text = " ".join(args[2:])
-        users = firebase_manager.get_all_users()
-        sent_count = 0
-        failed_count = 0
-        
-        # Отправляем сообщение о начале рассылки
-        status_msg = bot.reply_to(message, f"⏳ Начинаю рассылку {len(users)} пользователям...")
-        
-        for user in users:
-            try:
-                user_id = user.get('user_id')
-                if user_id:
-                    bot.send_message(user_id, broadcast_text)
-                    sent_count += 1
-                    
-                    # Обновляем статус каждые 10 отправленных сообщений
-                    if sent_count % 10 == 0:
-                        bot.edit_message_text(
-                            f"⏳ Отправлено: {sent_count}/{len(users)}...",
-                            chat_id=status_msg.chat.id,
-                            message_id=status_msg.message_id
-                        )
-            except Exception as e:
-                logging.error(f"Error sending broadcast to {user.get('user_id')}: {str(e)}")
-                failed_count += 1
-        
-        # Обновляем сообщение с финальным статусом
-        bot.edit_message_text(
-            f"✅ Рассылка завершена!\n\n"
-            f"✓ Успешно отправлено: {sent_count}\n"
-            f"✗ Ошибок: {failed_count}\n"
-            f"📊 Всего пользователей: {len(users)}",
-            chat_id=status_msg.chat.id,
-            message_id=status_msg.message_id
-        )
+        status_msg = bot.reply_to(message, "⏳ Начинаю рассылку...")
+        start_broadcast(broadcast_text, status_msg)
     
     else:
         bot.reply_to(message, "❌ Неизвестная команда. Используйте /admin для справки.")
@@ -484,14 +716,13 @@ def language_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.message_handler(func=lambda message: True)
 def handle_message(message):
     user_id = message.from_user.id
     text = message.text
     
     try:
-        # Отладочный вывод
-        logger.info(f"Received message: {text}")
+        # Текст сообщения не пишем в лог
+        logger.debug("Received message from user %s (%d chars)", user_id, len(text or ''))
         
         # Временное решение для отладки
         bot.reply_to(message, f"Получено сообщение: {text}\nНачинаю обработку...")
@@ -533,30 +764,24 @@ def handle_message(message):
         )
         
         try:
-            # Получение отзывов
-            review_handler = WbReview(text)
-            reviews = review_handler.parse()
+            # Получение анализа (из общего хранилища или по свежим отзывам)
+            sku, item_name, analysis = get_product_analysis(text)
             
-            if not reviews:
+            if not analysis:
                 bot.edit_message_text("❌ Не найдено отзывов для данного товара", 
                                     chat_id=message.chat.id, 
                                     message_id=processing_msg.message_id)
                 return
-                
-            # Преобразуем список отзывов в строку для кэширования
-            reviews_text = "\n".join(reviews)
-            
-            # Используем кэшированную функцию с артикулом товара
-            analysis = analyze_reviews_cached(review_handler.sku, reviews_text)
             
             # Уменьшаем количество попыток
             remaining_attempts = firebase_manager.decrease_attempts(user_id)
             
             # Добавляем информацию о товаре и оставшихся попытках
             analysis_with_info = (
-                f"🛍️ *{review_handler.item_name}*\n"
-                f"📦 Артикул: {review_handler.sku}\n\n"
+                f"🛍️ *{item_name}*\n"
+                f"📦 Артикул: {sku}\n\n"
                 f"{analysis}\n\n"
+                f"{review_stats_text(sku)}"
                 f"Осталось попыток: {remaining_attempts}"
             )
             
@@ -564,11 +789,11 @@ def handle_message(message):
             markup = types.InlineKeyboardMarkup(row_width=2)
             view_button = types.InlineKeyboardButton(
                 "🔍 Посмотреть на WB",
-                url=f"https://www.wildberries.ru/catalog/{review_handler.sku}/detail.aspx"
+                url=f"https://www.wildberries.ru/catalog/{sku}/detail.aspx"
             )
             share_button = types.InlineKeyboardButton(
                 "📤 Поделиться",
-                switch_inline_query=review_handler.sku
+                switch_inline_query=sku
             )
             markup.add(view_button, share_button)
             
@@ -581,7 +806,7 @@ def handle_message(message):
             )
             
             # Сохраняем результаты анализа
-            firebase_manager.save_analysis(user_id, review_handler.sku, review_handler.item_name, analysis)
+            save_analysis_result(user_id, sku, item_name, analysis)
             
         except Exception as e:
             logger.error(f"Error analyzing product: {str(e)}", exc_info=True)
@@ -614,37 +839,135 @@ def handle_payment_callback(call):
     
     bot.answer_callback_query(call.id)
 
+# Inline-режим: данные карточки кэшируются по артикулу, Telegram кэширует ответы у себя
+INLINE_CACHE_TIME = 300
+INLINE_PENDING_CACHE_TIME = 10
+INLINE_DEBOUNCE_SECONDS = 0.4
+PRODUCT_INFO_TTL = 3600
+PRODUCT_INFO_ERROR_TTL = 60
+_product_info_cache = TTLCache(maxsize=5000, ttl=PRODUCT_INFO_TTL)
+# Последний inline-запрос каждого пользователя: ответы на устаревшие запросы не отправляются
+_latest_inline_query = LRUCache(10000)
+_inline_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='inline')
+
+def normalize_sku(text):
+    """Артикул из текста (число или ссылка на каталог WB) или None
+
+    Цифры артикула не изменяются (в том числе ведущие нули): тот же артикул получают
+    обработчик сообщений, пакетный анализ и команды, и ключи кэшей у них совпадают.
+    """
+    text = text.strip()
+    if text.isdigit():
+        return text
+    lowered = text.lower()
+    if 'wildberries' in lowered and 'catalog' in lowered:
+        match = re.search(r"\d{7,15}", text)
+        if match:
+            return match.group(0)
+    return None
+
+def get_product_info(sku):
+    """Название и root_id товара: не больше одного запроса к card.wb.ru на артикул за PRODUCT_INFO_TTL"""
+    def load():
+        review_handler = WbReview(sku)
+        return {'sku': review_handler.sku, 'item_name': review_handler.item_name, 'root_id': review_handler.root_id}
+    
+    try:
+        return _product_info_cache.get_or_load(sku, load)
+    except Exception as e:
+        # Ненайденный товар или ошибка WB кэшируется ненадолго
+        logger.warning(f"Product info lookup failed for SKU {sku}: {str(e)}")
+        _product_info_cache.set(sku, None, ttl=PRODUCT_INFO_ERROR_TTL)
+        return None
+
+def is_latest_inline_query(query):
+    return _latest_inline_query.get(query.from_user.id) == query.id
+
+def inline_analyze_button(sku):
+    return types.InlineKeyboardMarkup().add(
+        types.InlineKeyboardButton(
+            "Получить анализ",
+            url=f"https://t.me/{get_bot_info().username}?start=analyze_{sku}"
+        )
+    )
+
+def answer_inline_analysis(query, sku, cached):
+    """Ответ на inline-запрос полным готовым анализом"""
+    message_text = f"🛍️ {cached['item_name']}\n📦 Артикул: {sku}\n\n{cached['analysis_text']}"
+    result = types.InlineQueryResultArticle(
+        id=f"analysis_{sku}",
+        title=f"Анализ отзывов: {cached['item_name']}",
+        description=cached['analysis_text'][:100],
+        # Без parse_mode: ответ LLM может содержать непарные символы разметки
+        input_message_content=types.InputTextMessageContent(message_text=message_text[:4096]),
+        thumb_url="https://example.com/icon.png",  # Замените на реальную иконку
+        reply_markup=types.InlineKeyboardMarkup().add(
+            types.InlineKeyboardButton(
+                "🔍 Посмотреть на WB",
+                url=f"https://www.wildberries.ru/catalog/{sku}/detail.aspx"
+            )
+        )
+    )
+    
+    # Результат одинаков для всех пользователей, поэтому Telegram может отдавать его из своего кэша
+    bot.answer_inline_query(query.id, [result], cache_time=INLINE_CACHE_TIME, is_personal=False)
+
+def answer_inline_product(query, product):
+    """Ответ на inline-запрос карточкой товара, пока анализ считается в фоне"""
+    result = types.InlineQueryResultArticle(
+        id=product['sku'],
+        title=f"Анализ отзывов: {product['item_name']}",
+        description=f"Артикул: {product['sku']}",
+        input_message_content=types.InputTextMessageContent(
+            message_text=f"🔍 Анализ отзывов для товара:\n{product['item_name']}\n\nАртикул: {product['sku']}"
+        ),
+        thumb_url="https://example.com/icon.png",  # Замените на реальную иконку
+        reply_markup=inline_analyze_button(product['sku'])
+    )
+    
+    # Короткий кэш: через несколько секунд по этому артикулу будет готов полный анализ
+    bot.answer_inline_query(query.id, [result], cache_time=INLINE_PENDING_CACHE_TIME, is_personal=False)
+
+def answer_inline_lookup(query, sku):
+    """Отложенный поиск товара: пропускается, если пользователь продолжил ввод"""
+    try:
+        time.sleep(INLINE_DEBOUNCE_SECONDS)
+        if not is_latest_inline_query(query):
+            return
+        
+        cached = get_cached_analysis(sku)
+        if cached:
+            if is_latest_inline_query(query):
+                answer_inline_analysis(query, sku, cached)
+            return
+        
+        product = get_product_info(sku)
+        if not product:
+            return
+        
+        # Анализ будет готов к переходу по ссылке "Получить анализ"
+        schedule_analysis_precompute(sku)
+        if is_latest_inline_query(query):
+            answer_inline_product(query, product)
+    except Exception as e:
+        logging.error(f"Error in inline query: {str(e)}")
+
 @bot.inline_handler(lambda query: len(query.query) > 0)
 def inline_query(query):
     try:
         # Проверяем, является ли запрос артикулом или ссылкой
-        text = query.query
-        is_valid_wb = text.isdigit() or ('wildberries' in text.lower() and 'catalog' in text.lower())
-        
-        if not is_valid_wb:
+        sku = normalize_sku(query.query)
+        if not sku:
             return
         
-        # Получаем информацию о товаре
-        review_handler = WbReview(text)
-        
-        # Создаем результат
-        result = types.InlineQueryResultArticle(
-            id='1',
-            title=f"Анализ отзывов: {review_handler.item_name}",
-            description=f"Артикул: {review_handler.sku}",
-            input_message_content=types.InputTextMessageContent(
-                message_text=f"🔍 Анализ отзывов для товара:\n{review_handler.item_name}\n\nАртикул: {review_handler.sku}"
-            ),
-            thumb_url="https://example.com/icon.png",  # Замените на реальную иконку
-            reply_markup=types.InlineKeyboardMarkup().add(
-                types.InlineKeyboardButton(
-                    "Получить анализ",
-                    url=f"https://t.me/{bot.get_me().username}?start=analyze_{review_handler.sku}"
-                )
-            )
-        )
+        _latest_inline_query.set(query.from_user.id, query.id)
         
-        bot.answer_inline_query(query.id, [result])
+        cached = _analysis_cache.get(sku)
+        if cached:
+            answer_inline_analysis(query, sku, cached)
+        elif sku not in _product_info_cache or _product_info_cache.get(sku):
+            # Поиск выполняется вне очереди апдейтов, чтобы не задерживать новые запросы пользователя
+            _inline_executor.submit(answer_inline_lookup, query, sku)
     except Exception as e:
         logging.error(f"Error in inline query: {str(e)}")
 
@@ -692,9 +1015,25 @@ def export_command(message):
     # Удаляем временный файл
     os.remove(f"analysis_{user_id}.txt")
 
+# Товары, собранные для сравнения: user_id -> список артикулов (только в памяти процесса)
+COMPARE_SESSION_TTL = 1800
+comparison_sessions = TTLCache(maxsize=10000, ttl=COMPARE_SESSION_TTL)
+_compare_executor = ThreadPoolExecutor(max_workers=COMPARE_WORKERS, thread_name_prefix='compare')
+NUMBER_EMOJIS = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+MESSAGE_LIMIT = 4000
+
+def parse_sku_list(text):
+    """Артикулы без повторов из текста со ссылками или артикулами через пробел, запятую или перенос строки"""
+    skus = {}
+    for token in re.split(r"[\s,;]+", text or ""):
+        sku = normalize_sku(token.strip('"\''))
+        if sku:
+            skus[sku] = True
+    return list(skus)
+
 @bot.message_handler(commands=['compare'])
 def compare_command(message):
-    """Команда для сравнения двух товаров"""
+    """Команда для сравнения товаров"""
     user_id = message.from_user.id
     
     # Проверяем количество попыток
@@ -706,119 +1045,683 @@ def compare_command(message):
         )
         return
     
-    # Запрашиваем первый товар
+    comparison_sessions.pop(user_id)
+    
+    # Товары можно перечислить сразу после команды
+    skus = parse_sku_list(message.text.partition(' ')[2])
+    if skus:
+        handle_compare_input(message, skus)
+        return
+    
+    # Запрашиваем товары
     msg = bot.reply_to(
         message,
-        "🔍 Пожалуйста, отправьте ссылку или артикул первого товара для сравнения."
+        f"🔍 Отправьте ссылки или артикулы товаров для сравнения (от 2 до {COMPARE_MAX_PRODUCTS}) "
+        f"одним сообщением - через пробел или с новой строки."
     )
     
     # Регистрируем следующий шаг
-    bot.register_next_step_handler(msg, process_first_product)
+    bot.register_next_step_handler(msg, process_compare_products)
+
+def process_compare_products(message):
+    """Обработка сообщения с товарами для сравнения"""
+    skus = parse_sku_list(message.text)
+    
+    if not skus:
+        comparison_sessions.pop(message.from_user.id)
+        bot.reply_to(message, "❌ Пожалуйста, отправьте корректную ссылку на товар с Wildberries или артикул товара.")
+        return
+    
+    handle_compare_input(message, skus)
 
-def process_first_product(message):
-    """Обработка первого товара для сравнения"""
+def handle_compare_input(message, skus):
+    """Добавление товаров в сессию сравнения; при двух и более товарах запускается сравнение"""
     user_id = message.from_user.id
-    text = message.text
+    selected = comparison_sessions.get(user_id, [])
+    for sku in skus:
+        if sku not in selected:
+            selected.append(sku)
+    
+    if len(selected) > COMPARE_MAX_PRODUCTS:
+        bot.reply_to(message, f"ℹ️ Сравниваются первые {COMPARE_MAX_PRODUCTS} товаров.")
+        selected = selected[:COMPARE_MAX_PRODUCTS]
+    
+    if len(selected) < 2:
+        comparison_sessions.set(user_id, selected)
+        msg = bot.reply_to(message, "🔍 Теперь отправьте ссылку или артикул еще хотя бы одного товара.")
+        bot.register_next_step_handler(msg, process_compare_products)
+        return
     
-    # Проверка на ссылку или артикул
-    is_valid_wb = text.isdigit() or ('wildberries' in text.lower() and 'catalog' in text.lower())
+    comparison_sessions.pop(user_id)
+    run_comparison(message, selected)
+
+def fetch_comparison_material(sku):
+    """Данные товара для сравнения: готовый анализ или, если его нет, отзывы с WB"""
+    cached = get_cached_analysis(sku)
+    if cached:
+        return {'sku': sku, 'item_name': cached['item_name'], 'analysis': cached['analysis_text'], 'reviews': None}
+    
+    review_handler = WbReview(sku)
+    return {
+        'sku': review_handler.sku,
+        'item_name': review_handler.item_name,
+        'analysis': None,
+        'reviews': review_handler.parse()
+    }
+
+def format_comparison_progress(skus, lines):
+    """Ход сравнения: по строке на каждый товар в порядке запроса"""
+    done = sum(1 for sku in skus if sku in lines)
+    status = "⏳ Сравниваю товары" if done < len(skus) else "⏳ Товары загружены, готовлю сравнение"
+    items = "\n".join(
+        f"{NUMBER_EMOJIS[i]} {lines.get(sku, f'Артикул {sku}: загружается...')}"
+        for i, sku in enumerate(skus)
+    )
+    return f"{status} ({done}/{len(skus)})\n\n{items}"
+
+def run_comparison(message, skus):
+    """Параллельная загрузка товаров с выводом каждого по готовности и итоговое сравнение"""
+    user_id = message.from_user.id
     
-    if not is_valid_wb:
-        bot.reply_to(message, "❌ Пожалуйста, отправьте корректную ссылку на товар с Wildberries или артикул товара.")
+    # Попытки списываются за все товары одной операцией, неиспользованные возвращаются в конце
+    if firebase_manager.reserve_attempts(user_id, len(skus)) is None:
+        attempts = firebase_manager.get_user_attempts(user_id)
+        bot.reply_to(
+            message,
+            f"❌ Для сравнения {len(skus)} товаров требуется {len(skus)} попыток. У вас осталось: {attempts}."
+        )
         return
     
-    # Сохраняем первый товар
-    firebase_manager.set_comparison_product(user_id, 1, text)
+    charged = 0
+    try:
+        charged = compare_and_send(message, skus)
+    except Exception as e:
+        logger.error(f"Error comparing products for user {user_id}: {str(e)}", exc_info=True)
+        bot.reply_to(message, "❌ Не удалось сравнить товары. Попытки возвращены.")
+    finally:
+        if charged < len(skus):
+            firebase_manager.refund_attempts(user_id, len(skus) - charged)
+
+def compare_and_send(message, skus):
+    """Загрузка, сравнение и отправка результата; возвращает число сравненных товаров (0 - сравнения нет)"""
+    lines = {}
+    processing_msg = bot.reply_to(message, format_comparison_progress(skus, lines))
+    
+    # Число одновременных загрузок ограничено общим пулом _compare_executor
+    futures = {_compare_executor.submit(fetch_comparison_material, sku): sku for sku in skus}
+    materials = {}
+    for future in as_completed(futures):
+        sku = futures[future]
+        try:
+            material = future.result()
+            if material['analysis']:
+                lines[sku] = f"{material['item_name']} - ⚡ готовый анализ"
+                materials[sku] = material
+            elif material['reviews']:
+                lines[sku] = f"{material['item_name']} - 📝 отзывов: {len(material['reviews'])}"
+                materials[sku] = material
+            else:
+                lines[sku] = f"{material['item_name']} - ❌ нет отзывов"
+        except Exception as e:
+            logger.warning(f"Error fetching SKU {sku} for comparison: {str(e)}")
+            lines[sku] = f"Артикул {sku}: ❌ не удалось загрузить"
+        
+        try:
+            bot.edit_message_text(
+                format_comparison_progress(skus, lines),
+                chat_id=message.chat.id,
+                message_id=processing_msg.message_id
+            )
+        except Exception as e:
+            logger.debug(f"Could not update comparison progress: {str(e)}")
+    
+    products = [materials[sku] for sku in skus if sku in materials]
+    if len(products) < 2:
+        bot.reply_to(message, "❌ Не найдено отзывов хотя бы для двух товаров, сравнение невозможно. Попытки возвращены.")
+        return 0
     
-    # Запрашиваем второй товар
+    comparison = compare_products(products)
+    if not comparison:
+        bot.reply_to(message, "❌ Не удалось сравнить товары. Попытки возвращены.")
+        return 0
+    
+    send_long_message(message.chat.id, comparison)
+    # Одна попытка за каждый сравненный товар
+    return len(products)
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Части текста не длиннее limit, разрезанные по границам строк (разметка не рвется посреди строки)"""
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        # Строка длиннее лимита режется на куски
+        while len(line) > limit:
+            chunks.append(line[:limit])
+            line = line[limit:]
+        current += line
+    chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+def send_long_message(chat_id, text, parse_mode="Markdown"):
+    """Отправка длинного текста частями; часть, разметку которой Telegram не принял, уходит простым текстом"""
+    for chunk in split_message(text):
+        try:
+            bot.send_message(chat_id, chunk, parse_mode=parse_mode)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            logger.warning(f"Telegram rejected message markup, sending plain text: {str(e)}")
+            bot.send_message(chat_id, chunk)
+
+def compare_products(products):
+    """Сравнение товаров: готовые анализы без LLM, иначе один сравнительный запрос"""
+    header = "📊 *Сравнение товаров*\n\n" + "".join(
+        f"{NUMBER_EMOJIS[i]} *{product['item_name']}* (Артикул: {product['sku']})\n"
+        for i, product in enumerate(products)
+    ) + "\n"
+    
+    if all(product['analysis'] for product in products):
+        return header + "".join(
+            f"*Анализ товара {NUMBER_EMOJIS[i]}:*\n{product['analysis']}\n\n"
+            for i, product in enumerate(products)
+        ) + "*Вывод:*\nНа основе анализа отзывов, рекомендуем выбрать товар, который лучше соответствует вашим требованиям."
+    
+    reviews_per_product = max(10, COMPARISON_REVIEWS_TOTAL // len(products))
+    
+    def material(product):
+        if product['analysis']:
+            return f"Готовый анализ отзывов:\n{product['analysis']}"
+        return "Отзывы:\n" + "\n".join(product['reviews'][:reviews_per_product])
+    
+    comparison = compare_reviews_cached(tuple((product['item_name'], material(product)) for product in products))
+    if not comparison or comparison == ANALYSIS_FAILED_TEXT:
+        return None
+    return header + comparison
+
+# Пакетный анализ артикулов из файла
+BATCH_MAX_FILE_SIZE = 1024 * 1024
+BATCH_FILE_EXTENSIONS = ('.csv', '.txt')
+BATCH_PROGRESS_INTERVAL = 5.0
+# Карточки товаров запрашиваются у card.wb.ru пачками: nm=1;2;3
+CARD_BATCH_SIZE = 50
+# Пакеты выполняются в фоне, чтобы не занимать потоки обработки апдейтов
+_batch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='batch')
+_batch_fetch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch-fetch')
+_batch_llm_executor = ThreadPoolExecutor(max_workers=BATCH_LLM_WORKERS, thread_name_prefix='batch-llm')
+# Пользователи с выполняющимся пакетом (не больше одного пакета на пользователя)
+_running_batches = set()
+_running_batches_lock = threading.Lock()
+
+BATCH_STATUS_CACHED = "готово (готовый анализ)"
+BATCH_STATUS_DONE = "готово"
+BATCH_STATUS_NOT_FOUND = "товар не найден"
+BATCH_STATUS_NO_REVIEWS = "нет отзывов"
+BATCH_STATUS_FAILED = "ошибка"
+
+@bot.message_handler(commands=['batch'])
+def batch_command(message):
+    """Команда для пакетного анализа товаров из файла"""
     msg = bot.reply_to(
         message,
-        "🔍 Теперь отправьте ссылку или артикул второго товара для сравнения."
+        f"📄 Отправьте файл CSV или TXT со ссылками или артикулами товаров (до {BATCH_MAX_SKUS} шт.).\n\n"
+        f"Каждый товар расходует 1 попытку, попытки списываются сразу за весь файл. "
+        f"За товары, которые не удалось проанализировать, попытки вернутся."
     )
-    
-    # Регистрируем следующий шаг
-    bot.register_next_step_handler(msg, process_second_product)
+    bot.register_next_step_handler(msg, process_batch_file)
 
-def process_second_product(message):
-    """Обработка второго товара и выполнение сравнения"""
+def process_batch_file(message):
+    """Проверка файла, списание попыток за весь пакет и запуск анализа в фоне"""
     user_id = message.from_user.id
-    text = message.text
+    document = message.document
     
-    # Проверка на ссылку или артикул
-    is_valid_wb = text.isdigit() or ('wildberries' in text.lower() and 'catalog' in text.lower())
-    
-    if not is_valid_wb:
-        bot.reply_to(message, "❌ Пожалуйста, отправьте корректную ссылку на товар с Wildberries или артикул товара.")
+    if not document or not (document.file_name or '').lower().endswith(BATCH_FILE_EXTENSIONS):
+        bot.reply_to(message, "❌ Пожалуйста, отправьте файл в формате CSV или TXT. Начните заново: /batch")
+        return
+    if document.file_size and document.file_size > BATCH_MAX_FILE_SIZE:
+        bot.reply_to(message, "❌ Файл слишком большой (максимум 1 МБ).")
         return
     
-    # Сохраняем второй товар
-    firebase_manager.set_comparison_product(user_id, 2, text)
+    with _running_batches_lock:
+        if user_id in _running_batches:
+            bot.reply_to(message, "⏳ Ваш предыдущий пакетный анализ еще выполняется.")
+            return
+        _running_batches.add(user_id)
     
-    # Получаем оба товара
-    product1 = firebase_manager.get_comparison_product(user_id, 1)
-    product2 = firebase_manager.get_comparison_product(user_id, 2)
+    started = False
+    try:
+        file_info = bot.get_file(document.file_id)
+        skus = parse_sku_list(decode_batch_file(bot.download_file(file_info.file_path)))
+        if not skus:
+            bot.reply_to(message, "❌ В файле не найдено ссылок на товары Wildberries или артикулов.")
+            return
+        if len(skus) > BATCH_MAX_SKUS:
+            bot.reply_to(message, f"ℹ️ В файле {len(skus)} товаров, будут проанализированы первые {BATCH_MAX_SKUS}.")
+            skus = skus[:BATCH_MAX_SKUS]
+        
+        # Попытки списываются за весь пакет одной операцией
+        remaining = firebase_manager.reserve_attempts(user_id, len(skus))
+        if remaining is None:
+            attempts = firebase_manager.get_user_attempts(user_id)
+            bot.reply_to(
+                message,
+                f"❌ Для анализа {len(skus)} товаров требуется {len(skus)} попыток. У вас осталось: {attempts}."
+            )
+            return
+        
+        status_msg = bot.reply_to(
+            message,
+            f"⏳ Анализирую {len(skus)} товаров. Это может занять некоторое время.\n"
+            f"Списано попыток: {len(skus)}, осталось: {remaining}"
+        )
+        _batch_executor.submit(run_batch, message.chat.id, user_id, skus, status_msg.message_id)
+        started = True
+    except Exception as e:
+        logger.error(f"Error starting batch analysis: {str(e)}", exc_info=True)
+        bot.reply_to(message, "❌ Не удалось обработать файл. Попробуйте позже.")
+    finally:
+        if not started:
+            with _running_batches_lock:
+                _running_batches.discard(user_id)
+
+def decode_batch_file(content):
+    """Текст загруженного файла: UTF-8 (в том числе с BOM) или Windows-1251 из Excel"""
+    try:
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return content.decode('cp1251', errors='ignore')
+
+def fetch_product_cards(skus, use_cache=True, failed=None):
+    """Название, root_id и число отзывов товаров запросами к card.wb.ru по CARD_BATCH_SIZE артикулов
+
+    При use_cache карточки сначала берутся из кэша (число отзывов в них может отсутствовать).
+    Артикулы пачек, запрос которых не удался, добавляются в множество failed: в отличие
+    от отсутствующих в ответе, о них ничего не известно.
+    """
+    cards = {}
+    missing = []
+    for sku in skus:
+        info = _product_info_cache.get(sku) if use_cache else None
+        if info:
+            cards[sku] = info
+        else:
+            missing.append(sku)
     
-    # Отправляем сообщение о начале сравнения
-    processing_msg = bot.reply_to(
-        message, 
-        f"⏳ Сравниваю товары... Это может занять некоторое время."
-    )
+    for start in range(0, len(missing), CARD_BATCH_SIZE):
+        chunk = missing[start:start + CARD_BATCH_SIZE]
+        try:
+            response = requests.get(
+                WB_CARD_URL.format(';'.join(chunk)),
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=15
+            )
+            response.raise_for_status()
+            products = (response.json().get('data') or {}).get('products') or []
+        except Exception as e:
+            logger.warning(f"Card lookup failed for {len(chunk)} SKUs: {str(e)}")
+            if failed is not None:
+                failed.update(chunk)
+            continue
+        
+        found = {}
+        for product in products:
+            sku = str(product.get('id'))
+            if sku in chunk and product.get('root'):
+                info = {'sku': sku, 'item_name': product.get('name', 'Название не найдено'), 'root_id': product['root'],
+                        'feedback_count': product.get('feedbacks')}
+                _product_info_cache.set(sku, info)
+                cards[sku] = info
+                found[sku] = product
+        record_price_history(found)
+    return cards
+
+def fetch_root_feedbacks(root_id, sku, item_name):
+    """Отзывы всех вариантов товара (общий root_id) одним запросом"""
+    return WbReview(sku, item_name=item_name, root_id=root_id).get_review()
+
+def collect_batch_results(skus, on_progress):
+    """Конвейер пакетного анализа: готовые анализы, карточки пачками, отзывы по root_id, LLM
+
+    Отзывы вариантов одного товара загружаются один раз, анализ артикула ставится
+    в очередь LLM сразу после загрузки его отзывов. Результат: sku -> {'item_name', 'status', 'analysis'}.
+    """
+    results = {}
+    
+    # Готовые анализы не требуют ни WB, ни LLM
+    for sku, cached in zip(skus, _batch_fetch_executor.map(get_cached_analysis, skus)):
+        if cached:
+            results[sku] = {'item_name': cached['item_name'], 'status': BATCH_STATUS_CACHED,
+                            'analysis': cached['analysis_text']}
+    on_progress(results)
+    
+    pending_skus = [sku for sku in skus if sku not in results]
+    # Артикулы пачек, которые не удалось загрузить, - ошибка (попытка вернется), а не "товар не найден"
+    failed_skus = set()
+    cards = fetch_product_cards(pending_skus, failed=failed_skus)
+    roots = {}
+    for sku in pending_skus:
+        if sku in cards:
+            roots.setdefault(cards[sku]['root_id'], []).append(sku)
+        elif sku in failed_skus:
+            results[sku] = {'item_name': None, 'status': BATCH_STATUS_FAILED, 'analysis': None}
+        else:
+            results[sku] = {'item_name': None, 'status': BATCH_STATUS_NOT_FOUND, 'analysis': None}
+    
+    # Future -> ('fetch', артикулы root_id) или ('analyze', артикул)
+    pending = {
+        _batch_fetch_executor.submit(fetch_root_feedbacks, root_id, group[0], cards[group[0]]['item_name']):
+            ('fetch', group)
+        for root_id, group in roots.items()
+    }
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, payload = pending.pop(future)
+            if stage == 'fetch':
+                try:
+                    feedbacks = future.result()
+                except Exception as e:
+                    logger.warning(f"Feedback fetch failed for SKUs {payload}: {str(e)}")
+                    feedbacks = None
+                for sku in payload:
+                    item_name = cards[sku]['item_name']
+                    store_review_stats(sku, feedbacks)
+                    reviews = WbReview(sku, item_name=item_name, root_id=cards[sku]['root_id']).parse(feedbacks or {})
+                    if reviews:
+                        analysis_future = _batch_llm_executor.submit(analyze_product_reviews, sku, item_name, reviews)
+                        pending[analysis_future] = ('analyze', sku)
+                    else:
+                        status = BATCH_STATUS_NO_REVIEWS if feedbacks else BATCH_STATUS_FAILED
+                        results[sku] = {'item_name': item_name, 'status': status, 'analysis': None}
+            else:
+                sku = payload
+                try:
+                    analysis = future.result()
+                except Exception as e:
+                    logger.warning(f"Batch analysis failed for SKU {sku}: {str(e)}")
+                    analysis = None
+                if analysis and analysis != ANALYSIS_FAILED_TEXT:
+                    results[sku] = {'item_name': cards[sku]['item_name'], 'status': BATCH_STATUS_DONE,
+                                    'analysis': analysis}
+                else:
+                    results[sku] = {'item_name': cards[sku]['item_name'], 'status': BATCH_STATUS_FAILED,
+                                    'analysis': None}
+        on_progress(results)
+    return results
+
+def build_batch_report(skus, results):
+    """CSV-отчет пакетного анализа (UTF-8 с BOM, чтобы Excel открывал кириллицу)"""
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(['Артикул', 'Название', 'Статус', 'Средняя оценка', 'Отзывов', 'С фото, %', 'Анализ'])
+    for sku in skus:
+        result = results[sku]
+        stats = _review_stats_cache.get(sku)
+        writer.writerow([
+            sku, result['item_name'] or '', result['status'],
+            f"{stats['average']:.2f}" if stats else '',
+            stats['count'] if stats else '',
+            round(stats['photo_share'] * 100) if stats else '',
+            result['analysis'] or ''
+        ])
+    return output.getvalue().encode('utf-8-sig')
+
+def run_batch(chat_id, user_id, skus, status_message_id):
+    """Фоновый пакетный анализ: прогресс в статусном сообщении, результат - одним файлом"""
+    last_progress = [0.0]
+    
+    def on_progress(results):
+        now = time.monotonic()
+        if now - last_progress[0] < BATCH_PROGRESS_INTERVAL:
+            return
+        last_progress[0] = now
+        try:
+            bot.edit_message_text(
+                f"⏳ Пакетный анализ: обработано {len(results)} из {len(skus)} товаров",
+                chat_id=chat_id,
+                message_id=status_message_id
+            )
+        except Exception as e:
+            logger.debug(f"Could not update batch progress: {str(e)}")
     
     try:
-        # Анализируем оба товара
-        review_handler1 = WbReview(product1)
-        reviews1 = review_handler1.parse()
-        
-        review_handler2 = WbReview(product2)
-        reviews2 = review_handler2.parse()
-        
-        if not reviews1 or not reviews2:
+        try:
+            results = collect_batch_results(skus, on_progress)
+        except Exception as e:
+            logger.error(f"Batch analysis failed for user {user_id}: {str(e)}", exc_info=True)
+            firebase_manager.refund_attempts(user_id, len(skus))
             bot.edit_message_text(
-                "❌ Не найдено отзывов для одного из товаров", 
-                chat_id=message.chat.id, 
-                message_id=processing_msg.message_id
+                "❌ Не удалось выполнить пакетный анализ. Попытки возвращены.",
+                chat_id=chat_id,
+                message_id=status_message_id
             )
             return
         
-        # Анализируем отзывы обоих товаров
-        reviews_text1 = "\n".join(reviews1)
-        analysis1 = analyze_reviews_cached(review_handler1.sku, reviews_text1)
+        analyzed = [sku for sku in skus if results[sku]['analysis']]
+        refunded = len(skus) - len(analyzed)
+        firebase_manager.refund_attempts(user_id, refunded)
+        for sku in analyzed:
+            save_analysis_result(user_id, sku, results[sku]['item_name'], results[sku]['analysis'])
         
-        reviews_text2 = "\n".join(reviews2)
-        analysis2 = analyze_reviews_cached(review_handler2.sku, reviews_text2)
-        
-        # Сравниваем товары
-        comparison = compare_products(review_handler1, review_handler2, analysis1, analysis2)
+        summary = f"✅ Пакетный анализ завершен: проанализировано {len(analyzed)} из {len(skus)} товаров."
+        if refunded:
+            summary += f"\nВозвращено попыток: {refunded}"
+        bot.edit_message_text(summary, chat_id=chat_id, message_id=status_message_id)
+        bot.send_document(
+            chat_id,
+            io.BytesIO(build_batch_report(skus, results)),
+            visible_file_name=f"batch_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            caption="📊 Результаты пакетного анализа"
+        )
+    except Exception as e:
+        logger.error(f"Error finishing batch for user {user_id}: {str(e)}", exc_info=True)
+    finally:
+        with _running_batches_lock:
+            _running_batches.discard(user_id)
+
+# Подписки на новые негативные отзывы (опрос выполняет планировщик)
+WATCH_REVIEWS_IN_MESSAGE = 3
+WATCH_REVIEW_TEXT_LIMIT = 300
+
+@bot.message_handler(commands=['watch'])
+def watch_command(message):
+    """Команда для подписки на новые негативные отзывы товара"""
+    sku = normalize_sku(message.text.partition(' ')[2])
+    if sku:
+        add_user_watch(message, sku)
+        return
+    
+    msg = bot.reply_to(
+        message,
+        "🔔 Отправьте ссылку или артикул товара, и я сообщу, когда у него появятся новые негативные отзывы."
+    )
+    bot.register_next_step_handler(msg, process_watch_sku)
+
+def process_watch_sku(message):
+    """Обработка артикула для подписки"""
+    sku = normalize_sku(message.text or '')
+    if not sku:
+        bot.reply_to(message, "❌ Пожалуйста, отправьте корректную ссылку на товар с Wildberries или артикул товара.")
+        return
+    add_user_watch(message, sku)
+
+def add_user_watch(message, sku):
+    """Подписка пользователя на артикул с проверкой лимита подписок"""
+    user_id = message.from_user.id
+    try:
+        watches = firebase_manager.get_user_watches(user_id)
+        if any(watch['sku'] == sku for watch in watches):
+            bot.reply_to(message, f"ℹ️ Вы уже подписаны на товар {sku}.")
+            return
+        if len(watches) >= WATCH_MAX_PER_USER:
+            bot.reply_to(
+                message,
+                f"❌ Можно отслеживать не больше {WATCH_MAX_PER_USER} товаров. Отписаться: /unwatch <артикул>"
+            )
+            return
         
-        # Уменьшаем количество попыток (2 попытки за сравнение)
-        firebase_manager.decrease_attempts(user_id)
-        firebase_manager.decrease_attempts(user_id)
+        product = get_product_info(sku)
+        if not product:
+            bot.reply_to(message, "❌ Товар не найден на Wildberries.")
+            return
         
-        # Отправляем результат
-        bot.edit_message_text(
-            comparison,
-            chat_id=message.chat.id,
-            message_id=processing_msg.message_id,
-            parse_mode="Markdown"
+        firebase_manager.add_watch(user_id, product['sku'], product['root_id'], product['item_name'])
+        bot.reply_to(
+            message,
+            f"🔔 Подписка оформлена: {product['item_name']} (Артикул: {product['sku']})\n\n"
+            f"Я сообщу о новых отзывах с оценкой {WATCH_NEGATIVE_RATING}⭐ и ниже.\n"
+            f"Ваши подписки: /watchlist"
         )
-        
     except Exception as e:
-        bot.edit_message_text(
-            f"❌ Произошла ошибка при сравнении товаров: {str(e)}", 
-            chat_id=message.chat.id,
-            message_id=processing_msg.message_id
-        )
+        logger.error(f"Error adding watch for user {user_id}: {str(e)}", exc_info=True)
+        bot.reply_to(message, "❌ Не удалось оформить подписку. Попробуйте позже.")
 
-def compare_products(product1, product2, analysis1, analysis2):
-    """Сравнение двух товаров на основе их анализов"""
-    return (
-        f"📊 *Сравнение товаров*\n\n"
-        f"🔵 *{product1.item_name}* (Артикул: {product1.sku})\n"
-        f"🔴 *{product2.item_name}* (Артикул: {product2.sku})\n\n"
-        f"*Анализ первого товара:*\n{analysis1}\n\n"
-        f"*Анализ второго товара:*\n{analysis2}\n\n"
-        f"*Вывод:*\nНа основе анализа отзывов, рекомендуем выбрать товар, который лучше соответствует вашим требованиям."
+@bot.message_handler(commands=['unwatch'])
+def unwatch_command(message):
+    """Команда для отмены подписки на товар"""
+    sku = normalize_sku(message.text.partition(' ')[2])
+    if not sku:
+        bot.reply_to(message, "ℹ️ Укажите артикул товара: /unwatch 12345678")
+        return
+    
+    if firebase_manager.remove_watch(message.from_user.id, sku):
+        bot.reply_to(message, f"🔕 Подписка на товар {sku} отменена.")
+    else:
+        bot.reply_to(message, f"ℹ️ Вы не подписаны на товар {sku}.")
+
+@bot.message_handler(commands=['watchlist'])
+def watchlist_command(message):
+    """Список подписок пользователя"""
+    watches = firebase_manager.get_user_watches(message.from_user.id)
+    if not watches:
+        bot.reply_to(message, "ℹ️ У вас нет подписок. Подписаться на товар: /watch <артикул>")
+        return
+    
+    lines = "\n".join(f"• {watch.get('item_name') or 'Без названия'} - {watch['sku']}" for watch in watches)
+    bot.reply_to(
+        message,
+        f"🔔 Ваши подписки ({len(watches)}/{WATCH_MAX_PER_USER}):\n\n{lines}\n\n"
+        f"Отписаться: /unwatch <артикул>"
+    )
+
+def build_watch_messages(watch, reviews):
+    """Уведомления подписчикам артикула о новых негативных отзывах: [(chat_id, text, kwargs)]"""
+    parts = []
+    for review in reviews[:WATCH_REVIEWS_IN_MESSAGE]:
+        review_text = review.get('text') or review.get('cons') or "(без текста)"
+        if len(review_text) > WATCH_REVIEW_TEXT_LIMIT:
+            review_text = review_text[:WATCH_REVIEW_TEXT_LIMIT] + "..."
+        parts.append(f"{'⭐' * (review.get('productValuation') or 1)} {(review.get('createdDate') or '')[:10]}\n{review_text}")
+    if len(reviews) > WATCH_REVIEWS_IN_MESSAGE:
+        parts.append(f"...и еще {len(reviews) - WATCH_REVIEWS_IN_MESSAGE}")
+    
+    text = (
+        f"⚠️ Новые негативные отзывы: {watch.get('item_name') or 'товар'} (Артикул: {watch['sku']})\n\n"
+        + "\n\n".join(parts)
+    )
+    markup = types.InlineKeyboardMarkup().add(
+        types.InlineKeyboardButton(
+            "🔍 Посмотреть на WB",
+            url=f"https://www.wildberries.ru/catalog/{watch['sku']}/feedbacks"
+        )
     )
+    return [(user_id, text, {'reply_markup': markup}) for user_id in watch['subscribers']]
+
+# История цены и рейтинга: ряды пишутся при анализе, пакетном анализе и опросе подписок
+# Сколько последних дней показывать на мини-графике цены
+HISTORY_SPARK_POINTS = 30
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+def sparkline(values):
+    """Мини-график ряда символами разной высоты"""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[round((value - low) / (high - low) * (len(SPARK_CHARS) - 1))] for value in values)
+
+def format_change(current, previous):
+    if previous is None or current is None or previous == current:
+        return "без изменений"
+    sign = "+" if current > previous else "-"
+    return f"{sign}{abs(current - previous):.0f} ₽ ({sign}{abs(current - previous) / previous * 100:.1f}%)"
+
+def value_before(points, index, moment):
+    """Последнее известное значение колонки index не позже moment"""
+    value = None
+    for point in points:
+        if point[0] > moment:
+            break
+        if point[index] is not None:
+            value = point[index]
+    return value
+
+def format_price_history(sku, points):
+    """Текст истории цены и рейтинга артикула"""
+    now = points[-1][0]
+    prices = [point[1] for point in points if point[1] is not None]
+    ratings = [point[2] for point in points if point[2] is not None]
+    current_price = prices[-1] if prices else None
+    
+    lines = [f"📈 *История товара* (Артикул: {sku})", f"С {points[0][0].strftime('%d.%m.%Y')}, точек: {len(points)}", ""]
+    if prices:
+        lines.append(f"💰 Цена: {current_price:.0f} ₽ (мин. {min(prices):.0f} ₽, макс. {max(prices):.0f} ₽)")
+        lines.append(f"За 7 дней: {format_change(current_price, value_before(points, 1, now - timedelta(days=7)))}")
+        lines.append(f"За 30 дней: {format_change(current_price, value_before(points, 1, now - timedelta(days=30)))}")
+        # Последняя цена каждого дня
+        daily_prices = {point[0].date(): point[1] for point in points if point[1] is not None}
+        lines.append(f"`{sparkline(list(daily_prices.values())[-HISTORY_SPARK_POINTS:])}`")
+    if ratings:
+        lines.append("")
+        lines.append(f"⭐ Рейтинг: {ratings[-1]:.1f} (было {ratings[0]:.1f})")
+    feedbacks = [point[3] for point in points if point[3] is not None]
+    if feedbacks:
+        lines.append(f"📝 Отзывов: {feedbacks[-1]} (+{feedbacks[-1] - feedbacks[0]} за период)")
+    return "\n".join(lines)
+
+def format_review_stats(stats):
+    """Блок статистики оценок для сообщения с анализом"""
+    lines = [f"📊 Оценки ({stats['count']} отзывов), средняя {stats['average']:.1f}⭐"]
+    for stars in range(5, 0, -1):
+        share = stats['distribution'][stars] / stats['count']
+        lines.append(f"{stars}⭐ {'█' * round(share * 10)}{'░' * (10 - round(share * 10))} {share * 100:.0f}%")
+    if len(stats['trend']) > 1:
+        lines.append(f"📈 Тренд: {sparkline(stats['trend'])} {stats['trend'][0]:.1f} → {stats['recent_average']:.1f}")
+    if stats['previous_average'] is not None:
+        lines.append(f"Последние отзывы: {stats['recent_average']:.1f}⭐, до них: {stats['previous_average']:.1f}⭐")
+    lines.append(f"📷 С фото: {stats['photo_share'] * 100:.0f}%")
+    lines.append(f"⏱ Отзывов в день: {stats['per_day_recent']:.1f} за последние 30 дней")
+    return "\n".join(lines)
+
+def review_stats_text(sku):
+    """Статистика оценок артикула с отступом или пустая строка, если она не считалась"""
+    stats = _review_stats_cache.get(sku)
+    return f"{format_review_stats(stats)}\n\n" if stats else ""
+
+@bot.message_handler(commands=['history'])
+def history_command(message):
+    """История цены и рейтинга товара из локального хранилища"""
+    sku = normalize_sku(message.text.partition(' ')[2])
+    if not sku:
+        bot.reply_to(message, "ℹ️ Укажите артикул или ссылку на товар: /history 12345678")
+        return
+    
+    try:
+        points = price_history.get(sku)
+    except Exception as e:
+        logger.error(f"Error reading price history for SKU {sku}: {str(e)}")
+        points = []
+    
+    if not points:
+        bot.reply_to(
+            message,
+            f"ℹ️ Истории по товару {sku} пока нет. Она собирается после анализа товара "
+            f"и для товаров из подписок (/watch {sku})."
+        )
+        return
+    
+    bot.reply_to(message, format_price_history(sku, points), parse_mode="Markdown")
 
 @bot.message_handler(commands=['search'])
 def search_command(message):
@@ -887,6 +1790,11 @@ def process_category_search(message):
             disable_web_page_preview=True
         )
         
+        # Пока пользователь читает выдачу, считаем анализы показанных товаров
+        if SEARCH_PREFETCH:
+            for product in products[:5]:
+                schedule_analysis_precompute(str(product['id']))
+        
     except Exception as e:
         bot.edit_message_text(
             f"❌ Произошла ошибка при поиске товаров: {str(e)}", 
@@ -894,36 +1802,47 @@ def process_category_search(message):
             message_id=processing_msg.message_id
         )
 
+# Выдача поиска по нормализованному запросу категории
+_search_cache = TTLCache(maxsize=500, ttl=SEARCH_CACHE_TTL)
+
+def normalize_category(category: str) -> str:
+    """Запрос категории без различий в регистре и пробелах"""
+    return " ".join(category.lower().split())
+
+def fetch_products_by_category(query: str) -> list:
+    """Запрос популярных товаров категории к search.wb.ru"""
+    # Формируем запрос к API Wildberries
+    search_url = f"https://search.wb.ru/exactmatch/ru/common/v4/search?appType=1&couponsGeo=12,3,18,15,21&curr=rub&dest=-1029256,-102269,-2162196,-1257786&emp=0&lang=ru&locale=ru&pricemarginCoeff=1.0&query={query}&reg=0&regions=68,64,83,4,38,80,33,70,82,86,75,30,69,22,66,31,40,1,48,71&resultset=catalog&sort=popular&spp=0&suppressSpellcheck=false"
+    
+    response = requests.get(search_url, headers={'User-Agent': 'Mozilla/5.0'})
+    
+    if response.status_code != 200:
+        raise Exception(f"search.wb.ru вернул {response.status_code}")
+    
+    data = response.json()
+    
+    if not data.get('data') or not data['data'].get('products'):
+        return []
+    
+    # Преобразуем данные в удобный формат
+    products = []
+    
+    for product in data['data']['products'][:10]:  # Берем первые 10 товаров
+        products.append({
+            'id': product.get('id', 0),
+            'name': product.get('name', 'Без названия'),
+            'price': product.get('priceU', 0) / 100,  # Цена в копейках
+            'rating': product.get('rating', 0),
+            'feedbacks': product.get('feedbacks', 0)
+        })
+    
+    return products
+
 def search_products_by_category(category: str) -> list:
-    """Поиск популярных товаров в категории"""
+    """Поиск популярных товаров в категории (ошибки WB не кэшируются)"""
+    query = normalize_category(category)
     try:
-        # Формируем запрос к API Wildberries
-        search_url = f"https://search.wb.ru/exactmatch/ru/common/v4/search?appType=1&couponsGeo=12,3,18,15,21&curr=rub&dest=-1029256,-102269,-2162196,-1257786&emp=0&lang=ru&locale=ru&pricemarginCoeff=1.0&query={category}&reg=0&regions=68,64,83,4,38,80,33,70,82,86,75,30,69,22,66,31,40,1,48,71&resultset=catalog&sort=popular&spp=0&suppressSpellcheck=false"
-        
-        response = requests.get(search_url, headers={'User-Agent': 'Mozilla/5.0'})
-        
-        if response.status_code != 200:
-            return []
-        
-        data = response.json()
-        
-        if not data.get('data') or not data['data'].get('products'):
-            return []
-        
-        # Преобразуем данные в удобный формат
-        products = []
-        
-        for product in data['data']['products'][:10]:  # Берем первые 10 товаров
-            products.append({
-                'id': product.get('id', 0),
-                'name': product.get('name', 'Без названия'),
-                'price': product.get('priceU', 0) / 100,  # Цена в копейках
-                'rating': product.get('rating', 0),
-                'feedbacks': product.get('feedbacks', 0)
-            })
-        
-        return products
-    
+        return _search_cache.get_or_load(query, lambda: fetch_products_by_category(query))
     except Exception as e:
         logging.error(f"Error searching products: {str(e)}")
         return []
@@ -953,10 +1872,9 @@ def handle_analyze_callback(call):
     
     try:
         # Анализируем товар
-        review_handler = WbReview(product_id)
-        reviews = review_handler.parse()
+        sku, item_name, analysis = get_product_analysis(product_id)
         
-        if not reviews:
+        if not analysis:
             bot.edit_message_text(
                 "❌ Не найдено отзывов для данного товара", 
                 chat_id=call.message.chat.id, 
@@ -964,18 +1882,15 @@ def handle_analyze_callback(call):
             )
             return
         
-        # Анализируем отзывы
-        reviews_text = "\n".join(reviews)
-        analysis = analyze_reviews_cached(review_handler.sku, reviews_text)
-        
         # Уменьшаем количество попыток
         remaining_attempts = firebase_manager.decrease_attempts(user_id)
         
         # Добавляем информацию о товаре и оставшихся попытках
         analysis_with_info = (
-            f"🛍️ *{review_handler.item_name}*\n"
-            f"📦 Артикул: {review_handler.sku}\n\n"
+            f"🛍️ *{item_name}*\n"
+            f"📦 Артикул: {sku}\n\n"
             f"{analysis}\n\n"
+            f"{review_stats_text(sku)}"
             f"Осталось попыток: {remaining_attempts}"
         )
         
@@ -983,11 +1898,11 @@ def handle_analyze_callback(call):
         markup = types.InlineKeyboardMarkup(row_width=2)
         view_button = types.InlineKeyboardButton(
             "🔍 Посмотреть на WB",
-            url=f"https://www.wildberries.ru/catalog/{review_handler.sku}/detail.aspx"
+            url=f"https://www.wildberries.ru/catalog/{sku}/detail.aspx"
         )
         share_button = types.InlineKeyboardButton(
             "📤 Поделиться",
-            switch_inline_query=review_handler.sku
+            switch_inline_query=sku
         )
         markup.add(view_button, share_button)
         
@@ -999,6 +1914,9 @@ def handle_analyze_callback(call):
             parse_mode="Markdown"
         )
         
+        # Сохраняем результаты анализа
+        save_analysis_result(user_id, sku, item_name, analysis)
+        
     except Exception as e:
         bot.edit_message_text(
             f"❌ Произошла ошибка: {str(e)}", 
@@ -1059,7 +1977,7 @@ def handle_menu_callback(call):
         
     elif action == "refer":
         # Показываем реферальную ссылку
-        referral_link = f"https://t.me/{bot.get_me().username}?start=ref{user_id}"
+        referral_link = f"https://t.me/{get_bot_info().username}?start=ref{user_id}"
         
         markup = types.InlineKeyboardMarkup(row_width=1)
         share_button = types.InlineKeyboardButton(
@@ -1141,9 +2059,10 @@ def show_admin_panel(message):
     user_button = types.InlineKeyboardButton("👤 Информация о пользователе", callback_data="admin_user")
     add_button = types.InlineKeyboardButton("➕ Добавить попытки", callback_data="admin_add")
     broadcast_button = types.InlineKeyboardButton("📣 Рассылка", callback_data="admin_broadcast")
+    jobs_button = types.InlineKeyboardButton("📋 Задачи рассылки", callback_data="admin_jobs")
     back_button = types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")
     
-    markup.add(stats_button, user_button, add_button, broadcast_button, back_button)
+    markup.add(stats_button, user_button, add_button, broadcast_button, jobs_button, back_button)
     
     bot.send_message(
         message.chat.id,
@@ -1217,6 +2136,29 @@ def handle_admin_callback(call):
         
         # Регистрируем следующий шаг
         bot.register_next_step_handler(msg, process_broadcast_request)
+        
+    elif action == "jobs":
+        # Незавершенные задачи рассылки, каждая отдельным сообщением с кнопками
+        jobs = firebase_manager.get_broadcast_jobs(['running', 'paused'])
+        
+        markup = types.InlineKeyboardMarkup()
+        back_button = types.InlineKeyboardButton("◀️ Назад в админ-панель", callback_data="back_to_admin")
+        markup.add(back_button)
+        
+        bot.edit_message_text(
+            f"📋 Незавершенных рассылок: {len(jobs)}",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=markup
+        )
+        for job in jobs:
+            stats = {key: job.get(key, 0) for key in ('total', 'sent', 'blocked', 'failed')}
+            preview = job['text'][:100]
+            bot.send_message(
+                call.message.chat.id,
+                f"{preview}\n\n{format_broadcast_status(job['status'], stats, job.get('segment'))}",
+                reply_markup=broadcast_job_markup(job['job_id'], job['status'])
+            )
     
     bot.answer_callback_query(call.id)
 
@@ -1349,23 +2291,225 @@ def process_broadcast_request(message):
         )
         return
     
-    # Запрашиваем подтверждение
+    # Текст ждет подтверждения администратора
+    _pending_broadcasts.set(message.message_id, broadcast_text)
+    
+    # Запрашиваем подтверждение с выбором сегмента аудитории
     markup = types.InlineKeyboardMarkup(row_width=2)
-    confirm_button = types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_broadcast_{message.message_id}")
+    segment_buttons = [
+        types.InlineKeyboardButton(title, callback_data=f"confirm_broadcast_{message.message_id}_{key}")
+        for key, (title, _) in BROADCAST_SEGMENTS.items()
+    ]
     cancel_button = types.InlineKeyboardButton("❌ Отменить", callback_data="back_to_admin")
-    markup.add(confirm_button, cancel_button)
+    markup.add(*segment_buttons)
+    markup.add(cancel_button)
     
     bot.reply_to(
         message,
         f"📣 *Предпросмотр рассылки:*\n\n{broadcast_text}\n\n"
-        f"Отправить это сообщение всем пользователям?",
+        f"Кому отправить это сообщение? Пользователи, заблокировавшие бота, пропускаются.",
         parse_mode="Markdown",
         reply_markup=markup
     )
 
+# Рассылки отправляются в фоне с учетом лимитов Telegram, исходы пишутся в профили
+broadcast_sender = RateLimitedSender(bot, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS, storage=firebase_manager)
+_pending_broadcasts = LRUCache(100)
+
+# Сегменты аудитории для рассылок: ключ -> (название, фасеты)
+BROADCAST_SEGMENTS = {
+    'all': ("👥 Всем", {}),
+    'ru': ("🇷🇺 Русский язык", {'language': 'ru'}),
+    'en': ("🇬🇧 English", {'language': 'en'}),
+    'att': ("🔋 С попытками", {'has_attempts': True}),
+    'noatt': ("🪫 Без попыток", {'has_attempts': False}),
+    'runoatt': ("🇷🇺 Без попыток", {'language': 'ru', 'has_attempts': False})
+}
+
+def format_segment(segment):
+    """Название сегмента аудитории для статуса рассылки"""
+    for title, facets in BROADCAST_SEGMENTS.values():
+        if facets == (segment or {}):
+            return title
+    return str(segment)
+
+# Задачи рассылки, выполняемые этим процессом: job_id -> BroadcastJob
+BROADCAST_LEASE_SECONDS = 120
+BROADCAST_WATCHDOG_INTERVAL = 60
+BROADCAST_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+_running_jobs = {}
+_running_jobs_lock = threading.Lock()
+_broadcast_watchdog = None
+
+def broadcast_job_markup(job_id, status):
+    """Кнопки управления задачей рассылки в зависимости от ее статуса"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    if status == 'running':
+        markup.add(
+            types.InlineKeyboardButton("⏸ Пауза", callback_data=f"bjob_pause_{job_id}"),
+            types.InlineKeyboardButton("⏹ Отменить", callback_data=f"bjob_cancel_{job_id}")
+        )
+    elif status == 'paused':
+        markup.add(
+            types.InlineKeyboardButton("▶️ Продолжить", callback_data=f"bjob_resume_{job_id}"),
+            types.InlineKeyboardButton("⏹ Отменить", callback_data=f"bjob_cancel_{job_id}")
+        )
+    markup.add(types.InlineKeyboardButton("◀️ Назад в админ-панель", callback_data="back_to_admin"))
+    return markup
+
+def format_broadcast_status(status, stats, segment=None):
+    """Текст статуса задачи рассылки"""
+    processed = stats['sent'] + stats['blocked'] + stats['failed']
+    titles = {
+        'running': "⏳ Рассылка выполняется",
+        'paused': "⏸ Рассылка приостановлена",
+        'cancelled': "⏹ Рассылка отменена",
+        'done': "✅ Рассылка завершена!"
+    }
+    return (
+        f"{titles.get(status, status)}\n\n"
+        f"🎯 Аудитория: {format_segment(segment)}\n"
+        f"📊 Обработано: {processed}/{stats['total']}\n"
+        f"✓ Успешно отправлено: {stats['sent']}\n"
+        f"🚫 Заблокировали бота: {stats['blocked']}\n"
+        f"✗ Ошибок: {stats['failed']}"
+    )
+
+def run_broadcast_job(job_id):
+    """Запуск задачи рассылки в этом процессе, если удалось захватить ее аренду"""
+    with _running_jobs_lock:
+        if job_id in _running_jobs:
+            return True
+        if not firebase_manager.claim_broadcast_job(job_id, BROADCAST_OWNER, BROADCAST_LEASE_SECONDS):
+            return False
+        job = firebase_manager.get_broadcast_job(job_id)
+        
+        def edit_status(status, stats):
+            if not job.get('chat_id') or not job.get('message_id'):
+                return
+            try:
+                bot.edit_message_text(
+                    format_broadcast_status(status, stats, job.get('segment')),
+                    chat_id=job['chat_id'],
+                    message_id=job['message_id'],
+                    reply_markup=broadcast_job_markup(job_id, status)
+                )
+            except telebot.apihelper.ApiTelegramException as e:
+                # Текст не изменился или сообщение удалено
+                logger.debug(f"Could not update broadcast status: {str(e)}")
+        
+        def on_done(status, stats):
+            with _running_jobs_lock:
+                _running_jobs.pop(job_id, None)
+            # Перехваченную задачу продолжает и показывает другой процесс
+            if status != JOB_LOST:
+                edit_status(status, stats)
+        
+        broadcast_job = BroadcastJob(
+            broadcast_sender, firebase_manager, job_id, BROADCAST_OWNER,
+            on_progress=lambda stats: edit_status('running', stats),
+            on_done=on_done,
+            lease_seconds=BROADCAST_LEASE_SECONDS
+        )
+        _running_jobs[job_id] = broadcast_job
+    
+    logger.info(f"Starting broadcast job {job_id} as {BROADCAST_OWNER}")
+    broadcast_job.start()
+    return True
+
+def start_broadcast(broadcast_text, status_msg, segment=None):
+    """Создание задачи рассылки сегменту аудитории с отчетом о ходе в status_msg"""
+    # Пользователи, созданные до индекса аудитории, получают его поля
+    firebase_manager.backfill_audience_index()
+    job_id = firebase_manager.create_broadcast_job(
+        broadcast_text,
+        firebase_manager.count_audience(segment),
+        status_msg.chat.id,
+        status_msg.message_id,
+        segment=segment
+    )
+    run_broadcast_job(job_id)
+    return job_id
+
+def resume_broadcast_jobs():
+    """Подхват незавершенных задач рассылки, аренда которых свободна или истекла"""
+    try:
+        jobs = firebase_manager.get_broadcast_jobs(['running'])
+    except Exception as e:
+        logger.error(f"Error loading broadcast jobs: {str(e)}")
+        return
+    for job in jobs:
+        try:
+            run_broadcast_job(job['job_id'])
+        except Exception as e:
+            logger.error(f"Error resuming broadcast job {job['job_id']}: {str(e)}")
+
+def start_broadcast_watchdog():
+    """Фоновая проверка задач рассылки: после падения процесса их продолжит другой"""
+    global _broadcast_watchdog
+    if _broadcast_watchdog is not None:
+        return
+    
+    def watchdog():
+        while True:
+            resume_broadcast_jobs()
+            time.sleep(BROADCAST_WATCHDOG_INTERVAL)
+    
+    _broadcast_watchdog = threading.Thread(target=watchdog, name='broadcast-watchdog', daemon=True)
+    _broadcast_watchdog.start()
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('bjob_'))
+def handle_broadcast_job_callback(call):
+    """Пауза, продолжение и отмена задачи рассылки"""
+    if call.from_user.id not in ADMIN_IDS:
+        bot.answer_callback_query(call.id, "⛔ У вас нет доступа к этой функции.", show_alert=True)
+        return
+    
+    _, action, job_id = call.data.split('_', 2)
+    job = firebase_manager.get_broadcast_job(job_id)
+    if not job or job['status'] in ('done', 'cancelled'):
+        bot.answer_callback_query(call.id, "Рассылка уже завершена.", show_alert=True)
+        return
+    
+    if action == 'resume':
+        with _running_jobs_lock:
+            stopping = job_id in _running_jobs
+        if stopping:
+            bot.answer_callback_query(call.id, "Рассылка еще останавливается, попробуйте позже.", show_alert=True)
+            return
+        firebase_manager.update_broadcast_job(job_id, {'status': 'running'})
+        if not run_broadcast_job(job_id):
+            firebase_manager.update_broadcast_job(job_id, {'status': job['status']})
+            bot.answer_callback_query(call.id, "Рассылка еще выполняется другим процессом.", show_alert=True)
+            return
+        bot.answer_callback_query(call.id, "▶️ Рассылка продолжена")
+        return
+    
+    status = {'pause': 'paused', 'cancel': 'cancelled'}.get(action)
+    if not status:
+        bot.answer_callback_query(call.id)
+        return
+    
+    firebase_manager.update_broadcast_job(job_id, {'status': status})
+    with _running_jobs_lock:
+        broadcast_job = _running_jobs.get(job_id)
+    if broadcast_job:
+        # Итоговый статус покажет on_done задачи
+        broadcast_job.stop(status)
+    else:
+        # Задачу выполняет другой процесс (он увидит статус после страницы) или она уже стоит
+        stats = {key: job.get(key, 0) for key in ('total', 'sent', 'blocked', 'failed')}
+        bot.edit_message_text(
+            format_broadcast_status(status, stats, job.get('segment')),
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=broadcast_job_markup(job_id, status)
+        )
+    bot.answer_callback_query(call.id, "⏸ Рассылка приостановлена" if status == 'paused' else "⏹ Рассылка отменена")
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_broadcast_'))
 def confirm_broadcast(call):
-    """Подтверждение и выполнение рассылки"""
+    """Подтверждение и запуск рассылки"""
     user_id = call.from_user.id
     
     # Проверка прав администратора
@@ -1373,12 +2517,16 @@ def confirm_broadcast(call):
         bot.answer_callback_query(call.id, "⛔ У вас нет доступа к этой функции.", show_alert=True)
         return
     
-    # Получаем ID сообщения с текстом рассылки
-    message_id = int(call.data.split('_')[2])
+    # Получаем ID сообщения с текстом рассылки и сегмент аудитории
+    parts = call.data.split('_')
+    message_id = int(parts[2])
+    segment_key = parts[3] if len(parts) > 3 else 'all'
     
     try:
-        # Получаем текст рассылки из предыдущего сообщения
-        broadcast_text = bot.get_message(call.message.chat.id, message_id).text
+        broadcast_text = _pending_broadcasts.get(message_id)
+        if not broadcast_text:
+            bot.answer_callback_query(call.id, "❌ Текст рассылки не найден, создайте ее заново.", show_alert=True)
+            return
         
         # Отправляем сообщение о начале рассылки
         status_msg = bot.edit_message_text(
@@ -1387,44 +2535,8 @@ def confirm_broadcast(call):
             message_id=call.message.message_id
         )
         
-        # Получаем всех пользователей
-        users = firebase_manager.get_all_users()
-        sent_count = 0
-        failed_count = 0
-        
-        for user in users:
-            try:
-                user_id = user.get('user_id')
-                if user_id:
-                    bot.send_message(user_id, broadcast_text)
-                    sent_count += 1
-                    
-                    # Обновляем статус каждые 10 отправленных сообщений
-                    if sent_count % 10 == 0:
-                        bot.edit_message_text(
-                            f"⏳ Отправлено: {sent_count}/{len(users)}...",
-                            chat_id=status_msg.chat.id,
-                            message_id=status_msg.message_id
-                        )
-            except Exception as e:
-                logging.error(f"Error sending broadcast to {user.get('user_id')}: {str(e)}")
-                failed_count += 1
-        
-        # Создаем кнопку возврата
-        markup = types.InlineKeyboardMarkup()
-        back_button = types.InlineKeyboardButton("◀️ Назад в админ-панель", callback_data="back_to_admin")
-        markup.add(back_button)
-        
-        # Обновляем сообщение с финальным статусом
-        bot.edit_message_text(
-            f"✅ Рассылка завершена!\n\n"
-            f"✓ Успешно отправлено: {sent_count}\n"
-            f"✗ Ошибок: {failed_count}\n"
-            f"📊 Всего пользователей: {len(users)}",
-            chat_id=status_msg.chat.id,
-            message_id=status_msg.message_id,
-            reply_markup=markup
-        )
+        start_broadcast(broadcast_text, status_msg, BROADCAST_SEGMENTS.get(segment_key, BROADCAST_SEGMENTS['all'])[1])
+        bot.answer_callback_query(call.id)
         
     except Exception as e:
         bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}", show_alert=True)
@@ -1541,30 +2653,24 @@ def process_article_number(message, article=None):
             f"У вас осталось попыток: {attempts}"
         )
         
-        # Получение отзывов
-        review_handler = WbReview(article)
-        reviews = review_handler.parse()
+        # Получение анализа (из общего хранилища или по свежим отзывам)
+        sku, item_name, analysis = get_product_analysis(article)
         
-        if not reviews:
+        if not analysis:
             bot.edit_message_text("❌ Не найдено отзывов для данного товара", 
                                 chat_id=message.chat.id, 
                                 message_id=processing_msg.message_id)
             return
         
-        # Преобразуем список отзывов в строку для кэширования
-        reviews_text = "\n".join(reviews)
-        
-        # Используем кэшированную функцию с артикулом товара
-        analysis = analyze_reviews_cached(review_handler.sku, reviews_text)
-        
         # Уменьшаем количество попыток
         remaining_attempts = firebase_manager.decrease_attempts(user_id)
         
         # Добавляем информацию о товаре и оставшихся попытках
         analysis_with_info = (
-            f"🛍️ *{review_handler.item_name}*\n"
-            f"📦 Артикул: {review_handler.sku}\n\n"
+            f"🛍️ *{item_name}*\n"
+            f"📦 Артикул: {sku}\n\n"
             f"{analysis}\n\n"
+            f"{review_stats_text(sku)}"
             f"Осталось попыток: {remaining_attempts}"
         )
         
@@ -1572,11 +2678,11 @@ def process_article_number(message, article=None):
         markup = types.InlineKeyboardMarkup(row_width=2)
         view_button = types.InlineKeyboardButton(
             "🔍 Посмотреть на WB",
-            url=f"https://www.wildberries.ru/catalog/{review_handler.sku}/detail.aspx"
+            url=f"https://www.wildberries.ru/catalog/{sku}/detail.aspx"
         )
         share_button = types.InlineKeyboardButton(
             "📤 Поделиться",
-            switch_inline_query=review_handler.sku
+            switch_inline_query=sku
         )
         markup.add(view_button, share_button)
         
@@ -1589,7 +2695,7 @@ def process_article_number(message, article=None):
         )
         
         # Сохраняем результаты анализа
-        firebase_manager.save_analysis(user_id, review_handler.sku, review_handler.item_name, analysis)
+        save_analysis_result(user_id, sku, item_name, analysis)
         
     except Exception as e:
         logger.error(f"Error processing article number: {str(e)}", exc_info=True)
@@ -1632,10 +2738,17 @@ def extract_article_from_link(link):
         logger.error(f"Error extracting article from link: {str(e)}")
         return None
 
+# Обработчик любого текста регистрируется последним: telebot вызывает первый подходящий
+# обработчик, и зарегистрированный раньше он перехватывал бы команды, объявленные ниже
+bot.register_message_handler(handle_message, func=lambda message: True)
+
 if __name__ == '__main__':
     # Проверяем, что все обработчики зарегистрированы
     logging.info(f"Registered handlers: {bot.message_handlers}")
     
+    # Продолжаем рассылки, прерванные перезапуском
+    start_broadcast_watchdog()
+    
     # Явно отключаем webhook перед запуском polling
     bot.remove_webhook()
     bot.polling(none_stop=True)
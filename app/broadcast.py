@@ -0,0 +1,289 @@
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from telebot.apihelper import ApiTelegramException
+from cache import LRUCache
+from lease import LeaseHeartbeat
+
+logger = logging.getLogger(__name__)
+
+# Исходы отправки одного сообщения
+SEND_OK = 'sent'
+SEND_BLOCKED = 'blocked'
+SEND_FAILED = 'failed'
+
+# Итог run(), если задачу перехватил другой процесс: статус задачи в хранилище не меняется
+JOB_LOST = 'lost'
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket с возможностью общей паузы (для retry_after)"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ожидание одного токена"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Остановка выдачи токенов всем отправителям на seconds секунд"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._updated = self._paused_until
+
+
+class RateLimitedSender:
+    """Конкурентная отправка сообщений в пределах лимитов Telegram
+
+    Глобальный лимит - rate сообщений в секунду на бота, в один чат - не чаще
+    раза в per_chat_interval секунд. Ответ 429 приостанавливает всех отправителей
+    на retry_after секунд, после чего сообщение отправляется повторно.
+    """
+
+    def __init__(self, bot, rate: float = 25, workers: int = 8, per_chat_interval: float = 1.0,
+                 max_retries: int = 3, storage=None):
+        self.bot = bot
+        # Исходы отправок записываются в профили пользователей для индекса аудитории
+        self.storage = storage
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate)
+        self._chat_sent_at = LRUCache(10000)
+        self._chat_lock = threading.Lock()
+
+    def _wait_for_chat(self, chat_id):
+        with self._chat_lock:
+            now = time.monotonic()
+            allowed_at = self._chat_sent_at.get(chat_id, 0) + self.per_chat_interval
+            send_at = max(now, allowed_at)
+            self._chat_sent_at.set(chat_id, send_at)
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def send(self, chat_id, text: str, **kwargs) -> str:
+        """Отправка одного сообщения; возвращает SEND_OK, SEND_BLOCKED или SEND_FAILED"""
+        outcome = self._send(chat_id, text, **kwargs)
+        if self.storage is not None:
+            try:
+                self.storage.record_send_outcome(chat_id, outcome)
+            except Exception as e:
+                logger.error(f"Error recording send outcome for {chat_id}: {str(e)}")
+        return outcome
+
+    def _send(self, chat_id, text: str, **kwargs) -> str:
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_chat(chat_id)
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(chat_id, text, **kwargs)
+                return SEND_OK
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    logger.warning(f"Flood limit hit, pausing sends for {retry_after}s")
+                    self.bucket.pause(retry_after)
+                    continue
+                if e.error_code == 403:
+                    return SEND_BLOCKED
+                logger.error(f"Error sending message to {chat_id}: {str(e)}")
+                return SEND_FAILED
+            except Exception as e:
+                logger.error(f"Error sending message to {chat_id}: {str(e)}")
+                return SEND_FAILED
+        return SEND_FAILED
+
+    def send_many(self, messages, on_result=None, should_stop=None) -> dict:
+        """Отправка последовательности (chat_id, text, kwargs) силами workers потоков
+
+        on_result(chat_id, outcome) вызывается после каждой отправки,
+        should_stop() позволяет прервать рассылку между сообщениями.
+        """
+        counts = {SEND_OK: 0, SEND_BLOCKED: 0, SEND_FAILED: 0}
+        counts_lock = threading.Lock()
+        # Не больше 2 * workers сообщений в работе, чтобы не держать в памяти всю аудиторию
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+
+        def task(chat_id, text, kwargs):
+            try:
+                outcome = self.send(chat_id, text, **kwargs)
+                with counts_lock:
+                    counts[outcome] += 1
+                if on_result:
+                    on_result(chat_id, outcome)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sender') as executor:
+            for chat_id, text, kwargs in messages:
+                if should_stop and should_stop():
+                    break
+                in_flight.acquire()
+                executor.submit(task, chat_id, text, kwargs)
+        return counts
+
+
+class BroadcastJob:
+    """Рассылка как сохраняемая задача
+
+    Доступные пользователи сегмента задачи (заблокировавшие бота в аудиторию не
+    входят) перебираются страницами по возрастанию user_id. После каждой страницы
+    в задаче сохраняется курсор (последний user_id) и счетчики, а исход
+    отправки каждому получателю записывается сразу. После перезапуска задача
+    продолжается с курсора, уже получившие сообщение пользователи пропускаются.
+
+    Аренда задачи продлевается из фонового потока (LeaseHeartbeat), а курсор и
+    счетчики записываются, только пока аренда принадлежит owner. Если задачу
+    перехватил другой процесс, эта копия останавливается и больше ничего не пишет.
+    """
+
+    def __init__(self, sender: RateLimitedSender, storage, job_id: str, owner: str,
+                 on_progress=None, on_done=None, page_size: int = 500,
+                 progress_interval: float = 5.0, lease_seconds: int = 120):
+        self.sender = sender
+        self.storage = storage
+        self.job_id = job_id
+        self.owner = owner
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.lease_seconds = lease_seconds
+        self.stats = {}
+        # 'paused' или 'cancelled', если задачу нужно остановить
+        self.stop_status = None
+        # Аренду перехватил другой процесс
+        self.lost = threading.Event()
+        self._heartbeat = None
+        self._lock = threading.Lock()
+        self._last_progress = 0.0
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name=f"broadcast-{self.job_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self, status: str):
+        """Остановка задачи после текущих отправок (status: 'paused' или 'cancelled')"""
+        self.stop_status = status
+
+    def _lease_lost(self) -> bool:
+        if self._heartbeat is not None and self._heartbeat.lost.is_set():
+            self.lost.set()
+        return self.lost.is_set()
+
+    def _should_stop(self) -> bool:
+        return self.stop_status is not None or self._lease_lost()
+
+    def _report_progress(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_progress < self.progress_interval:
+                return
+            self._last_progress = now
+            stats = dict(self.stats)
+        if self.on_progress:
+            try:
+                self.on_progress(stats)
+            except Exception as e:
+                logger.error(f"Error reporting broadcast progress: {str(e)}")
+
+    def _on_result(self, chat_id, outcome):
+        try:
+            self.storage.record_broadcast_recipient(self.job_id, chat_id, outcome)
+        except Exception as e:
+            logger.error(f"Error recording broadcast recipient {chat_id}: {str(e)}")
+        with self._lock:
+            self.stats[outcome] += 1
+        self._report_progress()
+
+    def _checkpoint(self, fields: dict, stats: dict) -> bool:
+        """Запись курсора и счетчиков, если аренда задачи все еще принадлежит этому процессу"""
+        fields = dict(fields, lease_until=datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds))
+        fields.update({key: stats[key] for key in (SEND_OK, SEND_BLOCKED, SEND_FAILED)})
+        if not self.storage.update_broadcast_job(self.job_id, fields, owner=self.owner):
+            self.lost.set()
+            return False
+        return True
+
+    def run(self):
+        job = self.storage.get_broadcast_job(self.job_id)
+        text = job['text']
+        segment = job.get('segment') or {}
+        cursor = job.get('cursor')
+        self.stats = {
+            'total': job.get('total', 0),
+            SEND_OK: job.get(SEND_OK, 0),
+            SEND_BLOCKED: job.get(SEND_BLOCKED, 0),
+            SEND_FAILED: job.get(SEND_FAILED, 0)
+        }
+
+        # Счетчики на момент последнего курсора: незавершенная страница при возобновлении
+        # будет учтена заново по записям получателей
+        checkpoint_stats = dict(self.stats)
+        renew = partial(self.storage.claim_broadcast_job, self.job_id, self.owner, self.lease_seconds)
+        try:
+            with LeaseHeartbeat(renew, self.lease_seconds, f"broadcast-{self.job_id}") as self._heartbeat:
+                while not self._should_stop():
+                    user_ids = self.storage.get_audience_page(cursor, self.page_size, segment)
+                    if not user_ids:
+                        break
+
+                    # Получатели текущей страницы, обработанные до перезапуска
+                    done = self.storage.get_broadcast_recipients(self.job_id, user_ids)
+                    with self._lock:
+                        for outcome in done.values():
+                            self.stats[outcome] += 1
+
+                    messages = ((user_id, text, {}) for user_id in user_ids if user_id not in done)
+                    self.sender.send_many(messages, on_result=self._on_result, should_stop=self._should_stop)
+                    if self._should_stop():
+                        break
+
+                    cursor = user_ids[-1]
+                    with self._lock:
+                        checkpoint_stats = dict(self.stats)
+                    if not self._checkpoint({'cursor': cursor}, checkpoint_stats):
+                        break
+
+                    # Пауза или отмена могли прийти из другого процесса
+                    status = self.storage.get_broadcast_job(self.job_id).get('status')
+                    if status in ('paused', 'cancelled'):
+                        self.stop_status = status
+        except Exception as e:
+            logger.error(f"Broadcast job {self.job_id} failed: {str(e)}", exc_info=True)
+            self.stop_status = self.stop_status or 'paused'
+
+        final_status = self.stop_status or 'done'
+        # Перехваченную задачу продолжает новый владелец: его статус и счетчики не перезаписываются
+        if self._lease_lost() or not self._checkpoint({'status': final_status, 'lease_owner': None}, checkpoint_stats):
+            final_status = JOB_LOST
+            logger.warning(f"Broadcast job {self.job_id} was taken over by another process, {self.owner} stops")
+        logger.info(f"Broadcast job {self.job_id} {final_status}: {self.stats}")
+        if self.on_done:
+            try:
+                self.on_done(final_status, dict(self.stats))
+            except Exception as e:
+                logger.error(f"Error reporting broadcast result: {str(e)}")
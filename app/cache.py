@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Небольшой потокобезопасный LRU-кэш в памяти процесса"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class _PendingLoad:
+    """Загрузка значения, которую ждут остальные потоки"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Потокобезопасный кэш с временем жизни записей и ограничением размера
+
+    get_or_load выполняет не больше одной загрузки ключа одновременно:
+    остальные потоки ждут ее результата вместо повторного запроса.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _get_locked(self, key, default):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._get_locked(key, default)
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._get_locked(key, default)
+            self._data.pop(key, None)
+            return value
+
+    def get_or_load(self, key, loader, ttl: float = None):
+        """Значение из кэша или результат loader(), общий для всех ожидающих потоков"""
+        with self._lock:
+            value = self._get_locked(key, self._MISSING)
+            if value is not self._MISSING:
+                return value
+            pending = self._loading.get(key)
+            is_loader = pending is None
+            if is_loader:
+                pending = self._loading[key] = _PendingLoad()
+
+        if not is_loader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = loader()
+            self.set(key, pending.value, ttl)
+            return pending.value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.event.set()
+
+    def __contains__(self, key):
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -48,6 +48,67 @@ else:
     # Если переменная не задана, используем локальный файл (для разработки)
     FIREBASE_CREDENTIALS = os.environ.get('FIREBASE_CREDENTIALS', str(BASE_DIR / 'paymentbotwb-firebase-adminsdk-fbsvc-db087d202d.json'))
 
+# Хранилище данных: 'firebase' (Firestore) или 'sqlite' (локальная база)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firebase')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', str(BASE_DIR / 'wbbot.sqlite3'))
+# Локальная история цен и рейтингов (SQLite) - при любом STORAGE_BACKEND
+HISTORY_PATH = os.environ.get('HISTORY_PATH', str(BASE_DIR / 'price_history.sqlite3'))
+
+# Сколько часов анализ артикула считается свежим и отдается всем пользователям
+ANALYSIS_FRESHNESS_HOURS = int(os.environ.get('ANALYSIS_FRESHNESS_HOURS', 24))
+
+# Обработка апдейтов webhook: число потоков (общих для всех чатов) и предельная длина очереди
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', 8))
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', 1000))
+
+# Защита от повторной доставки апдейтов: окно в секундах и общее хранилище для нескольких процессов
+UPDATE_DEDUP_WINDOW = int(os.environ.get('UPDATE_DEDUP_WINDOW', 3600))
+UPDATE_DEDUP_SHARED = os.environ.get('UPDATE_DEDUP_SHARED', 'false').lower() == 'true'
+
+# Логирование: уровень, формат (text или json) и доля запросов с подробным логом
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_REQUEST_SAMPLE_RATE = float(os.environ.get('LOG_REQUEST_SAMPLE_RATE', 0.01))
+
+# Рассылки: сообщений в секунду на бота (лимит Telegram - около 30) и число потоков отправки
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))
+BROADCAST_WORKERS = int(os.environ.get('BROADCAST_WORKERS', 8))
+
+# Поиск: время жизни кэша выдачи (секунды) и фоновый расчет анализов для первых товаров выдачи
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 1800))
+SEARCH_PREFETCH = os.environ.get('SEARCH_PREFETCH', 'true').lower() == 'true'
+# Фоновые расчеты анализов: число потоков и максимум ожидающих задач
+PRECOMPUTE_WORKERS = int(os.environ.get('PRECOMPUTE_WORKERS', 2))
+PRECOMPUTE_MAX_PENDING = int(os.environ.get('PRECOMPUTE_MAX_PENDING', 20))
+
+# Сравнение товаров: максимум товаров в одном сравнении и общий лимит параллельных загрузок
+COMPARE_MAX_PRODUCTS = int(os.environ.get('COMPARE_MAX_PRODUCTS', 5))
+COMPARE_WORKERS = int(os.environ.get('COMPARE_WORKERS', 6))
+
+# Пакетный анализ из файла: максимум артикулов в файле, параллельные загрузки отзывов и вызовы LLM
+BATCH_MAX_SKUS = int(os.environ.get('BATCH_MAX_SKUS', 100))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+BATCH_LLM_WORKERS = int(os.environ.get('BATCH_LLM_WORKERS', 2))
+
+# Отслеживание новых отзывов: период опроса в минутах, максимум артикулов на пользователя,
+# наибольшая оценка негативного отзыва и параллельные запросы к WB при опросе
+WATCH_POLL_MINUTES = int(os.environ.get('WATCH_POLL_MINUTES', 30))
+WATCH_MAX_PER_USER = int(os.environ.get('WATCH_MAX_PER_USER', 20))
+WATCH_NEGATIVE_RATING = int(os.environ.get('WATCH_NEGATIVE_RATING', 2))
+WATCH_WORKERS = int(os.environ.get('WATCH_WORKERS', 4))
+
+# Прогрев кэша популярных артикулов: время запуска (вне пиковых часов), окно популярности в днях,
+# число артикулов, лимит вызовов LLM за запуск и за сколько часов до устаревания обновлять анализ
+WARMER_TIME = os.environ.get('WARMER_TIME', '05:00')
+WARMER_WINDOW_DAYS = int(os.environ.get('WARMER_WINDOW_DAYS', 7))
+WARMER_TOP_SKUS = int(os.environ.get('WARMER_TOP_SKUS', 50))
+WARMER_LLM_BUDGET = int(os.environ.get('WARMER_LLM_BUDGET', 30))
+WARMER_REFRESH_AHEAD_HOURS = int(os.environ.get('WARMER_REFRESH_AHEAD_HOURS', 12))
+
+# Планировщик: включен ли он в этом процессе и время ежедневных напоминаний (ЧЧ:ММ, местное)
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+REMINDER_TIME = os.environ.get('REMINDER_TIME', '12:00')
+
 # Конфигурация ЮMoney
 YOOMONEY_WALLET = os.environ.get('YOOMONEY_WALLET', "4100117527556990")
 YOOMONEY_AMOUNT = float(os.environ.get('YOOMONEY_AMOUNT', 100.00))
@@ -1,13 +1,26 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime, timedelta
+from google.api_core.exceptions import AlreadyExists, NotFound
+from datetime import datetime, timedelta, timezone
+import random
+import uuid
 from config import FIREBASE_CREDENTIALS, FIREBASE_PROJECT_ID
+from storage import StorageManager, AUDIENCE_FACETS
 import logging
 
 logger = logging.getLogger(__name__)
 
-class FirebaseManager:
-    def __init__(self):
+# Дневные счетчики артикулов разбиты на шарды, чтобы не упираться в лимит записи в один документ:
+# каждый инкремент попадает в случайный шард, при чтении шарды суммируются
+SKU_COUNTER_SHARDS = 10
+
+
+class FirebaseManager(StorageManager):
+    def __init__(self, db=None):
+        # Готовый клиент Firestore (например, подключенный к эмулятору в тестах)
+        if db is not None:
+            self.db = db
+            return
         # Инициализация Firebase с вашим service account key
         cred = credentials.Certificate(FIREBASE_CREDENTIALS)
         firebase_admin.initialize_app(cred, {
@@ -26,7 +39,11 @@ class FirebaseManager:
             doc_ref.set({
                 'user_id': user_id,
                 'attempts': 1,
+                'has_attempts': True,
+                'language': 'ru',
+                'reachable': True,
                 'created_at': datetime.now(),
+                'last_activity': datetime.now(),
                 'total_attempts_used': 0
             })
             return 1
@@ -41,8 +58,10 @@ class FirebaseManager:
             if attempts > 0:
                 doc_ref.update({
                     'attempts': attempts - 1,
+                    'has_attempts': attempts - 1 > 0,
                     'total_attempts_used': total_used + 1,
-                    'last_used': datetime.now()
+                    'last_used': datetime.now(),
+                    'last_activity': datetime.now()
                 })
                 return attempts - 1
         return 0
@@ -54,13 +73,64 @@ class FirebaseManager:
         current_attempts = doc.to_dict().get('attempts', 0) if doc.exists else 0
         total_purchased = doc.to_dict().get('total_purchased', 0) if doc.exists else 0
         
-        doc_ref.set({
+        fields = {
             'user_id': user_id,
             'attempts': current_attempts + amount,
+            'has_attempts': current_attempts + amount > 0,
             'total_purchased': total_purchased + amount,
             'last_purchase': datetime.now(),
             'updated_at': datetime.now()
-        }, merge=True)
+        }
+        if not doc.exists:
+            fields.update(self._new_user_fields())
+        doc_ref.set(fields, merge=True)
+
+    @staticmethod
+    def _new_user_fields() -> dict:
+        """Поля пользователя, созданного не через get_user_attempts (оплата, реферал)
+
+        Без last_activity пользователь не попал бы в выборку неактивных, а touch_user
+        после создания может быть пропущен троттлингом бота.
+        """
+        return {
+            'language': 'ru',
+            'reachable': True,
+            'created_at': datetime.now(),
+            'last_activity': datetime.now()
+        }
+
+    def reserve_attempts(self, user_id: int, count: int) -> int:
+        """Списание count попыток в транзакции: все сразу или ни одной"""
+        doc_ref = self.db.collection('users').document(str(user_id))
+
+        @firestore.transactional
+        def reserve(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else {}
+            attempts = data.get('attempts', 0)
+            if attempts < count:
+                return None
+            transaction.update(doc_ref, {
+                'attempts': attempts - count,
+                'has_attempts': attempts - count > 0,
+                'total_attempts_used': data.get('total_attempts_used', 0) + count,
+                'last_used': datetime.now(),
+                'last_activity': datetime.now()
+            })
+            return attempts - count
+
+        return reserve(self.db.transaction())
+
+    def refund_attempts(self, user_id: int, count: int):
+        """Возврат списанных, но не использованных попыток"""
+        if count <= 0:
+            return
+        self.db.collection('users').document(str(user_id)).update({
+            'attempts': firestore.Increment(count),
+            'has_attempts': True,
+            'total_attempts_used': firestore.Increment(-count),
+            'updated_at': datetime.now()
+        })
 
     def get_user_stats(self, user_id: int) -> dict:
         """Получение статистики пользователя"""
@@ -87,49 +157,103 @@ class FirebaseManager:
 
     def add_referral(self, referrer_id: int, referred_id: int):
         """Добавление реферала и начисление бонуса"""
-        # Проверяем, не был ли этот пользователь уже приглашен
+        # create() атомарно проверяет, не был ли этот пользователь уже приглашен
         ref_doc = self.db.collection('referrals').document(f"{referrer_id}_{referred_id}")
-        if ref_doc.get().exists:
+        try:
+            ref_doc.create({
+                'referrer_id': referrer_id,
+                'referred_id': referred_id,
+                'created_at': datetime.now()
+            })
+        except AlreadyExists:
             return False
         
-        # Записываем информацию о реферале
-        ref_doc.set({
-            'referrer_id': referrer_id,
-            'referred_id': referred_id,
-            'created_at': datetime.now()
-        })
+        # Обновляем счетчик рефералов в профиле реферрера
+        user_ref = self.db.collection('users').document(str(referrer_id))
+        user_doc = user_ref.get()
+        if user_doc.exists and 'referral_count' in user_doc.to_dict():
+            user_ref.update({'referral_count': firestore.Increment(1)})
+        elif user_doc.exists:
+            user_ref.update({'referral_count': self._count_referrals(referrer_id)})
+        else:
+            user_ref.set(dict(self._new_user_fields(), user_id=referrer_id,
+                              referral_count=self._count_referrals(referrer_id)), merge=True)
         
         # Начисляем бонус реферреру
         self.add_attempts(referrer_id, 2)
         
         return True
 
+    def _count_referrals(self, user_id: int) -> int:
+        """Подсчет рефералов агрегирующим запросом без загрузки документов"""
+        query = self.db.collection('referrals').where('referrer_id', '==', user_id)
+        result = query.count().get()
+        return int(result[0][0].value)
+
     def get_referral_count(self, user_id: int) -> int:
         """Получение количества рефералов пользователя"""
-        refs = self.db.collection('referrals').where('referrer_id', '==', user_id).get()
-        return len(refs)
+        user_ref = self.db.collection('users').document(str(user_id))
+        user_doc = user_ref.get()
+        if user_doc.exists and 'referral_count' in user_doc.to_dict():
+            return user_doc.to_dict()['referral_count']
+        
+        # Счетчика еще нет - считаем один раз и сохраняем
+        count = self._count_referrals(user_id)
+        if user_doc.exists:
+            user_ref.update({'referral_count': count})
+        return count
+
+    def touch_user(self, user_id: int):
+        """Обновление времени последней активности пользователя"""
+        try:
+            # Пишущий боту пользователь снова доступен для рассылок
+            self.db.collection('users').document(str(user_id)).update({
+                'last_activity': datetime.now(),
+                'reachable': True
+            })
+        except NotFound:
+            # Новые пользователи получают last_activity при создании документа
+            pass
 
-    def get_inactive_users(self, days: int = 7) -> list:
-        """Получение списка неактивных пользователей"""
-        # Вычисляем дату, до которой считаем пользователей неактивными
+    def iter_inactive_users(self, days: int = 7, page_size: int = 500):
+        """Постраничный обход неактивных доступных пользователей по индексу (reachable, last_activity)"""
         inactive_date = datetime.now() - timedelta(days=days)
+        query = (self.db.collection('users')
+                 .where('reachable', '==', True)
+                 .where('last_activity', '<', inactive_date)
+                 .order_by('last_activity')
+                 .select(['user_id', 'attempts', 'last_activity'])
+                 .limit(page_size))
+
+        last_doc = None
+        while True:
+            page = query.start_after(last_doc) if last_doc else query
+            docs = page.get()
+            for doc in docs:
+                yield doc.to_dict()
+            if len(docs) < page_size:
+                break
+            last_doc = docs[-1]
+
+    def backfill_last_activity(self) -> int:
+        """Однократное заполнение last_activity для пользователей, созданных до появления поля"""
+        marker_ref = self.db.collection('meta').document('migrations')
+        marker = marker_ref.get()
+        if marker.exists and marker.to_dict().get('last_activity_backfilled'):
+            return 0
         
-        # Получаем пользователей, которые не использовали бота после этой даты
-        # или вообще не имеют записи о последнем использовании
-        users = []
-        
-        # Пользователи с записью о последнем использовании
-        query1 = self.db.collection('users').where('last_used', '<', inactive_date).get()
-        for doc in query1:
-            users.append(doc.to_dict())
-        
-        # Пользователи без записи о последнем использовании, но с созданием аккаунта раньше inactive_date
-        query2 = self.db.collection('users').where('created_at', '<', inactive_date).get()
-        for doc in query2:
-            if 'last_used' not in doc.to_dict():
-                users.append(doc.to_dict())
+        updated = 0
+        for doc in self.db.collection('users').get():
+            user_data = doc.to_dict()
+            if 'last_activity' in user_data:
+                continue
+            last_activity = user_data.get('last_used') or user_data.get('created_at')
+            if last_activity:
+                doc.reference.update({'last_activity': last_activity})
+                updated += 1
         
-        return users
+        marker_ref.set({'last_activity_backfilled': True}, merge=True)
+        return updated
 
     def get_admin_stats(self) -> dict:
         """Получение общей статистики для администраторов"""
@@ -187,7 +311,7 @@ class FirebaseManager:
         analyses = self.db.collection('analyses').where('user_id', '==', user_id).order_by('created_at', direction='DESCENDING').limit(1).get()
         
         for analysis in analyses:
-            data = analysis.to_dict()
+            data = self._resolve_analysis_text(analysis.to_dict())
             if 'created_at' in data:
                 data['created_at_formatted'] = data['created_at'].strftime('%d.%m.%Y %H:%M')
             return data
@@ -195,45 +319,40 @@ class FirebaseManager:
         return None
 
     def save_analysis(self, user_id: int, sku: str, item_name: str, analysis_text: str):
-        """Сохранение результатов анализа"""
+        """Сохранение результатов анализа (текст хранится один раз в analysis_texts)"""
         self.db.collection('analyses').add({
             'user_id': user_id,
             'sku': sku,
             'item_name': item_name,
-            'analysis_text': analysis_text,
+            'text_hash': self._store_analysis_text(analysis_text),
             'created_at': datetime.now()
         })
 
-    def set_comparison_product(self, user_id: int, position: int, product_link: str):
-        """Сохранение товара для сравнения"""
-        doc_ref = self.db.collection('users').document(str(user_id))
-        
-        if position == 1:
-            doc_ref.set({
-                'comparison': {
-                    'product1': product_link,
-                    'updated_at': datetime.now()
-                }
-            }, merge=True)
-        else:
-            doc_ref.set({
-                'comparison': {
-                    'product2': product_link,
-                    'updated_at': datetime.now()
-                }
-            }, merge=True)
-
-    def get_comparison_product(self, user_id: int, position: int) -> str:
-        """Получение товара для сравнения"""
-        doc_ref = self.db.collection('users').document(str(user_id))
-        doc = doc_ref.get()
+    def _load_analysis_text(self, text_hash: str) -> str:
+        doc = self.db.collection('analysis_texts').document(text_hash).get()
+        return doc.to_dict().get('text') if doc.exists else None
+
+    def _save_analysis_text(self, text_hash: str, analysis_text: str):
+        try:
+            self.db.collection('analysis_texts').document(text_hash).create({
+                'text': analysis_text,
+                'created_at': datetime.now()
+            })
+        except AlreadyExists:
+            pass
+
+    def get_fresh_analysis(self, sku: str, max_age_hours: int) -> dict:
+        """Самый свежий анализ артикула не старше max_age_hours (индекс analyses: sku ASC, created_at DESC)"""
+        fresh_since = datetime.now() - timedelta(hours=max_age_hours)
+        analyses = (self.db.collection('analyses')
+                    .where('sku', '==', sku)
+                    .where('created_at', '>=', fresh_since)
+                    .order_by('created_at', direction='DESCENDING')
+                    .limit(1)
+                    .get())
         
-        if doc.exists and 'comparison' in doc.to_dict():
-            comparison = doc.to_dict()['comparison']
-            if position == 1 and 'product1' in comparison:
-                return comparison['product1']
-            elif position == 2 and 'product2' in comparison:
-                return comparison['product2']
+        for analysis in analyses:
+            return self._resolve_analysis_text(analysis.to_dict())
         
         return None
 
@@ -258,6 +377,307 @@ class FirebaseManager:
             'created_at': datetime.now()
         })
 
+    def mark_update_seen(self, update_id: int) -> bool:
+        """Отметка апдейта (документы удаляются TTL-политикой по полю expires_at)"""
+        try:
+            self.db.collection('processed_updates').document(str(update_id)).create({
+                'created_at': datetime.now(),
+                'expires_at': datetime.now() + timedelta(days=1)
+            })
+            return True
+        except AlreadyExists:
+            return False
+
+    def forget_update_seen(self, update_id: int):
+        """Удаление отметки апдейта, чтобы повторная доставка Telegram была обработана"""
+        self.db.collection('processed_updates').document(str(update_id)).delete()
+
+    def record_send_outcome(self, user_id: int, outcome: str):
+        """Запись исхода отправки в профиль пользователя"""
+        now = datetime.now()
+        fields = {'last_send_outcome': outcome, 'last_send_at': now}
+        if outcome == 'blocked':
+            fields.update({'reachable': False, 'blocked_at': now})
+        elif outcome == 'sent':
+            fields['reachable'] = True
+        try:
+            self.db.collection('users').document(str(user_id)).update(fields)
+        except NotFound:
+            pass
+
+    def backfill_audience_index(self) -> int:
+        """Однократное заполнение reachable, language и has_attempts у существующих пользователей"""
+        marker_ref = self.db.collection('meta').document('migrations')
+        marker = marker_ref.get()
+        if marker.exists and marker.to_dict().get('audience_index_backfilled'):
+            return 0
+        
+        updated = 0
+        for doc in self.db.collection('users').get():
+            user_data = doc.to_dict()
+            fields = {}
+            if 'reachable' not in user_data:
+                fields['reachable'] = True
+            if 'language' not in user_data:
+                fields['language'] = 'ru'
+            if 'has_attempts' not in user_data:
+                fields['has_attempts'] = user_data.get('attempts', 0) > 0
+            if 'user_id' not in user_data and doc.id.isdigit():
+                fields['user_id'] = int(doc.id)
+            if fields:
+                doc.reference.update(fields)
+                updated += 1
+        
+        marker_ref.set({'audience_index_backfilled': True}, merge=True)
+        return updated
+
+    def _audience_query(self, segment: dict = None):
+        """Запрос доступных пользователей сегмента (индексы в firestore.indexes.json)"""
+        query = self.db.collection('users').where('reachable', '==', True)
+        for facet, value in (segment or {}).items():
+            if facet in AUDIENCE_FACETS:
+                query = query.where(facet, '==', value)
+        return query
+
+    def count_audience(self, segment: dict = None) -> int:
+        """Размер сегмента агрегирующим запросом"""
+        result = self._audience_query(segment).count().get()
+        return int(result[0][0].value)
+
+    def get_audience_page(self, after_user_id: int = None, limit: int = 500, segment: dict = None) -> list:
+        """Страница user_id доступных пользователей сегмента"""
+        query = self._audience_query(segment).order_by('user_id').select(['user_id']).limit(limit)
+        if after_user_id is not None:
+            query = query.start_after({'user_id': after_user_id})
+        return [doc.to_dict()['user_id'] for doc in query.get()]
+
+    def create_broadcast_job(self, text: str, total: int, chat_id: int, message_id: int,
+                             segment: dict = None) -> str:
+        """Создание задачи рассылки"""
+        job_id = uuid.uuid4().hex
+        self.db.collection('broadcast_jobs').document(job_id).set({
+            'text': text,
+            'segment': segment or {},
+            'status': 'running',
+            'total': total,
+            'sent': 0,
+            'blocked': 0,
+            'failed': 0,
+            'cursor': None,
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'lease_owner': None,
+            'lease_until': None,
+            'created_at': datetime.now()
+        })
+        return job_id
+
+    def get_broadcast_job(self, job_id: str) -> dict:
+        """Получение задачи рассылки"""
+        doc = self.db.collection('broadcast_jobs').document(job_id).get()
+        if not doc.exists:
+            return None
+        return dict(doc.to_dict(), job_id=job_id)
+
+    def get_broadcast_jobs(self, statuses: list) -> list:
+        """Задачи рассылки с указанными статусами"""
+        docs = self.db.collection('broadcast_jobs').where('status', 'in', statuses).get()
+        return [dict(doc.to_dict(), job_id=doc.id) for doc in docs]
+
+    def update_broadcast_job(self, job_id: str, fields: dict, owner: str = None) -> bool:
+        """Обновление полей задачи рассылки; с owner - в транзакции, только пока аренда принадлежит owner"""
+        job_ref = self.db.collection('broadcast_jobs').document(job_id)
+        fields = dict(fields, updated_at=datetime.now())
+        if owner is None:
+            job_ref.update(fields)
+            return True
+
+        @firestore.transactional
+        def update(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists or snapshot.to_dict().get('lease_owner') != owner:
+                return False
+            transaction.update(job_ref, fields)
+            return True
+
+        return update(self.db.transaction())
+
+    def claim_broadcast_job(self, job_id: str, owner: str, lease_seconds: int) -> bool:
+        """Захват задачи в транзакции, если аренда свободна, истекла или уже принадлежит owner"""
+        job_ref = self.db.collection('broadcast_jobs').document(job_id)
+
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+            job = snapshot.to_dict()
+            now = datetime.now(timezone.utc)
+            lease_until = job.get('lease_until')
+            if job.get('lease_owner') not in (None, owner) and lease_until and lease_until > now:
+                return False
+            transaction.update(job_ref, {
+                'lease_owner': owner,
+                'lease_until': now + timedelta(seconds=lease_seconds)
+            })
+            return True
+
+        return claim(self.db.transaction())
+
+    def record_broadcast_recipient(self, job_id: str, user_id: int, outcome: str):
+        """Запись исхода отправки одному получателю"""
+        (self.db.collection('broadcast_jobs').document(job_id)
+         .collection('recipients').document(str(user_id))
+         .set({'outcome': outcome, 'created_at': datetime.now()}))
+
+    def get_broadcast_recipients(self, job_id: str, user_ids: list) -> dict:
+        """Исходы отправки для указанных получателей одним пакетным чтением"""
+        recipients = self.db.collection('broadcast_jobs').document(job_id).collection('recipients')
+        refs = [recipients.document(str(user_id)) for user_id in user_ids]
+        return {
+            int(doc.id): doc.to_dict()['outcome']
+            for doc in self.db.get_all(refs, field_paths=['outcome'])
+            if doc.exists
+        }
+
+    def increment_sku_requests(self, sku: str):
+        """Инкремент счетчика в документе sku_counters/{день}_{шард} (удаляется TTL-политикой)"""
+        now = datetime.now()
+        day = now.strftime('%Y%m%d')
+        # Случайный шард: запросы даже одного популярного артикула распределяются по всем документам дня
+        shard = random.randrange(SKU_COUNTER_SHARDS)
+        self.db.collection('sku_counters').document(f"{day}_{shard}").set({
+            'day': day,
+            'counts': {sku: firestore.Increment(1)},
+            'expires_at': now + timedelta(days=30)
+        }, merge=True)
+
+    def get_popular_skus(self, days: int, limit: int) -> list:
+        """Сумма дневных счетчиков за окно: days * SKU_COUNTER_SHARDS чтений без обхода коллекций"""
+        today = datetime.now()
+        counters = self.db.collection('sku_counters')
+        refs = [
+            counters.document(f"{(today - timedelta(days=offset)).strftime('%Y%m%d')}_{shard}")
+            for offset in range(days)
+            for shard in range(SKU_COUNTER_SHARDS)
+        ]
+        totals = {}
+        for doc in self.db.get_all(refs, field_paths=['counts']):
+            if not doc.exists:
+                continue
+            for sku, count in (doc.to_dict().get('counts') or {}).items():
+                totals[sku] = totals.get(sku, 0) + count
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def claim_lease(self, name: str, owner: str, lease_seconds: int) -> bool:
+        """Захват аренды в транзакции, если она свободна, истекла или уже принадлежит owner"""
+        lease_ref = self.db.collection('leases').document(name)
+
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = lease_ref.get(transaction=transaction)
+            now = datetime.now(timezone.utc)
+            if snapshot.exists:
+                lease = snapshot.to_dict()
+                if lease.get('owner') != owner and lease.get('lease_until') and lease['lease_until'] > now:
+                    return False
+            transaction.set(lease_ref, {
+                'owner': owner,
+                'lease_until': now + timedelta(seconds=lease_seconds)
+            })
+            return True
+
+        return claim(self.db.transaction())
+
+    def get_job_last_run(self, name: str) -> datetime:
+        """Время последнего запуска задачи планировщика"""
+        doc = self.db.collection('job_runs').document(name).get()
+        return doc.to_dict().get('last_run_at') if doc.exists else None
+
+    def set_job_last_run(self, name: str, run_at: datetime):
+        """Сохранение времени последнего запуска задачи планировщика"""
+        self.db.collection('job_runs').document(name).set({'last_run_at': run_at})
+
+    def add_watch(self, user_id: int, sku: str, root_id: int, item_name: str) -> bool:
+        """Подписка хранится в документе watched_skus/{sku} в массиве subscribers"""
+        watch_ref = self.db.collection('watched_skus').document(sku)
+        doc = watch_ref.get()
+        if doc.exists and user_id in (doc.to_dict().get('subscribers') or []):
+            return False
+        fields = {'subscribers': firestore.ArrayUnion([user_id])}
+        if not doc.exists:
+            fields.update({
+                'sku': sku,
+                'root_id': root_id,
+                'item_name': item_name,
+                'feedback_count': None,
+                'last_review_at': None,
+                'last_review_id': None,
+                'created_at': datetime.now()
+            })
+        watch_ref.set(fields, merge=True)
+        return True
+
+    def remove_watch(self, user_id: int, sku: str) -> bool:
+        """Отписка в транзакции: документ без подписчиков удаляется"""
+        watch_ref = self.db.collection('watched_skus').document(sku)
+
+        @firestore.transactional
+        def remove(transaction):
+            snapshot = watch_ref.get(transaction=transaction)
+            subscribers = (snapshot.to_dict().get('subscribers') or []) if snapshot.exists else []
+            if user_id not in subscribers:
+                return False
+            subscribers = [subscriber for subscriber in subscribers if subscriber != user_id]
+            if subscribers:
+                transaction.update(watch_ref, {'subscribers': subscribers})
+            else:
+                transaction.delete(watch_ref)
+            return True
+
+        return remove(self.db.transaction())
+
+    def get_user_watches(self, user_id: int) -> list:
+        """Артикулы пользователя по индексу массива subscribers"""
+        docs = (self.db.collection('watched_skus')
+                .where('subscribers', 'array_contains', user_id)
+                .select(['sku', 'item_name'])
+                .get())
+        return [doc.to_dict() for doc in docs]
+
+    def iter_watched_skus(self, page_size: int = 500):
+        """Постраничный обход отслеживаемых артикулов по возрастанию sku"""
+        query = self.db.collection('watched_skus').order_by('sku').limit(page_size)
+
+        last_doc = None
+        while True:
+            page = query.start_after(last_doc) if last_doc else query
+            docs = page.get()
+            for doc in docs:
+                yield doc.to_dict()
+            if len(docs) < page_size:
+                break
+            last_doc = docs[-1]
+
+    def update_watch_marks(self, marks: dict):
+        """Запись отметок пакетами (не больше 500 операций в пакете Firestore)"""
+        watched = self.db.collection('watched_skus')
+        items = [(sku, dict(mark, checked_at=datetime.now())) for sku, mark in marks.items()]
+        for start in range(0, len(items), 500):
+            chunk = items[start:start + 500]
+            batch = self.db.batch()
+            for sku, mark in chunk:
+                batch.update(watched.document(sku), mark)
+            try:
+                batch.commit()
+            except NotFound:
+                # Артикул удалили из наблюдения во время опроса: остальные отметки пишем по одной
+                for sku, mark in chunk:
+                    try:
+                        watched.document(sku).update(mark)
+                    except NotFound:
+                        pass
+
     def get_attempts(self, user_id):
         try:
             doc_ref = self.db.collection('users').document(str(user_id))
@@ -267,7 +687,15 @@ class FirebaseManager:
                 return user_data.get('attempts', 0)
             else:
                 # Создаем документ для нового пользователя
-                doc_ref.set({'attempts': 0, 'created_at': firestore.SERVER_TIMESTAMP})
+                doc_ref.set({
+                    'user_id': user_id,
+                    'attempts': 0,
+                    'has_attempts': False,
+                    'language': 'ru',
+                    'reachable': True,
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                    'last_activity': datetime.now()
+                })
                 return 0
         except Exception as e:
             logger.error(f"Error getting attempts for user {user_id}: {str(e)}")
@@ -0,0 +1,51 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseHeartbeat:
+    """Продление аренды из фонового потока, пока выполняется работа под этой арендой
+
+    renew() продлевает аренду и возвращает False, если ее перехватил другой процесс.
+    Аренда продлевается каждую треть lease_seconds. Если renew() вернул False или
+    продлить аренду не удается дольше, чем она действует, устанавливается lost:
+    работа получает его как should_stop и должна остановиться, чтобы не выполняться
+    параллельно с новым владельцем.
+    """
+
+    def __init__(self, renew, lease_seconds: int, name: str):
+        self.renew = renew
+        self.lease_seconds = lease_seconds
+        self.name = name
+        self.interval = max(lease_seconds / 3, 1)
+        self.lost = threading.Event()
+        self._done = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        renewed_at = time.monotonic()
+        while not self._done.wait(self.interval):
+            try:
+                renewed = self.renew()
+            except Exception as e:
+                logger.warning(f"Could not renew lease {self.name}: {str(e)}")
+                # Аренда еще действует, пока не прошло lease_seconds с последнего продления
+                if time.monotonic() - renewed_at + self.interval < self.lease_seconds:
+                    continue
+                renewed = False
+            if not renewed:
+                logger.warning(f"Lease {self.name} lost, stopping the work it guards")
+                self.lost.set()
+                return
+            renewed_at = time.monotonic()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
@@ -0,0 +1,69 @@
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Нагрузочный тест webhook: сравнение Flask-режима и ASGI-режима.
+#
+#   python webhook_handler.py                                 # текущий режим (Flask)
+#   uvicorn asgi_app:app --port 5000 --workers 1              # асинхронный режим
+#   python loadtest.py --url http://127.0.0.1:5000/webhook/<BOT_TOKEN> -n 5000 -c 50
+#
+# По умолчанию отправляются апдейты без содержимого: меряется именно путь
+# приема webhook (разбор, дедупликация, постановка в очередь), а не Telegram API.
+
+
+def build_update(update_id: int, text: str = None) -> bytes:
+    update = {'update_id': update_id}
+    if text:
+        update['message'] = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 100000 + update_id % 1000, 'type': 'private'},
+            'from': {'id': 100000 + update_id % 1000, 'is_bot': False, 'first_name': 'Load'},
+            'text': text
+        }
+    return json.dumps(update).encode('utf-8')
+
+
+def send(url: str, body: bytes) -> tuple:
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run(url: str, total: int, concurrency: int, text: str = None) -> dict:
+    first_id = int(time.time() * 1000)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: send(url, build_update(first_id + i, text)), range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, ok in results if not ok),
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест webhook')
+    parser.add_argument('--url', required=True, help='Полный URL webhook')
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-c', '--concurrency', type=int, default=50)
+    parser.add_argument('--text', help='Текст сообщения в апдейте (по умолчанию пустой апдейт)')
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.url, args.requests, args.concurrency, args.text), ensure_ascii=False, indent=2))
@@ -0,0 +1,94 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+from config import LOG_LEVEL, LOG_FORMAT, LOG_REQUEST_SAMPLE_RATE
+
+# Токен бота встречается в пути webhook и в URL запросов к Telegram API
+TOKEN_PATTERN = re.compile(r'\d{6,12}:[A-Za-z0-9_-]{30,}')
+
+_listener = None
+
+
+class RedactingFilter(logging.Filter):
+    """Маскирует токены бота в сообщениях логов"""
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = TOKEN_PATTERN.sub('<token>', message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля из extra= попадают в запись как есть"""
+
+    EXTRA_FIELDS = ('update_id', 'user_id', 'chat_id', 'path', 'method', 'duration_ms')
+
+    def format(self, record):
+        data = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for field in self.EXTRA_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Очередь внутри процесса: маскирование, форматирование и вывод выполняются в потоке QueueListener
+
+    Вызывающий поток только кладет запись в очередь, без фильтров и блокировки
+    обработчика (SimpleQueue потокобезопасна), поэтому фильтры на этот обработчик
+    не ставятся - они добавляются к обработчику вывода. Накладные расходы по сравнению
+    с синхронным выводом: benchmark_logging.py (результаты в README).
+    """
+
+    def handle(self, record):
+        self.enqueue(record)
+        return True
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging():
+    """Настройка логирования: запись в очередь в потоке запроса, вывод в отдельном потоке"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    output = logging.StreamHandler()
+    output.setFormatter(formatter)
+    output.addFilter(RedactingFilter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def sample_request_log() -> bool:
+    """Нужно ли логировать подробности этого запроса (доля LOG_REQUEST_SAMPLE_RATE)"""
+    return random.random() < LOG_REQUEST_SAMPLE_RATE
@@ -0,0 +1,145 @@
+import sqlite3
+import struct
+import threading
+from array import array
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_history (
+    sku TEXT PRIMARY KEY,
+    points BLOB NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+"""
+
+# Колонки ряда: время (unix), цена в копейках, рейтинг * 100, число отзывов; -1 - нет значения
+COLUMN_TYPES = ('I', 'i', 'h', 'i')
+HEADER = struct.Struct('<I')
+MISSING = -1
+
+DAY = 86400
+
+
+def encode_points(columns: tuple) -> bytes:
+    """Колонки ряда -> BLOB: число точек, затем массивы колонок подряд"""
+    return HEADER.pack(len(columns[0])) + b''.join(column.tobytes() for column in columns)
+
+
+def decode_points(blob: bytes) -> tuple:
+    """BLOB -> кортеж массивов (время, цена, рейтинг, отзывы)"""
+    count, = HEADER.unpack_from(blob)
+    columns = []
+    offset = HEADER.size
+    for typecode in COLUMN_TYPES:
+        column = array(typecode)
+        size = count * column.itemsize
+        column.frombytes(blob[offset:offset + size])
+        offset += size
+        columns.append(column)
+    return tuple(columns)
+
+
+class PriceHistory:
+    """Ряды цены и рейтинга по артикулам в локальном SQLite
+
+    Ряд артикула хранится одной строкой в колоночном виде (массивы array),
+    поэтому чтение истории - один поиск по первичному ключу. В каждом интервале
+    min_interval секунд хранится одна (последняя) точка, старше recent_days дней
+    прореживаются до одной за сутки, старше max_days дней удаляются.
+    """
+
+    def __init__(self, path: str, min_interval: int = 3600, recent_days: int = 7, max_days: int = 365):
+        self.path = path
+        self.min_interval = min_interval
+        self.recent_days = recent_days
+        self.max_days = max_days
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток: в режиме WAL читатели не блокируют писателя"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _downsample(self, columns: tuple, now: int) -> tuple:
+        """Одна точка (последняя) за сутки для точек старше recent_days, удаление старше max_days"""
+        timestamps = columns[0]
+        recent_from = now - self.recent_days * DAY
+        oldest = now - self.max_days * DAY
+        if not timestamps or timestamps[0] >= recent_from:
+            return columns
+
+        keep = []
+        for index, timestamp in enumerate(timestamps):
+            if timestamp < oldest:
+                continue
+            is_last_of_day = (index + 1 == len(timestamps)
+                              or timestamps[index + 1] // DAY != timestamp // DAY)
+            if timestamp >= recent_from or is_last_of_day:
+                keep.append(index)
+        return tuple(array(column.typecode, (column[index] for index in keep)) for column in columns)
+
+    def _append(self, columns: tuple, point: tuple, now: int) -> tuple:
+        if columns[0] and columns[0][-1] // self.min_interval == now // self.min_interval:
+            # Повторный снимок в том же интервале заменяет последнюю точку
+            for column, value in zip(columns, point):
+                column[-1] = value
+        else:
+            for column, value in zip(columns, point):
+                column.append(value)
+        return self._downsample(columns, now)
+
+    def record_many(self, snapshots: dict, at: datetime = None):
+        """Запись снимков карточек: sku -> (цена в копейках, рейтинг, число отзывов)"""
+        if not snapshots:
+            return
+        now = int((at or datetime.now(timezone.utc)).timestamp())
+        conn = self._connect()
+        with conn:
+            # Чтение и запись рядов в одной транзакции: параллельные записи не теряются
+            conn.execute('BEGIN IMMEDIATE')
+            placeholders = ', '.join('?' for _ in snapshots)
+            stored = dict(conn.execute(
+                f'SELECT sku, points FROM price_history WHERE sku IN ({placeholders})',
+                tuple(snapshots)
+            ).fetchall())
+            rows = []
+            for sku, (price, rating, feedback_count) in snapshots.items():
+                columns = decode_points(stored[sku]) if sku in stored else tuple(array(code) for code in COLUMN_TYPES)
+                point = (
+                    now,
+                    MISSING if price is None else int(price),
+                    MISSING if rating is None else round(float(rating) * 100),
+                    MISSING if feedback_count is None else int(feedback_count)
+                )
+                rows.append((sku, encode_points(self._append(columns, point, now)), now))
+            conn.executemany(
+                'INSERT INTO price_history (sku, points, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(sku) DO UPDATE SET points = excluded.points, updated_at = excluded.updated_at',
+                rows
+            )
+
+    def record(self, sku: str, price, rating, feedback_count, at: datetime = None):
+        self.record_many({sku: (price, rating, feedback_count)}, at)
+
+    def get(self, sku: str) -> list:
+        """История артикула: [(datetime UTC, цена в рублях, рейтинг, число отзывов)] по возрастанию времени"""
+        row = self._connect().execute('SELECT points FROM price_history WHERE sku = ?', (sku,)).fetchone()
+        if row is None:
+            return []
+        timestamps, prices, ratings, feedbacks = decode_points(row[0])
+        return [
+            (
+                datetime.fromtimestamp(timestamp, timezone.utc),
+                None if price == MISSING else price / 100,
+                None if rating == MISSING else rating / 100,
+                None if feedback_count == MISSING else feedback_count
+            )
+            for timestamp, price, rating, feedback_count in zip(timestamps, prices, ratings, feedbacks)
+        ]
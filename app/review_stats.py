@@ -0,0 +1,73 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+# Статистика оценок по ответу feedbacks.wb.ru, который уже загружен для анализа.
+# Поля отзывов один раз раскладываются в колонки (bytes оценок, отсортированный
+# список дат), дальше все считается операциями над колонками целиком:
+# bytes.count для распределения, префиксные суммы для скользящего среднего,
+# bisect для скорости появления отзывов. numpy для этого не нужен.
+
+ROLLING_WINDOW = 50
+TREND_POINTS = 12
+VELOCITY_DAYS = 30
+WB_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_wb_date(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def compute_review_stats(feedbacks: list, sku: str = None, window: int = ROLLING_WINDOW,
+                         now: datetime = None) -> dict:
+    """Распределение оценок, тренд скользящего среднего, доля отзывов с фото и скорость отзывов
+
+    feedbacks - список feedbacks из ответа WB, sku - оставить только отзывы этого артикула.
+    Возвращает None, если отзывов с оценкой нет.
+    """
+    if sku is not None:
+        feedbacks = [feedback for feedback in feedbacks if str(feedback.get('nmId')) == sku]
+    feedbacks = [feedback for feedback in feedbacks if feedback.get('productValuation') in (1, 2, 3, 4, 5)]
+    count = len(feedbacks)
+    if not count:
+        return None
+
+    # Колонки в хронологическом порядке (даты WB в ISO-формате сортируются как строки)
+    dates = [feedback.get('createdDate') or '' for feedback in feedbacks]
+    order = sorted(range(count), key=dates.__getitem__)
+    dates = [dates[index] for index in order]
+    ratings = bytes(feedbacks[index]['productValuation'] for index in order)
+    with_photos = sum(1 for feedback in feedbacks if feedback.get('photo') or feedback.get('photos'))
+
+    distribution = {stars: ratings.count(stars) for stars in range(1, 6)}
+    total = sum(ratings)
+
+    # Скользящее среднее по window последним отзывам на каждый момент; в тренд попадает TREND_POINTS значений
+    window = min(window, count)
+    prefix = list(accumulate(ratings, initial=0))
+    ends = sorted({window + (count - window) * step // (TREND_POINTS - 1) for step in range(TREND_POINTS)})
+    trend = [(prefix[end] - prefix[end - window]) / window for end in ends]
+    previous_end = max(count - window, 0)
+    previous_window = min(window, previous_end)
+
+    now = now or datetime.now(timezone.utc)
+    since = (now - timedelta(days=VELOCITY_DAYS)).strftime(WB_DATE_FORMAT)
+    recent = count - bisect_left(dates, since)
+    span_days = None
+    if dates[0] and dates[-1]:
+        span_days = max((parse_wb_date(dates[-1]) - parse_wb_date(dates[0])).total_seconds() / 86400, 1)
+
+    return {
+        'count': count,
+        'average': total / count,
+        'distribution': distribution,
+        'trend': trend,
+        'recent_average': trend[-1],
+        'previous_average': (
+            (prefix[previous_end] - prefix[previous_end - previous_window]) / previous_window
+            if previous_window else None
+        ),
+        'photo_share': with_photos / count,
+        'per_day_recent': recent / VELOCITY_DAYS,
+        'per_day_total': count / span_days if span_days else None
+    }
@@ -1,62 +1,237 @@
+import os
+import socket
 import threading
 import time
-import schedule
-from datetime import datetime, timedelta
-from firebase_manager import FirebaseManager
-from bot import bot
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from telebot import types
+from bot import (firebase_manager, payment_manager, broadcast_sender, compute_product_analysis,
+                 fetch_product_cards, fetch_root_feedbacks, build_watch_messages,
+                 ANALYSIS_FAILED_TEXT, SYSTEM_USER_ID)
+from config import (SCHEDULER_ENABLED, REMINDER_TIME, ANALYSIS_FRESHNESS_HOURS, PRECOMPUTE_WORKERS,
+                    WARMER_TIME, WARMER_WINDOW_DAYS, WARMER_TOP_SKUS, WARMER_LLM_BUDGET,
+                    WARMER_REFRESH_AHEAD_HOURS, WATCH_POLL_MINUTES, WATCH_NEGATIVE_RATING, WATCH_WORKERS)
+from watchlist import WatchlistMonitor
+from lease import LeaseHeartbeat
 
-firebase_manager = FirebaseManager()
+logger = logging.getLogger(__name__)
 
-def remind_inactive_users():
-    """Отправляет напоминания неактивным пользователям"""
-    # Получаем пользователей, которые не использовали бота более 7 дней
-    inactive_users = firebase_manager.get_inactive_users(days=7)
-    
-    for user in inactive_users:
-        user_id = user.get('user_id')
-        attempts = user.get('attempts', 0)
-        
-        if attempts > 0:
-            # Пользователь имеет попытки, но не использует их
-            try:
-                bot.send_message(
-                    user_id,
-                    f"👋 Привет! Мы заметили, что вы давно не пользовались нашим ботом.\n\n"
-                    f"У вас осталось {attempts} неиспользованных попыток анализа. "
-                    f"Не упустите возможность проанализировать отзывы на интересующие вас товары!"
-                )
-            except Exception:
-                pass
-        else:
-            # У пользователя нет попыток
+# Лидер среди процессов (воркеры gunicorn, инстансы) выбирается арендой в хранилище:
+# задачи выполняет только процесс, удерживающий аренду LEADER_LEASE
+LEADER_LEASE = 'scheduler'
+LEASE_SECONDS = 120
+TICK_SECONDS = 30
+
+
+class DailyJob:
+    """Задача, которая выполняется раз в сутки в заданное местное время"""
+
+    def __init__(self, name: str, at: str, func):
+        self.name = name
+        self.hour, self.minute = (int(part) for part in at.split(':'))
+        self.func = func
+
+    def last_slot(self, now: datetime) -> datetime:
+        """Последний наступивший момент запуска (UTC)"""
+        local_now = now.astimezone()
+        slot = local_now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if slot > local_now:
+            slot -= timedelta(days=1)
+        return slot.astimezone(timezone.utc)
+
+
+class IntervalJob:
+    """Задача, которая выполняется каждые minutes минут (слоты отсчитываются от начала эпохи)"""
+
+    def __init__(self, name: str, minutes: int, func):
+        self.name = name
+        self.period = minutes * 60
+        self.func = func
+
+    def last_slot(self, now: datetime) -> datetime:
+        """Последний наступивший момент запуска (UTC)"""
+        return datetime.fromtimestamp(now.timestamp() // self.period * self.period, timezone.utc)
+
+
+class JobRunner:
+    """Планировщик с одним лидером и сохраняемым временем последнего запуска
+
+    Время запуска хранится в общем хранилище, поэтому после перезапуска пропущенный
+    слот выполняется один раз, а уже выполненный не повторяется. Слот отмечается
+    до выполнения: при падении посреди задачи она не будет отправлять повторно.
+    Функция задачи получает should_stop() - признак потери аренды лидера.
+    """
+
+    def __init__(self, storage, owner: str = None, lease_seconds: int = LEASE_SECONDS,
+                 tick_seconds: int = TICK_SECONDS):
+        self.storage = storage
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.tick_seconds = tick_seconds
+        self.jobs = []
+        self._thread = None
+
+    def add_daily_job(self, name: str, at: str, func):
+        self.jobs.append(DailyJob(name, at, func))
+
+    def add_interval_job(self, name: str, minutes: int, func):
+        self.jobs.append(IntervalJob(name, minutes, func))
+
+    def run_pending(self):
+        """Один такт: продление аренды лидера и запуск наступивших задач"""
+        if not self.storage.claim_lease(LEADER_LEASE, self.owner, self.lease_seconds):
+            return
+
+        now = datetime.now(timezone.utc)
+        for job in self.jobs:
+            slot = job.last_slot(now)
+            last_run = self.storage.get_job_last_run(job.name)
+            if last_run is not None and last_run >= slot:
+                continue
+
+            self.storage.set_job_last_run(job.name, slot)
+            logger.info(f"Running scheduled job {job.name} for slot {slot.isoformat()}")
+            # Задача может выполняться дольше аренды: аренда продлевается, пока она работает
+            renew = partial(self.storage.claim_lease, LEADER_LEASE, self.owner, self.lease_seconds)
+            with LeaseHeartbeat(renew, self.lease_seconds, LEADER_LEASE) as heartbeat:
+                try:
+                    job.func(heartbeat.lost.is_set)
+                except Exception as e:
+                    logger.error(f"Scheduled job {job.name} failed: {str(e)}", exc_info=True)
+
+            if heartbeat.lost.is_set():
+                return
+
+    def run_forever(self):
+        while True:
             try:
-                markup = types.InlineKeyboardMarkup()
-                payment_button = types.InlineKeyboardButton(
-                    "💳 Пополнить попытки",
-                    url=payment_manager.create_payment_link(user_id)
-                )
-                markup.add(payment_button)
-                
-                bot.send_message(
-                    user_id,
-                    "👋 Привет! Мы заметили, что вы давно не пользовались нашим ботом.\n\n"
-                    "У вас закончились попытки анализа. Пополните их, чтобы продолжить "
-                    "пользоваться всеми возможностями бота!",
-                    reply_markup=markup
-                )
-            except Exception:
-                pass
-
-def run_scheduler():
-    """Запускает планировщик задач"""
-    # Напоминания каждый день в 12:00
-    schedule.every().day.at("12:00").do(remind_inactive_users)
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
-
-# Запускаем планировщик в отдельном потоке
-scheduler_thread = threading.Thread(target=run_scheduler)
-scheduler_thread.daemon = True
-scheduler_thread.start() 
\ No newline at end of file
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {str(e)}")
+            time.sleep(self.tick_seconds)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run_forever, name='scheduler', daemon=True)
+        self._thread.start()
+
+
+def build_reminder(user):
+    """Сообщение-напоминание неактивному пользователю: (chat_id, text, kwargs)"""
+    user_id = user.get('user_id')
+    attempts = user.get('attempts', 0)
+
+    if attempts > 0:
+        # Пользователь имеет попытки, но не использует их
+        return (
+            user_id,
+            f"👋 Привет! Мы заметили, что вы давно не пользовались нашим ботом.\n\n"
+            f"У вас осталось {attempts} неиспользованных попыток анализа. "
+            f"Не упустите возможность проанализировать отзывы на интересующие вас товары!",
+            {}
+        )
+
+    # У пользователя нет попыток
+    markup = types.InlineKeyboardMarkup()
+    payment_button = types.InlineKeyboardButton(
+        "💳 Пополнить попытки",
+        url=payment_manager.create_payment_link(user_id)
+    )
+    markup.add(payment_button)
+
+    return (
+        user_id,
+        "👋 Привет! Мы заметили, что вы давно не пользовались нашим ботом.\n\n"
+        "У вас закончились попытки анализа. Пополните их, чтобы продолжить "
+        "пользоваться всеми возможностями бота!",
+        {'reply_markup': markup}
+    )
+
+
+def remind_inactive_users(should_stop=None):
+    """Отправляет напоминания неактивным пользователям"""
+    # Пользователи, созданные до появления last_activity, попадают в индекс после миграции
+    firebase_manager.backfill_last_activity()
+    firebase_manager.backfill_audience_index()
+
+    # Постранично читаем доступных пользователей, которые не использовали бота более 7 дней,
+    # и отправляем напоминания конкурентно в пределах лимитов Telegram
+    reminders = (build_reminder(user) for user in firebase_manager.iter_inactive_users(days=7)
+                 if user.get('user_id'))
+    counts = broadcast_sender.send_many(reminders, should_stop=should_stop)
+    logger.info(f"Inactive user reminders: {counts}")
+
+
+def needs_refresh(sku) -> bool:
+    """Анализа нет или он устареет раньше, чем через WARMER_REFRESH_AHEAD_HOURS часов"""
+    analysis = firebase_manager.get_fresh_analysis(sku, ANALYSIS_FRESHNESS_HOURS)
+    if not analysis or not analysis.get('created_at'):
+        return True
+    created_at = analysis['created_at']
+    age = datetime.now(created_at.tzinfo) - created_at
+    return age > timedelta(hours=ANALYSIS_FRESHNESS_HOURS - WARMER_REFRESH_AHEAD_HOURS)
+
+
+def refresh_analysis(sku):
+    """Новый анализ артикула по свежим данным WB в общее хранилище"""
+    try:
+        sku, item_name, analysis = compute_product_analysis(sku)
+        if analysis and analysis != ANALYSIS_FAILED_TEXT:
+            firebase_manager.save_analysis(SYSTEM_USER_ID, sku, item_name, analysis)
+            return True
+    except Exception as e:
+        logger.warning(f"Cache warm-up failed for SKU {sku}: {str(e)}")
+    return False
+
+
+def warm_popular_analyses(should_stop=None):
+    """Обновление анализов самых запрашиваемых артикулов до их устаревания
+
+    Популярность берется из дневных счетчиков за WARMER_WINDOW_DAYS дней.
+    Каждое обновление - один вызов LLM, за запуск их не больше WARMER_LLM_BUDGET.
+    """
+    popular = firebase_manager.get_popular_skus(WARMER_WINDOW_DAYS, WARMER_TOP_SKUS)
+    stale = []
+    for sku, _ in popular:
+        if len(stale) >= WARMER_LLM_BUDGET or (should_stop and should_stop()):
+            break
+        try:
+            if needs_refresh(sku):
+                stale.append(sku)
+        except Exception as e:
+            logger.error(f"Error checking analysis age for SKU {sku}: {str(e)}")
+
+    def refresh(sku):
+        # После потери аренды оставшиеся артикулы не обновляются (и не тратят вызовы LLM)
+        return not (should_stop and should_stop()) and refresh_analysis(sku)
+
+    with ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix='warmer') as executor:
+        refreshed = sum(executor.map(refresh, stale))
+    logger.info(f"Cache warm-up: {len(popular)} popular SKUs, {len(stale)} stale, {refreshed} refreshed")
+
+
+watch_monitor = WatchlistMonitor(
+    firebase_manager,
+    # Число отзывов нужно свежее, поэтому карточки не берутся из кэша
+    fetch_cards=lambda skus: fetch_product_cards(skus, use_cache=False),
+    fetch_feedbacks=fetch_root_feedbacks,
+    build_messages=build_watch_messages,
+    sender=broadcast_sender,
+    workers=WATCH_WORKERS,
+    negative_rating=WATCH_NEGATIVE_RATING
+)
+
+
+scheduler = JobRunner(firebase_manager)
+scheduler.add_daily_job('remind_inactive_users', REMINDER_TIME, remind_inactive_users)
+scheduler.add_daily_job('warm_popular_analyses', WARMER_TIME, warm_popular_analyses)
+scheduler.add_interval_job('poll_watchlist', WATCH_POLL_MINUTES, watch_monitor.poll)
+
+
+def start_scheduler():
+    """Запуск планировщика в фоновом потоке (задачи выполняет только лидер)"""
+    if SCHEDULER_ENABLED:
+        scheduler.start()
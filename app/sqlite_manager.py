@@ -0,0 +1,698 @@
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from storage import StorageManager, AUDIENCE_FACETS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Явные адаптеры дат вместо устаревших встроенных в sqlite3
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    total_attempts_used INTEGER NOT NULL DEFAULT 0,
+    total_purchased INTEGER NOT NULL DEFAULT 0,
+    referral_count INTEGER NOT NULL DEFAULT 0,
+    language TEXT,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    last_used TIMESTAMP,
+    last_purchase TIMESTAMP,
+    last_activity TIMESTAMP,
+    reachable INTEGER NOT NULL DEFAULT 1,
+    last_send_outcome TEXT,
+    last_send_at TIMESTAMP,
+    blocked_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity, user_id);
+
+CREATE TABLE IF NOT EXISTS referrals (
+    referrer_id INTEGER NOT NULL,
+    referred_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (referrer_id, referred_id)
+);
+
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    sku TEXT NOT NULL,
+    item_name TEXT,
+    analysis_text TEXT,
+    text_hash TEXT,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_user_created ON analyses (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_sku_created ON analyses (sku, created_at);
+
+CREATE TABLE IF NOT EXISTS analysis_texts (
+    text_hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_updates_created ON processed_updates (created_at);
+
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    job_id TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    segment TEXT,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    cursor INTEGER,
+    chat_id INTEGER,
+    message_id INTEGER,
+    lease_owner TEXT,
+    lease_until TIMESTAMP,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status);
+
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    job_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (job_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS sku_requests (
+    day TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, sku)
+);
+
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    name TEXT PRIMARY KEY,
+    last_run_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS watched_skus (
+    sku TEXT PRIMARY KEY,
+    root_id INTEGER NOT NULL,
+    item_name TEXT,
+    feedback_count INTEGER,
+    last_review_at TEXT,
+    last_review_id TEXT,
+    checked_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS watch_subscribers (
+    sku TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (sku, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_watch_subscribers_user ON watch_subscribers (user_id);
+
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    text TEXT,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    plan TEXT,
+    created_at TIMESTAMP NOT NULL
+);
+"""
+
+# Поля задачи рассылки, которые можно менять через update_broadcast_job
+BROADCAST_JOB_FIELDS = ('status', 'sent', 'blocked', 'failed', 'cursor', 'lease_owner', 'lease_until')
+
+# Поля пользователя, которые отдаются наружу (как поля документа в Firestore)
+USER_FIELDS = (
+    'user_id', 'attempts', 'total_attempts_used', 'total_purchased', 'referral_count',
+    'language', 'created_at', 'updated_at', 'last_used', 'last_purchase', 'last_activity',
+    'last_send_outcome', 'last_send_at', 'blocked_at'
+)
+
+# Условия фасетов сегмента; язык NULL у старых пользователей считается 'ru'
+AUDIENCE_CONDITIONS = {
+    'language': "COALESCE(language, 'ru') = ?",
+    'has_attempts': '(attempts > 0) = ?'
+}
+
+
+class SQLiteManager(StorageManager):
+    """Локальное хранилище на SQLite (WAL) с тем же интерфейсом, что и FirebaseManager"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Добавление колонок, появившихся после создания базы"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(analyses)')}
+        if 'text_hash' not in columns:
+            conn.execute('ALTER TABLE analyses ADD COLUMN text_hash TEXT')
+
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(users)')}
+        if 'reachable' not in columns:
+            conn.execute('ALTER TABLE users ADD COLUMN reachable INTEGER NOT NULL DEFAULT 1')
+        for column in ('last_send_outcome TEXT', 'last_send_at TIMESTAMP', 'blocked_at TIMESTAMP'):
+            if column.split()[0] not in columns:
+                conn.execute(f'ALTER TABLE users ADD COLUMN {column}')
+
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(broadcast_jobs)')}
+        if 'segment' not in columns:
+            conn.execute('ALTER TABLE broadcast_jobs ADD COLUMN segment TEXT')
+
+        # Индекс аудитории по тем же выражениям, что и в AUDIENCE_CONDITIONS
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_audience "
+            "ON users (reachable, COALESCE(language, 'ru'), (attempts > 0), user_id)"
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_reachable_activity ON users (reachable, last_activity, user_id)')
+
+    def _connect(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток: в режиме WAL читатели не блокируют писателя"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=30,
+                detect_types=sqlite3.PARSE_DECLTYPES
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _user_to_dict(row) -> dict:
+        """Строка users -> словарь без пустых полей, как документ Firestore"""
+        return {key: row[key] for key in USER_FIELDS if row[key] is not None}
+
+    def get_user_attempts(self, user_id: int) -> int:
+        conn = self._connect()
+        with conn:
+            now = datetime.now()
+            conn.execute(
+                'INSERT OR IGNORE INTO users (user_id, attempts, created_at, last_activity, total_attempts_used) '
+                'VALUES (?, 1, ?, ?, 0)',
+                (user_id, now, now)
+            )
+            row = conn.execute('SELECT attempts FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['attempts']
+
+    def decrease_attempts(self, user_id: int) -> int:
+        conn = self._connect()
+        with conn:
+            now = datetime.now()
+            cursor = conn.execute(
+                'UPDATE users SET attempts = attempts - 1, total_attempts_used = total_attempts_used + 1, '
+                'last_used = ?, last_activity = ? WHERE user_id = ? AND attempts > 0',
+                (now, now, user_id)
+            )
+            if cursor.rowcount == 0:
+                return 0
+            row = conn.execute('SELECT attempts FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['attempts']
+
+    def add_attempts(self, user_id: int, amount: int = 10):
+        conn = self._connect()
+        with conn:
+            now = datetime.now()
+            # created_at и last_activity записываются, только если пользователь создается здесь
+            conn.execute(
+                'INSERT INTO users (user_id, attempts, total_purchased, last_purchase, updated_at, created_at, last_activity) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET attempts = attempts + excluded.attempts, '
+                'total_purchased = total_purchased + excluded.total_purchased, '
+                'last_purchase = excluded.last_purchase, updated_at = excluded.updated_at',
+                (user_id, amount, amount, now, now, now, now)
+            )
+
+    def reserve_attempts(self, user_id: int, count: int) -> int:
+        conn = self._connect()
+        with conn:
+            now = datetime.now()
+            cursor = conn.execute(
+                'UPDATE users SET attempts = attempts - ?, total_attempts_used = total_attempts_used + ?, '
+                'last_used = ?, last_activity = ? WHERE user_id = ? AND attempts >= ?',
+                (count, count, now, now, user_id, count)
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = conn.execute('SELECT attempts FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['attempts']
+
+    def refund_attempts(self, user_id: int, count: int):
+        if count <= 0:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'UPDATE users SET attempts = attempts + ?, total_attempts_used = total_attempts_used - ?, '
+                'updated_at = ? WHERE user_id = ?',
+                (count, count, datetime.now(), user_id)
+            )
+
+    def get_user_stats(self, user_id: int) -> dict:
+        row = self._connect().execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return {
+                'attempts': 0,
+                'total_attempts_used': 0,
+                'total_purchased': 0
+            }
+
+        user_data = self._user_to_dict(row)
+
+        if user_data.get('created_at'):
+            user_data['created_at_formatted'] = user_data['created_at'].strftime('%d.%m.%Y')
+
+        if user_data.get('last_used'):
+            user_data['last_used_formatted'] = user_data['last_used'].strftime('%d.%m.%Y %H:%M')
+
+        return user_data
+
+    def add_referral(self, referrer_id: int, referred_id: int):
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO referrals (referrer_id, referred_id, created_at) VALUES (?, ?, ?)',
+                (referrer_id, referred_id, datetime.now())
+            )
+            if cursor.rowcount == 0:
+                return False
+            now = datetime.now()
+            conn.execute(
+                'INSERT INTO users (user_id, referral_count, created_at, last_activity) VALUES (?, 1, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET referral_count = referral_count + 1',
+                (referrer_id, now, now)
+            )
+
+        # Начисляем бонус реферреру
+        self.add_attempts(referrer_id, 2)
+
+        return True
+
+    def get_referral_count(self, user_id: int) -> int:
+        row = self._connect().execute('SELECT referral_count FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['referral_count'] if row else 0
+
+    def touch_user(self, user_id: int):
+        conn = self._connect()
+        with conn:
+            conn.execute('UPDATE users SET last_activity = ?, reachable = 1 WHERE user_id = ?', (datetime.now(), user_id))
+
+    def iter_inactive_users(self, days: int = 7, page_size: int = 500):
+        inactive_date = datetime.now() - timedelta(days=days)
+        conn = self._connect()
+
+        # Keyset-пагинация по индексу (reachable, last_activity, user_id)
+        cursor_key = (datetime.min, 0)
+        while True:
+            rows = conn.execute(
+                'SELECT user_id, attempts, last_activity FROM users '
+                'WHERE reachable = 1 AND last_activity < ? AND (last_activity, user_id) > (?, ?) '
+                'ORDER BY last_activity, user_id LIMIT ?',
+                (inactive_date, cursor_key[0], cursor_key[1], page_size)
+            ).fetchall()
+            for row in rows:
+                yield dict(row)
+            if len(rows) < page_size:
+                break
+            cursor_key = (rows[-1]['last_activity'], rows[-1]['user_id'])
+
+    def backfill_last_activity(self) -> int:
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE users SET last_activity = COALESCE(last_used, created_at) '
+                'WHERE last_activity IS NULL AND COALESCE(last_used, created_at) IS NOT NULL'
+            )
+        return cursor.rowcount
+
+    def get_admin_stats(self) -> dict:
+        conn = self._connect()
+        users = conn.execute(
+            'SELECT COUNT(*) AS total_users, '
+            'COALESCE(SUM(total_attempts_used), 0) AS total_attempts_used, '
+            'COALESCE(SUM(total_purchased > 0), 0) AS total_payments FROM users'
+        ).fetchone()
+        payments = conn.execute('SELECT COALESCE(SUM(amount), 0) AS total_amount FROM payments').fetchone()
+        return {
+            'total_users': users['total_users'],
+            'total_attempts_used': users['total_attempts_used'],
+            'total_payments': users['total_payments'],
+            'total_amount': payments['total_amount']
+        }
+
+    def save_feedback(self, user_id: int, feedback_text: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO feedback (user_id, text, created_at) VALUES (?, ?, ?)',
+                (user_id, feedback_text, datetime.now())
+            )
+
+    def set_user_language(self, user_id: int, language: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO users (user_id, language, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET language = excluded.language, updated_at = excluded.updated_at',
+                (user_id, language, datetime.now())
+            )
+
+    def get_user_language(self, user_id: int) -> str:
+        row = self._connect().execute('SELECT language FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row and row['language']:
+            return row['language']
+        return 'ru'
+
+    def get_last_analysis(self, user_id: int) -> dict:
+        row = self._connect().execute(
+            'SELECT user_id, sku, item_name, analysis_text, text_hash, created_at FROM analyses '
+            'WHERE user_id = ? ORDER BY created_at DESC LIMIT 1',
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        data = self._resolve_analysis_text(dict(row))
+        data['created_at_formatted'] = data['created_at'].strftime('%d.%m.%Y %H:%M')
+        return data
+
+    def save_analysis(self, user_id: int, sku: str, item_name: str, analysis_text: str):
+        text_hash = self._store_analysis_text(analysis_text)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO analyses (user_id, sku, item_name, text_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+                (user_id, sku, item_name, text_hash, datetime.now())
+            )
+
+    def _load_analysis_text(self, text_hash: str) -> str:
+        row = self._connect().execute('SELECT text FROM analysis_texts WHERE text_hash = ?', (text_hash,)).fetchone()
+        return row['text'] if row else None
+
+    def _save_analysis_text(self, text_hash: str, analysis_text: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO analysis_texts (text_hash, text, created_at) VALUES (?, ?, ?)',
+                (text_hash, analysis_text, datetime.now())
+            )
+
+    def get_fresh_analysis(self, sku: str, max_age_hours: int) -> dict:
+        row = self._connect().execute(
+            'SELECT sku, item_name, analysis_text, text_hash, created_at FROM analyses '
+            'WHERE sku = ? AND created_at >= ? ORDER BY created_at DESC LIMIT 1',
+            (sku, datetime.now() - timedelta(hours=max_age_hours))
+        ).fetchone()
+        return self._resolve_analysis_text(dict(row)) if row else None
+
+    def get_all_users(self) -> list:
+        rows = self._connect().execute('SELECT * FROM users').fetchall()
+        return [self._user_to_dict(row) for row in rows]
+
+    def record_payment(self, user_id: int, amount: float, plan: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO payments (user_id, amount, plan, created_at) VALUES (?, ?, ?, ?)',
+                (user_id, amount, plan, datetime.now())
+            )
+
+    def mark_update_seen(self, update_id: int) -> bool:
+        conn = self._connect()
+        with conn:
+            now = datetime.now()
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO processed_updates (update_id, created_at) VALUES (?, ?)',
+                (update_id, now)
+            )
+            # Периодически удаляем отметки старше суток
+            if update_id % 1000 == 0:
+                conn.execute('DELETE FROM processed_updates WHERE created_at < ?', (now - timedelta(days=1),))
+        return cursor.rowcount == 1
+
+    def forget_update_seen(self, update_id: int):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM processed_updates WHERE update_id = ?', (update_id,))
+
+    def record_send_outcome(self, user_id: int, outcome: str):
+        now = datetime.now()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'UPDATE users SET last_send_outcome = ?, last_send_at = ?, '
+                "reachable = CASE ? WHEN 'blocked' THEN 0 WHEN 'sent' THEN 1 ELSE reachable END, "
+                "blocked_at = CASE ? WHEN 'blocked' THEN ? ELSE blocked_at END "
+                'WHERE user_id = ?',
+                (outcome, now, outcome, outcome, now, user_id)
+            )
+
+    def backfill_audience_index(self) -> int:
+        # Колонки индекса аудитории заполняются значениями по умолчанию при миграции
+        return 0
+
+    @staticmethod
+    def _audience_where(segment: dict = None) -> tuple:
+        conditions = ['reachable = 1']
+        params = []
+        for facet, value in (segment or {}).items():
+            if facet in AUDIENCE_FACETS:
+                conditions.append(AUDIENCE_CONDITIONS[facet])
+                params.append(value)
+        return ' AND '.join(conditions), params
+
+    def count_audience(self, segment: dict = None) -> int:
+        where, params = self._audience_where(segment)
+        return self._connect().execute(f'SELECT COUNT(*) FROM users WHERE {where}', params).fetchone()[0]
+
+    def get_audience_page(self, after_user_id: int = None, limit: int = 500, segment: dict = None) -> list:
+        where, params = self._audience_where(segment)
+        rows = self._connect().execute(
+            f'SELECT user_id FROM users WHERE {where} AND user_id > ? ORDER BY user_id LIMIT ?',
+            (*params, after_user_id if after_user_id is not None else -1, limit)
+        ).fetchall()
+        return [row['user_id'] for row in rows]
+
+    def create_broadcast_job(self, text: str, total: int, chat_id: int, message_id: int,
+                             segment: dict = None) -> str:
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO broadcast_jobs (job_id, text, segment, status, total, chat_id, message_id, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, text, json.dumps(segment or {}), 'running', total, chat_id, message_id, datetime.now())
+            )
+        return job_id
+
+    @staticmethod
+    def _job_to_dict(row) -> dict:
+        job = dict(row)
+        job['segment'] = json.loads(job['segment']) if job.get('segment') else {}
+        return job
+
+    def get_broadcast_job(self, job_id: str) -> dict:
+        row = self._connect().execute('SELECT * FROM broadcast_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return self._job_to_dict(row) if row else None
+
+    def get_broadcast_jobs(self, statuses: list) -> list:
+        placeholders = ', '.join('?' for _ in statuses)
+        rows = self._connect().execute(
+            f'SELECT * FROM broadcast_jobs WHERE status IN ({placeholders}) ORDER BY created_at',
+            tuple(statuses)
+        ).fetchall()
+        return [self._job_to_dict(row) for row in rows]
+
+    def update_broadcast_job(self, job_id: str, fields: dict, owner: str = None) -> bool:
+        fields = {key: value for key, value in fields.items() if key in BROADCAST_JOB_FIELDS}
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        where, params = 'job_id = ?', [job_id]
+        if owner is not None:
+            where, params = 'job_id = ? AND lease_owner = ?', [job_id, owner]
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                f'UPDATE broadcast_jobs SET {assignments}, updated_at = ? WHERE {where}',
+                (*fields.values(), datetime.now(), *params)
+            )
+        return cursor.rowcount == 1
+
+    def claim_broadcast_job(self, job_id: str, owner: str, lease_seconds: int) -> bool:
+        now = datetime.now(timezone.utc)
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE broadcast_jobs SET lease_owner = ?, lease_until = ? WHERE job_id = ? '
+                'AND (lease_owner IS NULL OR lease_owner = ? OR lease_until IS NULL OR lease_until < ?)',
+                (owner, now + timedelta(seconds=lease_seconds), job_id, owner, now)
+            )
+        return cursor.rowcount == 1
+
+    def record_broadcast_recipient(self, job_id: str, user_id: int, outcome: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO broadcast_recipients (job_id, user_id, outcome, created_at) VALUES (?, ?, ?, ?)',
+                (job_id, user_id, outcome, datetime.now())
+            )
+
+    def get_broadcast_recipients(self, job_id: str, user_ids: list) -> dict:
+        if not user_ids:
+            return {}
+        placeholders = ', '.join('?' for _ in user_ids)
+        rows = self._connect().execute(
+            f'SELECT user_id, outcome FROM broadcast_recipients WHERE job_id = ? AND user_id IN ({placeholders})',
+            (job_id, *user_ids)
+        ).fetchall()
+        return {row['user_id']: row['outcome'] for row in rows}
+
+    def increment_sku_requests(self, sku: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO sku_requests (day, sku, count) VALUES (?, ?, 1) '
+                'ON CONFLICT(day, sku) DO UPDATE SET count = count + 1',
+                (datetime.now().strftime('%Y%m%d'), sku)
+            )
+
+    def get_popular_skus(self, days: int, limit: int) -> list:
+        # Поиск по первичному ключу (day, sku): читаются только строки окна
+        since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y%m%d')
+        rows = self._connect().execute(
+            'SELECT sku, SUM(count) AS total FROM sku_requests WHERE day >= ? '
+            'GROUP BY sku ORDER BY total DESC LIMIT ?',
+            (since, limit)
+        ).fetchall()
+        return [(row['sku'], row['total']) for row in rows]
+
+    def claim_lease(self, name: str, owner: str, lease_seconds: int) -> bool:
+        now = datetime.now(timezone.utc)
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO leases (name, owner, lease_until) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until '
+                'WHERE leases.owner = excluded.owner OR leases.lease_until < ?',
+                (name, owner, now + timedelta(seconds=lease_seconds), now)
+            )
+        return cursor.rowcount == 1
+
+    def get_job_last_run(self, name: str) -> datetime:
+        row = self._connect().execute('SELECT last_run_at FROM job_runs WHERE name = ?', (name,)).fetchone()
+        return row['last_run_at'] if row else None
+
+    def set_job_last_run(self, name: str, run_at: datetime):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO job_runs (name, last_run_at) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at',
+                (name, run_at)
+            )
+
+    def add_watch(self, user_id: int, sku: str, root_id: int, item_name: str) -> bool:
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO watched_skus (sku, root_id, item_name) VALUES (?, ?, ?)',
+                (sku, root_id, item_name)
+            )
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO watch_subscribers (sku, user_id, created_at) VALUES (?, ?, ?)',
+                (sku, user_id, datetime.now())
+            )
+        return cursor.rowcount == 1
+
+    def remove_watch(self, user_id: int, sku: str) -> bool:
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM watch_subscribers WHERE sku = ? AND user_id = ?', (sku, user_id))
+            conn.execute(
+                'DELETE FROM watched_skus WHERE sku = ? AND NOT EXISTS '
+                '(SELECT 1 FROM watch_subscribers WHERE sku = ?)',
+                (sku, sku)
+            )
+        return cursor.rowcount == 1
+
+    def get_user_watches(self, user_id: int) -> list:
+        rows = self._connect().execute(
+            'SELECT w.sku, w.item_name FROM watch_subscribers s JOIN watched_skus w ON w.sku = s.sku '
+            'WHERE s.user_id = ? ORDER BY s.created_at',
+            (user_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_watched_skus(self, page_size: int = 500):
+        after_sku = ''
+        while True:
+            rows = self._connect().execute(
+                'SELECT w.sku, w.root_id, w.item_name, w.feedback_count, w.last_review_at, w.last_review_id, '
+                'GROUP_CONCAT(s.user_id) AS subscribers '
+                'FROM watched_skus w JOIN watch_subscribers s ON s.sku = w.sku '
+                'WHERE w.sku > ? GROUP BY w.sku ORDER BY w.sku LIMIT ?',
+                (after_sku, page_size)
+            ).fetchall()
+            for row in rows:
+                watch = dict(row)
+                watch['subscribers'] = [int(user_id) for user_id in row['subscribers'].split(',')]
+                yield watch
+            if len(rows) < page_size:
+                break
+            after_sku = rows[-1]['sku']
+
+    def update_watch_marks(self, marks: dict):
+        conn = self._connect()
+        with conn:
+            now = datetime.now()
+            conn.executemany(
+                'UPDATE watched_skus SET feedback_count = ?, last_review_at = ?, last_review_id = ?, '
+                'checked_at = ? WHERE sku = ?',
+                [(mark['feedback_count'], mark['last_review_at'], mark['last_review_id'], now, sku)
+                 for sku, mark in marks.items()]
+            )
+
+    def get_attempts(self, user_id):
+        try:
+            conn = self._connect()
+            with conn:
+                now = datetime.now()
+                conn.execute(
+                    'INSERT OR IGNORE INTO users (user_id, attempts, created_at, last_activity) VALUES (?, 0, ?, ?)',
+                    (user_id, now, now)
+                )
+                row = conn.execute('SELECT attempts FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            return row['attempts']
+        except Exception as e:
+            logger.error(f"Error getting attempts for user {user_id}: {str(e)}")
+            return 0
@@ -0,0 +1,249 @@
+import hashlib
+from datetime import datetime
+from abc import ABC, abstractmethod
+from cache import LRUCache
+from config import STORAGE_BACKEND, SQLITE_PATH
+
+# Сколько текстов анализов держать в локальном кэше процесса
+ANALYSIS_TEXT_CACHE_SIZE = 256
+
+# Поля сегмента аудитории: язык ('ru', 'en') и наличие попыток (True/False)
+AUDIENCE_FACETS = ('language', 'has_attempts')
+
+
+class StorageManager(ABC):
+    """Общий интерфейс хранилища данных бота"""
+
+    @abstractmethod
+    def get_user_attempts(self, user_id: int) -> int:
+        """Получение количества оставшихся попыток пользователя (новый пользователь получает 1 попытку)"""
+
+    @abstractmethod
+    def decrease_attempts(self, user_id: int) -> int:
+        """Уменьшение количества попыток"""
+
+    @abstractmethod
+    def add_attempts(self, user_id: int, amount: int = 10):
+        """Добавление попыток после оплаты"""
+
+    @abstractmethod
+    def reserve_attempts(self, user_id: int, count: int) -> int:
+        """Списание count попыток одной операцией; остаток попыток или None, если попыток не хватает"""
+
+    @abstractmethod
+    def refund_attempts(self, user_id: int, count: int):
+        """Возврат списанных, но не использованных попыток"""
+
+    @abstractmethod
+    def get_user_stats(self, user_id: int) -> dict:
+        """Получение статистики пользователя"""
+
+    @abstractmethod
+    def add_referral(self, referrer_id: int, referred_id: int):
+        """Добавление реферала и начисление бонуса"""
+
+    @abstractmethod
+    def get_referral_count(self, user_id: int) -> int:
+        """Получение количества рефералов пользователя"""
+
+    @abstractmethod
+    def touch_user(self, user_id: int):
+        """Обновление времени последней активности пользователя"""
+
+    @abstractmethod
+    def iter_inactive_users(self, days: int = 7, page_size: int = 500):
+        """Постраничный обход неактивных пользователей"""
+
+    def get_inactive_users(self, days: int = 7) -> list:
+        """Получение списка неактивных пользователей"""
+        return list(self.iter_inactive_users(days))
+
+    @abstractmethod
+    def backfill_last_activity(self) -> int:
+        """Заполнение last_activity для пользователей, созданных до появления поля"""
+
+    @abstractmethod
+    def get_admin_stats(self) -> dict:
+        """Получение общей статистики для администраторов"""
+
+    @abstractmethod
+    def save_feedback(self, user_id: int, feedback_text: str):
+        """Сохранение отзыва пользователя"""
+
+    @abstractmethod
+    def set_user_language(self, user_id: int, language: str):
+        """Установка языка пользователя"""
+
+    @abstractmethod
+    def get_user_language(self, user_id: int) -> str:
+        """Получение языка пользователя"""
+
+    @abstractmethod
+    def get_last_analysis(self, user_id: int) -> dict:
+        """Получение последнего анализа пользователя"""
+
+    @abstractmethod
+    def save_analysis(self, user_id: int, sku: str, item_name: str, analysis_text: str):
+        """Сохранение результатов анализа"""
+
+    @abstractmethod
+    def get_fresh_analysis(self, sku: str, max_age_hours: int) -> dict:
+        """Самый свежий анализ артикула не старше max_age_hours (от любого пользователя)"""
+
+    @abstractmethod
+    def _load_analysis_text(self, text_hash: str) -> str:
+        """Чтение текста анализа по хэшу содержимого"""
+
+    @abstractmethod
+    def _save_analysis_text(self, text_hash: str, analysis_text: str):
+        """Запись текста анализа под хэшем содержимого (повторная запись ничего не меняет)"""
+
+    @property
+    def _analysis_text_cache(self) -> LRUCache:
+        if not hasattr(self, '_text_cache'):
+            self._text_cache = LRUCache(ANALYSIS_TEXT_CACHE_SIZE)
+        return self._text_cache
+
+    def _store_analysis_text(self, analysis_text: str) -> str:
+        """Сохранение текста анализа один раз; возвращает его хэш"""
+        text_hash = hashlib.sha256(analysis_text.encode('utf-8')).hexdigest()
+        if text_hash not in self._analysis_text_cache:
+            self._save_analysis_text(text_hash, analysis_text)
+            self._analysis_text_cache.set(text_hash, analysis_text)
+        return text_hash
+
+    def _resolve_analysis_text(self, data: dict) -> dict:
+        """Подстановка текста анализа по хэшу (старые записи хранят текст целиком)"""
+        if data and not data.get('analysis_text') and data.get('text_hash'):
+            text_hash = data['text_hash']
+            analysis_text = self._analysis_text_cache.get(text_hash)
+            if analysis_text is None:
+                analysis_text = self._load_analysis_text(text_hash)
+                if analysis_text is not None:
+                    self._analysis_text_cache.set(text_hash, analysis_text)
+            data['analysis_text'] = analysis_text
+        return data
+
+    @abstractmethod
+    def get_all_users(self) -> list:
+        """Получение списка всех пользователей"""
+
+    @abstractmethod
+    def record_payment(self, user_id: int, amount: float, plan: str):
+        """Запись информации о платеже"""
+
+    @abstractmethod
+    def mark_update_seen(self, update_id: int) -> bool:
+        """Отметка update_id как обработанного; False, если он уже был отмечен"""
+
+    @abstractmethod
+    def forget_update_seen(self, update_id: int):
+        """Снятие отметки update_id, если апдейт не удалось принять в обработку"""
+
+    @abstractmethod
+    def record_send_outcome(self, user_id: int, outcome: str):
+        """Запись исхода отправки в профиль; 'blocked' исключает пользователя из аудитории"""
+
+    @abstractmethod
+    def backfill_audience_index(self) -> int:
+        """Однократное заполнение полей индекса аудитории у существующих пользователей"""
+
+    @abstractmethod
+    def count_audience(self, segment: dict = None) -> int:
+        """Количество доступных пользователей в сегменте (ключи из AUDIENCE_FACETS)"""
+
+    @abstractmethod
+    def get_audience_page(self, after_user_id: int = None, limit: int = 500, segment: dict = None) -> list:
+        """Страница user_id доступных пользователей сегмента по возрастанию, после after_user_id"""
+
+    @abstractmethod
+    def create_broadcast_job(self, text: str, total: int, chat_id: int, message_id: int,
+                             segment: dict = None) -> str:
+        """Создание задачи рассылки; возвращает ее идентификатор"""
+
+    @abstractmethod
+    def get_broadcast_job(self, job_id: str) -> dict:
+        """Получение задачи рассылки"""
+
+    @abstractmethod
+    def get_broadcast_jobs(self, statuses: list) -> list:
+        """Задачи рассылки с указанными статусами"""
+
+    @abstractmethod
+    def update_broadcast_job(self, job_id: str, fields: dict, owner: str = None) -> bool:
+        """Обновление полей задачи рассылки (статус, курсор, счетчики, аренда)
+
+        С owner поля записываются, только пока аренда задачи принадлежит owner;
+        возвращает False, если задачу перехватил другой процесс.
+        """
+
+    @abstractmethod
+    def claim_broadcast_job(self, job_id: str, owner: str, lease_seconds: int) -> bool:
+        """Захват задачи процессом owner, если ее аренда свободна или истекла"""
+
+    @abstractmethod
+    def record_broadcast_recipient(self, job_id: str, user_id: int, outcome: str):
+        """Запись исхода отправки одному получателю"""
+
+    @abstractmethod
+    def get_broadcast_recipients(self, job_id: str, user_ids: list) -> dict:
+        """Исходы отправки для указанных получателей: user_id -> outcome"""
+
+    @abstractmethod
+    def increment_sku_requests(self, sku: str):
+        """Увеличение дневного счетчика запросов анализа артикула"""
+
+    @abstractmethod
+    def get_popular_skus(self, days: int, limit: int) -> list:
+        """Самые запрашиваемые артикулы за последние days дней: [(sku, count)] по убыванию"""
+
+    @abstractmethod
+    def claim_lease(self, name: str, owner: str, lease_seconds: int) -> bool:
+        """Захват или продление именованной аренды (выбор лидера среди процессов)"""
+
+    @abstractmethod
+    def get_job_last_run(self, name: str) -> datetime:
+        """Время последнего запуска задачи планировщика (UTC) или None"""
+
+    @abstractmethod
+    def set_job_last_run(self, name: str, run_at: datetime):
+        """Сохранение времени последнего запуска задачи планировщика"""
+
+    @abstractmethod
+    def add_watch(self, user_id: int, sku: str, root_id: int, item_name: str) -> bool:
+        """Подписка пользователя на новые отзывы артикула; False, если подписка уже есть"""
+
+    @abstractmethod
+    def remove_watch(self, user_id: int, sku: str) -> bool:
+        """Отписка от артикула; артикул без подписчиков перестает отслеживаться"""
+
+    @abstractmethod
+    def get_user_watches(self, user_id: int) -> list:
+        """Артикулы, на которые подписан пользователь: [{'sku', 'item_name'}]"""
+
+    @abstractmethod
+    def iter_watched_skus(self, page_size: int = 500):
+        """Постраничный обход отслеживаемых артикулов
+
+        Элементы: sku, root_id, item_name, subscribers и отметка последнего опроса -
+        feedback_count, last_review_at, last_review_id (None до первого опроса).
+        """
+
+    @abstractmethod
+    def update_watch_marks(self, marks: dict):
+        """Сохранение отметок опроса: sku -> {'feedback_count', 'last_review_at', 'last_review_id'}"""
+
+    @abstractmethod
+    def get_attempts(self, user_id) -> int:
+        """Получение количества попыток без начисления стартовой попытки"""
+
+
+def create_storage_manager() -> StorageManager:
+    """Создание хранилища согласно STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_manager import SQLiteManager
+        return SQLiteManager(SQLITE_PATH)
+    if STORAGE_BACKEND == 'firebase':
+        from firebase_manager import FirebaseManager
+        return FirebaseManager()
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {STORAGE_BACKEND}")
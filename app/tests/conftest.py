@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+import itertools
+
+import pytest
+
+# Тесты запускаются из каталога app: python -m pytest tests
+# Бот работает на SQLite во временном каталоге, запросы к Telegram перехватываются
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+_data_dir = tempfile.mkdtemp(prefix='wbbot-tests-')
+os.environ['STORAGE_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = os.path.join(_data_dir, 'wbbot.sqlite3')
+os.environ['HISTORY_PATH'] = os.path.join(_data_dir, 'price_history.sqlite3')
+os.environ['BOT_TOKEN'] = '123456:TEST'
+os.environ['SCHEDULER_ENABLED'] = 'false'
+
+
+class FakeTelegram:
+    """Подмена apihelper._make_request: запоминает вызовы Bot API и отвечает правдоподобными данными"""
+
+    def __init__(self):
+        self.calls = []
+        self.files = {}
+        self._message_ids = itertools.count(1000)
+
+    def make_request(self, token, method_name, method='get', params=None, files=None):
+        params = dict(params or {})
+        self.calls.append((method_name, params))
+        if method_name in ('sendMessage', 'sendDocument', 'editMessageText'):
+            return {
+                'message_id': next(self._message_ids),
+                'date': 0,
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text')
+            }
+        if method_name == 'getFile':
+            return {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_path': params['file_id']}
+        return True
+
+    def download_file(self, token, file_path):
+        return self.files[file_path]
+
+    def texts(self, method_name='sendMessage') -> list:
+        return [params.get('text') for name, params in self.calls if name == method_name]
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    from telebot import apihelper
+
+    fake = FakeTelegram()
+    monkeypatch.setattr(apihelper, '_make_request', fake.make_request)
+    monkeypatch.setattr(apihelper, 'download_file', fake.download_file)
+    return fake
+
+
+_update_ids = itertools.count(1)
+
+
+def make_update(user_id: int, text: str = None, document: dict = None) -> dict:
+    """JSON апдейта Telegram с личным сообщением пользователя"""
+    message = {
+        'message_id': next(_update_ids),
+        'date': 0,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if document is not None:
+        message['document'] = document
+    return {'update_id': next(_update_ids), 'message': message}
+
+
+@pytest.fixture
+def bot_module(telegram):
+    import bot
+
+    yield bot
+    # Шаги диалогов не переходят в следующий тест
+    bot.bot.next_step_backend.handlers.clear()
+
+
+@pytest.fixture
+def dispatch(bot_module):
+    from telebot import types
+
+    def dispatch(*updates):
+        bot_module.bot.process_new_updates([types.Update.de_json(update) for update in updates])
+
+    return dispatch
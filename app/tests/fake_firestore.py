@@ -0,0 +1,332 @@
+import copy
+import functools
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_aggregation import AggregationResult
+
+# Клиент Firestore в памяти для проверок FirebaseManager без эмулятора.
+# Поддерживает то, чем пользуется FirebaseManager: документы и подколлекции,
+# create/set(merge)/update/delete, Increment, ArrayUnion, SERVER_TIMESTAMP, запросы
+# where/order_by/select/limit/start_after/count, get_all, пакеты и транзакции.
+# Транзакции оптимистичные, как в Firestore: если прочитанный документ изменился
+# до commit, commit бросает Aborted, и @firestore.transactional повторяет функцию.
+
+
+def _stored(value):
+    """Значение в том виде, в каком его вернет Firestore: datetime без зоны считается UTC"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    if isinstance(value, dict):
+        return {key: _stored(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stored(item) for item in value]
+    return value
+
+
+def _apply(data: dict, fields: dict, merge: bool):
+    for key, value in fields.items():
+        if value is transforms.SERVER_TIMESTAMP:
+            data[key] = datetime.now(timezone.utc)
+        elif value is transforms.DELETE_FIELD:
+            data.pop(key, None)
+        elif isinstance(value, transforms.Increment):
+            data[key] = data.get(key, 0) + value.value
+        elif isinstance(value, transforms.ArrayUnion):
+            current = list(data.get(key) or [])
+            data[key] = current + [item for item in _stored(value.values) if item not in current]
+        elif isinstance(value, transforms.ArrayRemove):
+            data[key] = [item for item in data.get(key) or [] if item not in _stored(value.values)]
+        elif isinstance(value, dict) and merge:
+            nested = data.get(key) if isinstance(data.get(key), dict) else {}
+            _apply(nested, value, merge)
+            data[key] = nested
+        elif isinstance(value, dict):
+            data[key] = {}
+            _apply(data[key], value, merge)
+        else:
+            data[key] = _stored(value)
+
+
+def _compare(left, right) -> int:
+    """Порядок значений: None раньше любых других, остальные сравниваются как есть"""
+    if left is None or right is None:
+        return (left is not None) - (right is not None)
+    return (left > right) - (left < right)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self._docs = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+        # Вызывается перед каждым commit транзакции: так тест имитирует конкурирующую запись
+        self.before_commit = None
+
+    def collection(self, name: str):
+        return CollectionReference(self, name)
+
+    def document(self, path: str):
+        return DocumentReference(self, path)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        return [reference.get(field_paths=field_paths, transaction=transaction) for reference in references]
+
+    def _read(self, path: str):
+        with self._lock:
+            return copy.deepcopy(self._docs.get(path)), self._versions.get(path, 0)
+
+    def _commit(self, writes: list, reads: dict = None):
+        """Все записи применяются атомарно или ни одна"""
+        with self._lock:
+            for path, version in (reads or {}).items():
+                if self._versions.get(path, 0) != version:
+                    raise Aborted(f"Document {path} changed since it was read")
+            exists = {path: path in self._docs for path, _, _, _ in writes}
+            for path, operation, _, _ in writes:
+                if operation == 'create' and exists[path]:
+                    raise AlreadyExists(f"Document already exists: {path}")
+                if operation == 'update' and not exists[path]:
+                    raise NotFound(f"No document to update: {path}")
+                exists[path] = operation != 'delete'
+            for path, operation, fields, merge in writes:
+                if operation == 'delete':
+                    self._docs.pop(path, None)
+                else:
+                    data = self._docs.get(path, {}) if operation == 'update' or merge else {}
+                    _apply(data, copy.deepcopy(fields), merge)
+                    self._docs[path] = data
+                self._versions[path] = self._versions.get(path, 0) + 1
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data: dict):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field: str):
+        return self._data.get(field)
+
+
+class DocumentReference:
+    def __init__(self, client: FakeFirestore, path: str):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit('/', 1)[-1]
+
+    def collection(self, name: str):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        data, version = self._client._read(self.path)
+        if transaction is not None:
+            transaction._reads.setdefault(self.path, version)
+        if data is not None and field_paths is not None:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        return DocumentSnapshot(self, data)
+
+    def create(self, document_data: dict):
+        self._client._commit([(self.path, 'create', document_data, False)])
+
+    def set(self, document_data: dict, merge: bool = False):
+        self._client._commit([(self.path, 'set', document_data, merge)])
+
+    def update(self, field_updates: dict):
+        self._client._commit([(self.path, 'update', field_updates, False)])
+
+    def delete(self):
+        self._client._commit([(self.path, 'delete', None, False)])
+
+
+class AggregateQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        return [[AggregationResult(alias='field_1', value=len(self._query._matching()))]]
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    OPERATORS = {
+        '==': lambda value, expected: value == expected,
+        '!=': lambda value, expected: value != expected,
+        '<': lambda value, expected: value is not None and value < expected,
+        '<=': lambda value, expected: value is not None and value <= expected,
+        '>': lambda value, expected: value is not None and value > expected,
+        '>=': lambda value, expected: value is not None and value >= expected,
+        'in': lambda value, expected: value in expected,
+        'array_contains': lambda value, expected: isinstance(value, list) and expected in value,
+    }
+
+    def __init__(self, client: FakeFirestore, path: str):
+        self._client = client
+        self._path = path
+        self._filters = []
+        self._orders = []
+        self._projection = None
+        self._limit = None
+        self._start_after = None
+
+    def _copy(self, **changes):
+        query = copy.copy(self)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, field_path: str, op_string: str, value):
+        return self._copy(_filters=self._filters + [(field_path, self.OPERATORS[op_string], _stored(value))])
+
+    def order_by(self, field_path: str, direction: str = ASCENDING):
+        return self._copy(_orders=self._orders + [(field_path, direction)])
+
+    def select(self, field_paths):
+        return self._copy(_projection=list(field_paths))
+
+    def limit(self, count: int):
+        return self._copy(_limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        if isinstance(document_fields_or_snapshot, DocumentSnapshot):
+            data = document_fields_or_snapshot.to_dict()
+            cursor = ([data.get(field) for field, _ in self._orders], document_fields_or_snapshot.id)
+        else:
+            cursor = ([_stored(document_fields_or_snapshot.get(field)) for field, _ in self._orders], None)
+        return self._copy(_start_after=cursor)
+
+    def count(self):
+        return AggregateQuery(self._copy(_limit=None, _start_after=None))
+
+    def _compare(self, left, right) -> int:
+        """Сравнение (значения полей order_by, id документа) с учетом направления сортировки"""
+        (left_values, left_id), (right_values, right_id) = left, right
+        for (_, direction), left_value, right_value in zip(self._orders, left_values, right_values):
+            result = _compare(left_value, right_value)
+            if result:
+                return -result if direction == self.DESCENDING else result
+        if left_id is None or right_id is None:
+            return 0
+        return _compare(left_id, right_id)
+
+    def _matching(self) -> list:
+        prefix = f"{self._path}/"
+        with self._client._lock:
+            documents = [
+                (path[len(prefix):], copy.deepcopy(data)) for path, data in self._client._docs.items()
+                if path.startswith(prefix) and '/' not in path[len(prefix):]
+            ]
+        # Документы без поля order_by в выборку не попадают, как в Firestore
+        documents = [
+            (doc_id, data) for doc_id, data in documents
+            if all(field in data for field, _ in self._orders)
+            and all(check(data.get(field), expected) for field, check, expected in self._filters)
+        ]
+        keyed = [(([data.get(field) for field, _ in self._orders], doc_id), doc_id, data) for doc_id, data in documents]
+        keyed.sort(key=functools.cmp_to_key(lambda left, right: self._compare(left[0], right[0])))
+        if self._start_after is not None:
+            keyed = [item for item in keyed if self._compare(item[0], self._start_after) > 0]
+        return [(doc_id, data) for _, doc_id, data in keyed]
+
+    def get(self, transaction=None):
+        documents = self._matching()[:self._limit]
+        snapshots = []
+        for doc_id, data in documents:
+            if self._projection is not None:
+                data = {key: value for key, value in data.items() if key in self._projection}
+            snapshots.append(DocumentSnapshot(DocumentReference(self._client, f"{self._path}/{doc_id}"), data))
+        return snapshots
+
+    def stream(self, transaction=None):
+        return iter(self.get(transaction=transaction))
+
+
+class CollectionReference(Query):
+    @property
+    def id(self) -> str:
+        return self._path.rsplit('/', 1)[-1]
+
+    def document(self, document_id: str = None):
+        return DocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data: dict, document_id: str = None):
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return datetime.now(timezone.utc), reference
+
+
+class WriteBatch:
+    def __init__(self, client: FakeFirestore):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data: dict):
+        self._writes.append((reference.path, 'create', document_data, False))
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        self._writes.append((reference.path, 'set', document_data, merge))
+
+    def update(self, reference, field_updates: dict):
+        self._writes.append((reference.path, 'update', field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append((reference.path, 'delete', None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+
+
+class Transaction(WriteBatch):
+    """Интерфейс, которым пользуется google.cloud.firestore.transactional"""
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, client: FakeFirestore):
+        super().__init__(client)
+        self._id = None
+        self._reads = {}
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        if self._client.before_commit:
+            self._client.before_commit()
+        try:
+            self._client._commit(self._writes, self._reads)
+        finally:
+            self._clean_up()
+
+    def _rollback(self):
+        self._clean_up()
@@ -0,0 +1,56 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from broadcast import BroadcastJob, RateLimitedSender, JOB_LOST
+from sqlite_manager import SQLiteManager
+
+
+class SlowBot:
+    """Бот, отправка через который занимает delay секунд; after_send вызывается после каждой"""
+
+    def __init__(self, delay: float, after_send=None):
+        self.delay = delay
+        self.after_send = after_send
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.delay)
+        self.sent.append(chat_id)
+        if self.after_send:
+            self.after_send(len(self.sent))
+
+
+def test_job_stops_when_lease_is_taken_mid_page(tmp_path):
+    storage = SQLiteManager(str(tmp_path / 'wbbot.sqlite3'))
+    user_ids = list(range(1001, 1031))
+    for user_id in user_ids:
+        storage.get_user_attempts(user_id)
+    storage.backfill_audience_index()
+    job_id = storage.create_broadcast_job('Новости', len(user_ids), chat_id=1, message_id=2)
+    assert storage.claim_broadcast_job(job_id, 'host-a', 3) is True
+
+    def take_over(sent_count):
+        # Процесс host-a "завис": его аренда истекла, и задачу забрал host-b
+        if sent_count == 3:
+            storage.update_broadcast_job(job_id, {'lease_until': datetime.now(timezone.utc) - timedelta(seconds=1)})
+            assert storage.claim_broadcast_job(job_id, 'host-b', 60) is True
+
+    bot = SlowBot(0.1, take_over)
+    results = []
+    job = BroadcastJob(
+        RateLimitedSender(bot, rate=100, workers=1, per_chat_interval=0), storage, job_id, 'host-a',
+        on_progress=None, on_done=lambda status, stats: results.append(status),
+        page_size=len(user_ids), lease_seconds=3
+    )
+    started = time.monotonic()
+    job.run()
+
+    # Продление аренды не прошло, и рассылка остановилась посреди страницы
+    assert results == [JOB_LOST]
+    assert len(bot.sent) < len(user_ids)
+    assert time.monotonic() - started < 2.5
+    # Курсор, счетчики и статус нового владельца не перезаписаны
+    stored = storage.get_broadcast_job(job_id)
+    assert (stored['status'], stored['lease_owner'], stored.get('cursor')) == ('running', 'host-b', None)
+    assert stored['sent'] == 0
+
@@ -0,0 +1,166 @@
+from conftest import make_update
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append((func, args))
+
+
+def test_batch_command_reaches_batch_handler(bot_module, dispatch, telegram, monkeypatch):
+    user_id = 470001
+    executor = RecordingExecutor()
+    monkeypatch.setattr(bot_module, '_batch_executor', executor)
+    bot_module.firebase_manager.add_attempts(user_id, 10)
+    attempts = bot_module.firebase_manager.get_user_attempts(user_id)
+
+    dispatch(make_update(user_id, '/batch'))
+
+    assert 'CSV или TXT' in telegram.texts()[-1]
+    assert 'Получено сообщение' not in ''.join(telegram.texts())
+
+    telegram.files['file-1'] = '12345678\nhttps://www.wildberries.ru/catalog/87654321/detail.aspx\n'.encode('utf-8')
+    dispatch(make_update(user_id, document={
+        'file_id': 'file-1', 'file_unique_id': 'file-1', 'file_name': 'skus.csv', 'file_size': 64
+    }))
+
+    assert len(executor.submitted) == 1
+    func, (chat_id, submitted_user, skus, _) = executor.submitted[0]
+    assert func is bot_module.run_batch
+    assert (chat_id, submitted_user, skus) == (user_id, user_id, ['12345678', '87654321'])
+    assert bot_module.firebase_manager.get_user_attempts(user_id) == attempts - 2
+    bot_module._running_batches.discard(user_id)
+
+
+def test_watch_commands_reach_watch_handlers(bot_module, dispatch, telegram, monkeypatch):
+    user_id = 480001
+    monkeypatch.setattr(bot_module, 'get_product_info', lambda sku: {
+        'sku': sku, 'root_id': 555, 'item_name': 'Кружка'
+    })
+
+    dispatch(make_update(user_id, '/watch 12345678'))
+    assert 'Подписка оформлена' in telegram.texts()[-1]
+    assert [watch['sku'] for watch in bot_module.firebase_manager.get_user_watches(user_id)] == ['12345678']
+
+    dispatch(make_update(user_id, '/watchlist'))
+    assert 'Кружка - 12345678' in telegram.texts()[-1]
+
+    dispatch(make_update(user_id, '/unwatch 12345678'))
+    assert 'отменена' in telegram.texts()[-1]
+    assert bot_module.firebase_manager.get_user_watches(user_id) == []
+
+    dispatch(make_update(user_id, '/watchlist'))
+    assert 'У вас нет подписок' in telegram.texts()[-1]
+    assert 'Получено сообщение' not in ''.join(telegram.texts())
+
+
+def test_history_command_reaches_history_handler(bot_module, dispatch, telegram):
+    user_id = 490001
+    bot_module.price_history.record('11223344', 125000, 4.7, 320)
+
+    dispatch(make_update(user_id, '/history 11223344'))
+    assert 'История товара' in telegram.texts()[-1]
+    assert 'Цена: 1250 ₽' in telegram.texts()[-1]
+
+    dispatch(make_update(user_id, '/history 99887766'))
+    assert 'Истории по товару 99887766 пока нет' in telegram.texts()[-1]
+    assert 'Получено сообщение' not in ''.join(telegram.texts())
+
+
+def comparison_material(sku):
+    if sku == '30000003':
+        raise ConnectionError('card.wb.ru is unavailable')
+    return {'sku': sku, 'item_name': f'Товар {sku}', 'analysis': f'Анализ {sku}', 'reviews': None}
+
+
+def test_compare_charges_only_compared_products(bot_module, dispatch, telegram, monkeypatch):
+    user_id = 460001
+    monkeypatch.setattr(bot_module, 'fetch_comparison_material', comparison_material)
+    bot_module.firebase_manager.add_attempts(user_id, 10)
+    attempts = bot_module.firebase_manager.get_user_attempts(user_id)
+
+    dispatch(make_update(user_id, '/compare 10000001 20000002 30000003'))
+
+    assert any('Сравнение товаров' in text for text in telegram.texts())
+    assert bot_module.firebase_manager.get_user_attempts(user_id) == attempts - 2
+
+
+def test_compare_refunds_attempts_when_comparison_fails(bot_module, dispatch, telegram, monkeypatch):
+    user_id = 460002
+    monkeypatch.setattr(bot_module, 'fetch_comparison_material', comparison_material)
+    monkeypatch.setattr(bot_module, 'compare_products', lambda products: 1 / 0)
+    bot_module.firebase_manager.add_attempts(user_id, 10)
+    attempts = bot_module.firebase_manager.get_user_attempts(user_id)
+
+    dispatch(make_update(user_id, '/compare 10000001 20000002'))
+
+    assert 'Попытки возвращены' in telegram.texts()[-1]
+    assert bot_module.firebase_manager.get_user_attempts(user_id) == attempts
+
+
+def test_long_message_is_split_on_lines_with_plain_text_fallback(bot_module, telegram, monkeypatch):
+    from telebot import apihelper
+
+    def make_request(token, method_name, method='get', params=None, files=None):
+        # Telegram отклоняет незакрытую разметку Markdown
+        if method_name == 'sendMessage' and params.get('parse_mode') and params['text'].count('*') % 2:
+            raise apihelper.ApiTelegramException(method_name, None, {
+                'ok': False, 'error_code': 400, 'description': "Bad Request: can't parse entities"
+            })
+        return telegram.make_request(token, method_name, method, params, files)
+
+    monkeypatch.setattr(apihelper, '_make_request', make_request)
+    lines = [f"*Строка {index}* " + 'x' * 90 for index in range(100)] + ['*незакрытая разметка']
+    bot_module.send_long_message(1, '\n'.join(lines))
+
+    sent = [params for name, params in telegram.calls if name == 'sendMessage']
+    assert all(len(params['text']) <= bot_module.MESSAGE_LIMIT for params in sent)
+    assert '\n'.join(params['text'] for params in sent) == '\n'.join(lines)
+    assert 'parse_mode' not in sent[-1]
+
+
+def test_activity_is_touched_once_per_interval(bot_module, dispatch, telegram, monkeypatch):
+    touched = []
+    monkeypatch.setattr(bot_module.firebase_manager, 'touch_user', touched.append)
+
+    dispatch(make_update(260001, '/help'), make_update(260001, '/help'), make_update(260002, '/help'))
+
+    assert touched == [260001, 260002]
+    assert bot_module._activity_touched.maxsize == 100000
+
+
+class CardResponse:
+    def __init__(self, products):
+        self.products = products
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'data': {'products': self.products}}
+
+
+def test_batch_marks_skus_of_failed_card_chunks_as_failed(bot_module, monkeypatch):
+    def get(url, **kwargs):
+        if '47000001' in url:
+            raise TimeoutError('card.wb.ru timed out')
+        return CardResponse([])
+
+    monkeypatch.setattr(bot_module, 'CARD_BATCH_SIZE', 1)
+    monkeypatch.setattr(bot_module.requests, 'get', get)
+
+    results = bot_module.collect_batch_results(['47000001', '47000002'], lambda results: None)
+
+    # Попытка за артикул из упавшей пачки возвращается, а не списывается как за ненайденный товар
+    assert results['47000001']['status'] == bot_module.BATCH_STATUS_FAILED
+    assert results['47000002']['status'] == bot_module.BATCH_STATUS_NOT_FOUND
+
+
+def test_sku_is_normalized_the_same_way_everywhere(bot_module):
+    assert bot_module.normalize_sku(' 012345678 ') == '012345678'
+    assert bot_module.normalize_sku('000') == '000'
+    assert bot_module.normalize_sku('https://www.wildberries.ru/catalog/012345678/detail.aspx') == '012345678'
+    assert bot_module.normalize_sku('кружка') is None
+    assert bot_module.parse_sku_list('012345678\n12345678') == ['012345678', '12345678']
@@ -0,0 +1,57 @@
+import time
+
+from scheduler import JobRunner, LEADER_LEASE
+from sqlite_manager import SQLiteManager
+
+
+class LosingLeaseStorage(SQLiteManager):
+    """SQLite, в котором аренду можно "перехватить": продления владельца перестают проходить"""
+
+    lease_taken = False
+
+    def claim_lease(self, name: str, owner: str, lease_seconds: int) -> bool:
+        if self.lease_taken:
+            return False
+        return super().claim_lease(name, owner, lease_seconds)
+
+
+def test_lease_is_renewed_while_job_runs(tmp_path):
+    storage = SQLiteManager(str(tmp_path / 'wbbot.sqlite3'))
+    runner = JobRunner(storage, owner='host-a', lease_seconds=2)
+    claims_by_other = []
+
+    def long_job(should_stop):
+        # Без продления аренда истекла бы через 2 секунды
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline:
+            claims_by_other.append(storage.claim_lease(LEADER_LEASE, 'host-b', 2))
+            time.sleep(0.5)
+        assert not should_stop()
+
+    runner.add_interval_job('long_job', 1, long_job)
+    runner.run_pending()
+
+    assert claims_by_other and not any(claims_by_other)
+    assert storage.get_job_last_run('long_job') is not None
+
+
+def test_job_stops_when_lease_is_lost(tmp_path):
+    storage = LosingLeaseStorage(str(tmp_path / 'wbbot.sqlite3'))
+    runner = JobRunner(storage, owner='host-a', lease_seconds=3)
+    stopped = []
+    later_jobs = []
+
+    def poll(should_stop):
+        storage.lease_taken = True
+        deadline = time.monotonic() + 5
+        while not should_stop() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stopped.append(should_stop())
+
+    runner.add_interval_job('poll_watchlist', 1, poll)
+    runner.add_interval_job('next_job', 1, lambda should_stop: later_jobs.append(True))
+    runner.run_pending()
+
+    assert stopped == [True]
+    # Следующие задачи выполнит новый лидер
+    assert later_jobs == []
@@ -0,0 +1,263 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+# Одни и те же проверки для обеих реализаций StorageManager.
+# SQLite работает во временном каталоге, FirebaseManager - на клиенте Firestore
+# в памяти (fake_firestore.py) и, если он запущен, на эмуляторе:
+#   gcloud emulators firestore start --host-port=127.0.0.1:8080
+#   FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python -m pytest tests
+EMULATOR_PROJECT = 'wbbot-test'
+
+
+def sqlite_storage(tmp_path):
+    from sqlite_manager import SQLiteManager
+
+    return SQLiteManager(str(tmp_path / 'wbbot.sqlite3'))
+
+
+def fake_firestore_storage(tmp_path):
+    from fake_firestore import FakeFirestore
+    from firebase_manager import FirebaseManager
+
+    return FirebaseManager(db=FakeFirestore())
+
+
+def firebase_storage(tmp_path):
+    host = os.environ.get('FIRESTORE_EMULATOR_HOST')
+    if not host:
+        pytest.skip('FIRESTORE_EMULATOR_HOST не задан: проверки Firestore выполняются только на эмуляторе')
+    from google.cloud import firestore
+    from firebase_manager import FirebaseManager
+
+    # Каждый тест начинается с пустой базы эмулятора
+    requests.delete(
+        f"http://{host}/emulator/v1/projects/{EMULATOR_PROJECT}/databases/(default)/documents",
+        timeout=10
+    ).raise_for_status()
+    return FirebaseManager(db=firestore.Client(project=EMULATOR_PROJECT))
+
+
+@pytest.fixture(params=[sqlite_storage, fake_firestore_storage, firebase_storage],
+                ids=['sqlite', 'firestore-fake', 'firebase'])
+def storage(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def set_last_activity(storage, user_id: int, last_activity: datetime):
+    """Перенос активности пользователя в прошлое в обход интерфейса хранилища"""
+    if hasattr(storage, 'db'):
+        storage.db.collection('users').document(str(user_id)).update({'last_activity': last_activity})
+        return
+    conn = storage._connect()
+    with conn:
+        conn.execute('UPDATE users SET last_activity = ? WHERE user_id = ?', (last_activity, user_id))
+
+
+def test_attempts_reserve_and_refund(storage):
+    assert storage.get_user_attempts(1) == 1
+    assert storage.decrease_attempts(1) == 0
+    assert storage.decrease_attempts(1) == 0
+
+    storage.add_attempts(1, 10)
+    assert storage.get_user_attempts(1) == 10
+    assert storage.reserve_attempts(1, 4) == 6
+    assert storage.reserve_attempts(1, 7) is None
+    assert storage.get_user_attempts(1) == 6
+
+    storage.refund_attempts(1, 4)
+    storage.refund_attempts(1, 0)
+    stats = storage.get_user_stats(1)
+    assert stats['attempts'] == 10
+    assert stats['total_attempts_used'] == 1
+    assert stats['total_purchased'] == 10
+
+
+def test_referrals(storage):
+    storage.get_user_attempts(10)
+    assert storage.get_referral_count(10) == 0
+
+    assert storage.add_referral(10, 11) is True
+    assert storage.add_referral(10, 11) is False
+    assert storage.add_referral(10, 12) is True
+
+    assert storage.get_referral_count(10) == 2
+    # Бонус 2 попытки за каждого приглашенного
+    assert storage.get_user_attempts(10) == 5
+
+
+def test_analyses(storage):
+    assert storage.get_last_analysis(20) is None
+    assert storage.get_fresh_analysis('12345678', 24) is None
+
+    storage.save_analysis(20, '12345678', 'Кружка', 'Анализ кружки')
+    storage.save_analysis(21, '87654321', 'Чайник', 'Анализ чайника')
+    # Тот же текст от другого пользователя хранится один раз и читается по хэшу
+    storage.save_analysis(21, '12345678', 'Кружка', 'Анализ кружки')
+
+    last = storage.get_last_analysis(20)
+    assert (last['sku'], last['item_name'], last['analysis_text']) == ('12345678', 'Кружка', 'Анализ кружки')
+    assert last['created_at_formatted']
+
+    fresh = storage.get_fresh_analysis('87654321', 24)
+    assert (fresh['item_name'], fresh['analysis_text']) == ('Чайник', 'Анализ чайника')
+    assert storage.get_fresh_analysis('11111111', 24) is None
+
+
+def test_update_dedup(storage):
+    assert storage.mark_update_seen(1000) is True
+    assert storage.mark_update_seen(1000) is False
+    assert storage.mark_update_seen(1001) is True
+
+    # Апдейт, который не удалось поставить в очередь, принимается при повторной доставке
+    storage.forget_update_seen(1000)
+    assert storage.mark_update_seen(1000) is True
+    storage.forget_update_seen(999)
+
+
+def test_leases_and_job_runs(storage):
+    assert storage.claim_lease('scheduler', 'host-a', 60) is True
+    assert storage.claim_lease('scheduler', 'host-b', 60) is False
+    # Владелец продлевает свою аренду
+    assert storage.claim_lease('scheduler', 'host-a', 60) is True
+    assert storage.claim_lease('other', 'host-b', 60) is True
+
+    # Истекшую аренду забирает другой процесс
+    assert storage.claim_lease('expired', 'host-a', -1) is True
+    assert storage.claim_lease('expired', 'host-b', 60) is True
+    assert storage.claim_lease('expired', 'host-a', 60) is False
+
+    assert storage.get_job_last_run('poll_watchlist') is None
+    run_at = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    storage.set_job_last_run('poll_watchlist', run_at)
+    assert storage.get_job_last_run('poll_watchlist') == run_at
+
+
+def test_audience_index(storage):
+    for user_id in (101, 102, 103, 104, 105):
+        storage.get_user_attempts(user_id)
+    storage.backfill_audience_index()
+    storage.set_user_language(102, 'en')
+    storage.reserve_attempts(103, 1)
+    storage.record_send_outcome(104, 'blocked')
+
+    assert storage.get_user_language(102) == 'en'
+    assert storage.count_audience() == 4
+    assert storage.count_audience({'language': 'en'}) == 1
+    assert storage.count_audience({'language': 'ru', 'has_attempts': True}) == 2
+    assert storage.get_audience_page(limit=2) == [101, 102]
+    assert storage.get_audience_page(after_user_id=102, limit=2) == [103, 105]
+    assert storage.get_audience_page(segment={'has_attempts': False}) == [103]
+
+    # Пользователь снова доступен после успешной отправки
+    storage.record_send_outcome(104, 'sent')
+    assert storage.count_audience() == 5
+
+
+def test_inactive_users_paging(storage):
+    now = datetime.now()
+    for user_id in (201, 202, 203, 204, 205):
+        storage.get_user_attempts(user_id)
+    for days, user_id in ((13, 203), (12, 201), (11, 204), (10, 205)):
+        set_last_activity(storage, user_id, now - timedelta(days=days))
+    storage.record_send_outcome(204, 'blocked')
+
+    inactive = list(storage.iter_inactive_users(days=7, page_size=2))
+    assert [user['user_id'] for user in inactive] == [203, 201, 205]
+    assert all('attempts' in user for user in inactive)
+    assert [user['user_id'] for user in storage.get_inactive_users(days=11)] == [203, 201]
+
+
+def test_implicitly_created_users_have_activity(storage):
+    # Пользователи, созданные не через get_user_attempts, тоже попадают в выборку неактивных
+    storage.get_attempts(211)
+    storage.add_attempts(212, 5)
+    storage.add_referral(213, 214)
+
+    inactive = {user['user_id'] for user in storage.iter_inactive_users(days=0)}
+    assert inactive == {211, 212, 213}
+
+
+def test_popular_skus(storage):
+    for sku in ('11111111', '22222222', '11111111', '33333333', '11111111', '22222222'):
+        storage.increment_sku_requests(sku)
+
+    assert storage.get_popular_skus(days=7, limit=2) == [('11111111', 3), ('22222222', 2)]
+    assert dict(storage.get_popular_skus(days=1, limit=10)) == {'11111111': 3, '22222222': 2, '33333333': 1}
+
+
+def test_watches(storage):
+    assert storage.add_watch(301, '11111111', 9, 'Кружка') is True
+    assert storage.add_watch(301, '11111111', 9, 'Кружка') is False
+    assert storage.add_watch(302, '11111111', 9, 'Кружка') is True
+    assert storage.add_watch(301, '22222222', 8, 'Чайник') is True
+
+    assert sorted(watch['sku'] for watch in storage.get_user_watches(301)) == ['11111111', '22222222']
+    assert storage.get_user_watches(302) == [{'sku': '11111111', 'item_name': 'Кружка'}]
+
+    watches = {watch['sku']: watch for watch in storage.iter_watched_skus(page_size=1)}
+    assert sorted(watches) == ['11111111', '22222222']
+    assert sorted(watches['11111111']['subscribers']) == [301, 302]
+    assert watches['11111111']['root_id'] == 9
+    assert watches['11111111']['last_review_at'] is None
+
+    storage.update_watch_marks({'11111111': {
+        'feedback_count': 42, 'last_review_at': '2026-01-02T03:04:05Z', 'last_review_id': 'fb1'
+    }})
+    watch = next(watch for watch in storage.iter_watched_skus() if watch['sku'] == '11111111')
+    assert (watch['feedback_count'], watch['last_review_at'], watch['last_review_id']) == (42, '2026-01-02T03:04:05Z', 'fb1')
+
+    assert storage.remove_watch(301, '22222222') is True
+    assert storage.remove_watch(301, '22222222') is False
+    # Артикул без подписчиков больше не опрашивается
+    assert [watch['sku'] for watch in storage.iter_watched_skus()] == ['11111111']
+
+
+def test_broadcast_jobs(storage):
+    job_id = storage.create_broadcast_job('Новости', 3, chat_id=1, message_id=2, segment={'language': 'en'})
+
+    job = storage.get_broadcast_job(job_id)
+    assert (job['job_id'], job['text'], job['status'], job['total']) == (job_id, 'Новости', 'running', 3)
+    assert job['segment'] == {'language': 'en'}
+    assert storage.get_broadcast_job('missing') is None
+    assert [job['job_id'] for job in storage.get_broadcast_jobs(['running'])] == [job_id]
+
+    storage.update_broadcast_job(job_id, {'status': 'paused', 'sent': 2, 'blocked': 1, 'cursor': 105})
+    job = storage.get_broadcast_job(job_id)
+    assert (job['status'], job['sent'], job['blocked'], job['cursor']) == ('paused', 2, 1, 105)
+    assert storage.get_broadcast_jobs(['running']) == []
+
+    assert storage.claim_broadcast_job(job_id, 'host-a', 60) is True
+    assert storage.claim_broadcast_job(job_id, 'host-b', 60) is False
+    assert storage.claim_broadcast_job(job_id, 'host-a', -1) is True
+    assert storage.claim_broadcast_job(job_id, 'host-b', 60) is True
+
+    # Курсор пишет только текущий владелец аренды
+    assert storage.update_broadcast_job(job_id, {'cursor': 201}, owner='host-b') is True
+    assert storage.update_broadcast_job(job_id, {'cursor': 301}, owner='host-a') is False
+    assert storage.get_broadcast_job(job_id)['cursor'] == 201
+
+    storage.record_broadcast_recipient(job_id, 101, 'sent')
+    storage.record_broadcast_recipient(job_id, 102, 'blocked')
+    assert storage.get_broadcast_recipients(job_id, [101, 102, 103]) == {101: 'sent', 102: 'blocked'}
+    assert storage.get_broadcast_recipients(job_id, []) == {}
+
+
+def test_firestore_transactions_retry_on_conflicting_write(tmp_path):
+    storage = fake_firestore_storage(tmp_path)
+    storage.add_attempts(1, 10)
+    user_ref = storage.db.collection('users').document('1')
+    conflicts = [lambda: user_ref.update({'attempts': 2})]
+
+    # Другой процесс списал попытки между чтением и commit: транзакция повторяется на свежих данных
+    storage.db.before_commit = lambda: conflicts and conflicts.pop()()
+    assert storage.reserve_attempts(1, 4) is None
+    assert storage.get_user_attempts(1) == 2
+
+    conflicts.append(lambda: storage.db.collection('leases').document('scheduler').set({
+        'owner': 'host-b', 'lease_until': datetime.now(timezone.utc) + timedelta(seconds=60)
+    }))
+    assert storage.claim_lease('scheduler', 'host-a', 60) is False
+    assert storage.claim_lease('scheduler', 'host-b', 60) is True
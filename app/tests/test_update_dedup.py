@@ -0,0 +1,17 @@
+from sqlite_manager import SQLiteManager
+from update_dedup import UpdateDeduplicator
+
+
+def test_forgotten_update_is_accepted_by_other_process(tmp_path):
+    storage = SQLiteManager(str(tmp_path / 'wbbot.sqlite3'))
+    first = UpdateDeduplicator(shared_store=storage)
+    second = UpdateDeduplicator(shared_store=storage)
+
+    assert first.is_new(7) is True
+    assert second.is_new(7) is False
+
+    # Очередь переполнена: апдейт не принят, Telegram доставит его повторно
+    first.forget(7)
+    assert second.is_new(7) is True
+    assert first.is_new(7) is False
+    assert (first.get_metrics()['duplicates_dropped'], second.get_metrics()['duplicates_dropped']) == (1, 1)
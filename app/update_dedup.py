@@ -0,0 +1,73 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Отбрасывание повторных доставок апдейтов по update_id"""
+
+    def __init__(self, window_seconds: int = 3600, maxsize: int = 100000, shared_store=None):
+        self.window_seconds = window_seconds
+        self.maxsize = maxsize
+        # Хранилище с mark_update_seen() для нескольких процессов-обработчиков
+        self.shared_store = shared_store
+        self.duplicates_dropped = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._seen:
+            update_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window_seconds and len(self._seen) <= self.maxsize:
+                break
+            self._seen.popitem(last=False)
+
+    def is_new(self, update_id: int) -> bool:
+        """True, если апдейт видим впервые; повторы считаются в duplicates_dropped"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if update_id in self._seen:
+                self.duplicates_dropped += 1
+                return False
+            self._seen[update_id] = now
+
+        if self.shared_store is not None:
+            try:
+                if not self.shared_store.mark_update_seen(update_id):
+                    # Локальная отметка не остается: если принявший апдейт процесс снимет
+                    # отметку (forget), повторная доставка сюда должна быть обработана
+                    with self._lock:
+                        self._seen.pop(update_id, None)
+                        self.duplicates_dropped += 1
+                    return False
+            except Exception as e:
+                # При недоступности общего хранилища лучше обработать апдейт, чем потерять его
+                logger.error(f"Error checking update {update_id} in shared store: {str(e)}")
+        return True
+
+    def forget(self, update_id: int):
+        """Снятие отметки, если апдейт не удалось принять в обработку
+
+        Отметка снимается и в общем хранилище: иначе повторную доставку этого
+        апдейта Telegram все процессы отбросили бы как дубликат.
+        """
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+        if self.shared_store is not None:
+            try:
+                self.shared_store.forget_update_seen(update_id)
+            except Exception as e:
+                logger.error(f"Error forgetting update {update_id} in shared store: {str(e)}")
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                'duplicates_dropped': self.duplicates_dropped,
+                'tracked_updates': len(self._seen),
+                'shared': self.shared_store is not None
+            }
@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """Очередь входящих апдейтов Telegram: упорядоченные дорожки по chat_id на общем пуле потоков
+
+    Апдейты одного чата обрабатываются строго по порядку (на этом держатся
+    register_next_step_handler-сценарии), разные чаты - параллельно.
+    """
+
+    def __init__(self, process, workers: int = 4, maxsize: int = 1000):
+        self._process = process
+        self.maxsize = maxsize
+        # chat_id -> очередь апдейтов; наличие ключа значит, что дорожка ждет потока или уже обрабатывается
+        self._lanes = {}
+        self._ready = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"update-worker-{i}", daemon=True)
+            thread.start()
+
+    @staticmethod
+    def _lane_key(update):
+        """Ключ дорожки: чат, к которому относится апдейт"""
+        message = update.message or update.edited_message
+        if message:
+            return message.chat.id
+        if update.callback_query:
+            if update.callback_query.message:
+                return update.callback_query.message.chat.id
+            return update.callback_query.from_user.id
+        if update.inline_query:
+            return update.inline_query.from_user.id
+        # Остальные типы апдейтов не требуют порядка
+        return ('update', update.update_id)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            return self._pending >= self.maxsize
+
+    def put(self, update) -> bool:
+        """Постановка апдейта в дорожку его чата; False, если очередь переполнена"""
+        key = self._lane_key(update)
+        with self._lock:
+            if self._pending >= self.maxsize:
+                self.rejected += 1
+                logger.warning(f"Update queue is full, rejecting update {update.update_id}")
+                return False
+            self._pending += 1
+            lane = self._lanes.get(key)
+            schedule = lane is None
+            if schedule:
+                lane = self._lanes[key] = deque()
+            lane.append((time.monotonic(), update))
+
+        if schedule:
+            self._ready.put(key)
+        return True
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            with self._lock:
+                enqueued_at, update = self._lanes[key].popleft()
+                self._pending -= 1
+                self._waits.append(time.monotonic() - enqueued_at)
+
+            try:
+                self._process([update])
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Error processing update {update.update_id}: {str(e)}", exc_info=True)
+
+            # По одному апдейту за раз, чтобы активный чат не занимал поток надолго
+            with self._lock:
+                reschedule = bool(self._lanes[key])
+                if not reschedule:
+                    del self._lanes[key]
+            if reschedule:
+                self._ready.put(key)
+
+    def get_metrics(self) -> dict:
+        """Глубина очереди и время ожидания апдейтов (по последним 1000)"""
+        with self._lock:
+            waits = sorted(self._waits)
+            metrics = {
+                'queue_depth': self._pending,
+                'active_lanes': len(self._lanes),
+                'workers': self.workers,
+                'processed': self.processed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+        if waits:
+            metrics['wait_ms_avg'] = round(sum(waits) / len(waits) * 1000, 2)
+            metrics['wait_ms_p50'] = round(waits[len(waits) // 2] * 1000, 2)
+            metrics['wait_ms_p99'] = round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 2)
+            metrics['wait_ms_max'] = round(waits[-1] * 1000, 2)
+        return metrics
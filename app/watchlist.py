@@ -0,0 +1,154 @@
+import logging
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+def review_key(feedback: dict) -> tuple:
+    """Ключ порядка отзывов: дата создания (ISO-строка WB), затем id"""
+    return (feedback.get('createdDate') or '', feedback.get('id') or '')
+
+
+class WatchlistMonitor:
+    """Инкрементальный опрос новых отзывов отслеживаемых артикулов
+
+    Карточки всех артикулов запрашиваются пачками (fetch_cards), и отзывы
+    загружаются только для root_id, у артикулов которого изменилось число
+    отзывов, - один раз на все варианты товара (fetch_feedbacks). Для каждого
+    артикула хранится отметка - дата и id последнего отзыва, поэтому при опросе
+    обрабатываются только отзывы новее отметки. Первый опрос артикула только
+    ставит отметку и ничего не отправляет.
+    """
+
+    def __init__(self, storage, fetch_cards, fetch_feedbacks, build_messages, sender,
+                 workers: int = 4, page_size: int = 500, negative_rating: int = 2):
+        self.storage = storage
+        # fetch_cards(skus) -> {sku: {'root_id', 'item_name', 'feedback_count'}}
+        self.fetch_cards = fetch_cards
+        # fetch_feedbacks(root_id, sku, item_name) -> ответ feedbacks.wb.ru
+        self.fetch_feedbacks = fetch_feedbacks
+        # build_messages(watch, reviews) -> [(chat_id, text, kwargs)]
+        self.build_messages = build_messages
+        self.sender = sender
+        self.workers = workers
+        self.page_size = page_size
+        self.negative_rating = negative_rating
+
+    def _pages(self):
+        watches = self.storage.iter_watched_skus(self.page_size)
+        while True:
+            page = list(islice(watches, self.page_size))
+            if not page:
+                return
+            yield page
+
+    def _changed_roots(self, executor, should_stop) -> dict:
+        """root_id -> отслеживаемые артикулы, у которых изменилось число отзывов или нет отметки"""
+        changed = {}
+        pending = {}
+
+        def collect(future):
+            page = pending.pop(future)
+            try:
+                cards = future.result()
+            except Exception as e:
+                logger.warning(f"Watchlist card lookup failed for {len(page)} SKUs: {str(e)}")
+                return
+            for watch in page:
+                card = cards.get(watch['sku'])
+                if not card:
+                    continue
+                if watch.get('last_review_at') is None or card.get('feedback_count') != watch.get('feedback_count'):
+                    watch['feedback_count'] = card.get('feedback_count')
+                    changed.setdefault(watch['root_id'], []).append(watch)
+
+        # Не больше workers страниц карточек в работе одновременно
+        for page in self._pages():
+            if should_stop():
+                break
+            if len(pending) >= self.workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            pending[executor.submit(self.fetch_cards, [watch['sku'] for watch in page])] = page
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+        return changed
+
+    def _process_root(self, watches: list, feedbacks: dict, marks: dict, messages: list):
+        """Новые отзывы каждого артикула root_id относительно его отметки"""
+        for watch in watches:
+            own = [feedback for feedback in feedbacks.get('feedbacks') or []
+                   if str(feedback.get('nmId')) == watch['sku']]
+            # Пустая строка - отметка поставлена, но отзывов у артикула еще нет
+            mark = (watch.get('last_review_at') or '', watch.get('last_review_id') or '')
+            last_review_at, last_review_id = max([mark] + [review_key(feedback) for feedback in own])
+            marks[watch['sku']] = {
+                'feedback_count': watch['feedback_count'],
+                'last_review_at': last_review_at,
+                'last_review_id': last_review_id
+            }
+
+            if watch.get('last_review_at') is None or not watch.get('subscribers'):
+                continue
+            negative = sorted(
+                (feedback for feedback in own
+                 if review_key(feedback) > mark and (feedback.get('productValuation') or 5) <= self.negative_rating),
+                key=review_key, reverse=True
+            )
+            if negative:
+                messages.extend(self.build_messages(watch, negative))
+
+    def poll(self, should_stop=None) -> dict:
+        """Один опрос всех отслеживаемых артикулов; возвращает статистику опроса
+
+        should_stop() прерывает опрос: уже обработанные артикулы сохраняют отметки
+        и отправляют уведомления, остальные будут опрошены в следующий раз.
+        """
+        should_stop = should_stop or (lambda: False)
+        marks = {}
+        messages = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='watchlist') as executor:
+            changed = self._changed_roots(executor, should_stop)
+            futures = {
+                executor.submit(self.fetch_feedbacks, root_id, watches[0]['sku'], watches[0].get('item_name')): root_id
+                for root_id, watches in changed.items()
+            }
+            while futures:
+                if should_stop():
+                    for future in futures:
+                        future.cancel()
+                    logger.warning(f"Watchlist poll stopped, {len(futures)} roots left for the next poll")
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    root_id = futures.pop(future)
+                    try:
+                        feedbacks = future.result()
+                    except Exception as e:
+                        logger.warning(f"Watchlist feedback fetch failed for root {root_id}: {str(e)}")
+                        feedbacks = None
+                    if not feedbacks:
+                        # Отметки не меняются: root_id будет опрошен снова в следующий раз
+                        continue
+                    self._process_root(changed[root_id], feedbacks, marks, messages)
+
+                # Отметки сохраняются по мере обработки, чтобы прерванный опрос не начинался с нуля
+                if len(marks) >= self.page_size:
+                    self.storage.update_watch_marks(marks)
+                    marks = {}
+
+        if marks:
+            self.storage.update_watch_marks(marks)
+        counts = self.sender.send_many(messages) if messages else {}
+        stats = {
+            'changed_roots': len(changed),
+            'changed_skus': sum(len(watches) for watches in changed.values()),
+            'notifications': len(messages),
+            'sent': counts
+        }
+        logger.info(f"Watchlist poll: {stats}")
+        return stats
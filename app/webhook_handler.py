@@ -1,10 +1,14 @@
 from flask import Flask, request, jsonify, redirect, render_template
 from flask_cors import CORS  # Добавляем импорт CORS
-from bot import bot, firebase_manager, payment_manager
-from config import BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_URL_BASE, WEBHOOK_URL_PATH
+from bot import bot, firebase_manager, payment_manager, get_bot_info, start_broadcast_watchdog
+from config import BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_URL_BASE, WEBHOOK_URL_PATH, UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_SHARED
+from update_queue import UpdateQueue
+from update_dedup import UpdateDeduplicator
+from scheduler import start_scheduler
 import telebot
 import os
 import logging
+from logging_config import setup_logging, sample_request_log
 from pathlib import Path  # Добавим для лучшей работы с путями
 from importlib import reload
 import config
@@ -13,10 +17,7 @@ import config
 reload(config)
 
 # Настраиваем более подробное логирование
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Получаем абсолютный путь к текущей директории
@@ -187,17 +188,38 @@ app.config.update(
 WEBHOOK_URL_BASE = WEBHOOK_HOST
 WEBHOOK_URL_PATH = WEBHOOK_PATH
 
+# Апдейты обрабатываются в фоне, webhook сразу отвечает Telegram
+update_queue = UpdateQueue(bot.process_new_updates, workers=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE)
+
+# Повторные доставки одного update_id отбрасываются до постановки в очередь
+update_dedup = UpdateDeduplicator(
+    window_seconds=UPDATE_DEDUP_WINDOW,
+    shared_store=firebase_manager if UPDATE_DEDUP_SHARED else None
+)
+
+# Получаем данные бота при старте, дальше они берутся из кэша
+try:
+    get_bot_info()
+except Exception as e:
+    logger.error(f"Error fetching bot info at startup: {str(e)}")
+
+# Продолжаем рассылки, прерванные перезапуском
+start_broadcast_watchdog()
+
+# Планировщик запускается в каждом процессе, задачи выполняет только лидер
+start_scheduler()
+
 @app.before_request
 def log_request_info():
-    """Логируем информацию о каждом запросе"""
-    logger.info('Headers: %s', request.headers)
-    logger.info('Body: %s', request.get_data())
-    logger.info('Path: %s', request.path)
+    """Выборочно логируем запросы: без тела и заголовков, токен в пути маскируется"""
+    if logger.isEnabledFor(logging.DEBUG) and sample_request_log():
+        logger.debug('Request %s %s', request.method, request.path,
+                     extra={'method': request.method, 'path': request.path})
 
 @app.route('/')
 def index():
     """Корневой маршрут"""
-    logger.info("Accessing root route")
+    logger.debug("Accessing root route")
     return "WB Review Bot is running!"
 
 @app.route('/test')
@@ -208,7 +230,7 @@ def test():
         logger.debug(f"Template folder: {app.template_folder}")
         logger.debug(f"Available templates: {os.listdir(template_dir)}")
         
-        bot_info = bot.get_me()
+        bot_info = get_bot_info()
         logger.debug(f"Bot info: {bot_info}")
         
         return render_template(
@@ -224,17 +246,19 @@ def test():
 def status():
     """Проверка статуса сервера"""
     try:
-        bot_info = bot.get_me()
+        bot_info = get_bot_info()
         response = {
             'status': 'ok',
             'bot_username': bot_info.username,
             'server': 'running',
             'bot_token_length': len(BOT_TOKEN),
             'webhook_host': WEBHOOK_HOST,
+            'update_queue': update_queue.get_metrics(),
+            'update_dedup': update_dedup.get_metrics(),
             'template_dir_exists': os.path.exists(template_dir),
             'templates': os.listdir(template_dir) if os.path.exists(template_dir) else []
         }
-        logger.info(f"Status check: {response}")
+        logger.debug('Status check: %s', response)
         return jsonify(response)
     except Exception as e:
         logger.error(f"Status check error: {str(e)}")
@@ -244,13 +268,28 @@ def status():
             'template_dir': template_dir
         }), 500
 
+@app.route('/metrics')
+def metrics():
+    """Метрики очереди апдейтов"""
+    return jsonify({
+        'update_queue': update_queue.get_metrics(),
+        'update_dedup': update_dedup.get_metrics()
+    })
+
 @app.route(WEBHOOK_PATH, methods=['POST'])
 def webhook():
-    logger.info(f"Received webhook request: {request.get_data().decode('utf-8')}")
     if request.headers.get('content-type') == 'application/json':
         json_string = request.get_data().decode('utf-8')
         update = telebot.types.Update.de_json(json_string)
-        bot.process_new_updates([update])
+        logger.debug('Received update %s', update.update_id, extra={'update_id': update.update_id})
+        if update_queue.is_full():
+            # Telegram повторит доставку позже
+            return jsonify({'status': 'busy'}), 503
+        if not update_dedup.is_new(update.update_id):
+            return jsonify({'status': 'ok'})
+        if not update_queue.put(update):
+            update_dedup.forget(update.update_id)
+            return jsonify({'status': 'busy'}), 503
         return jsonify({'status': 'ok'})
     else:
         return jsonify({'status': 'error', 'message': 'Invalid content type'})
@@ -321,7 +360,7 @@ def payment_success():
                     logger.error(f"Error sending payment notification: {str(e)}")
                 
                 # Перенаправляем на страницу успешной оплаты
-                return render_template('payment_success.html', bot_username=bot.get_me().username)
+                return render_template('payment_success.html', bot_username=get_bot_info().username)
             
         except Exception as e:
             logger.error(f"Error processing payment: {str(e)}")
@@ -337,7 +376,7 @@ def not_found_error(error):
         'error.html',
         error_code=404,
         error_message="Страница не найдена",
-        bot_username=bot.get_me().username
+        bot_username=get_bot_info().username
     ), 404
 
 # Добавим тестовый маршрут для проверки шаблонов